@@ -0,0 +1,348 @@
+"""Single-pass /analytics engine over the patient tables.
+
+The summary tables (summaries.py) answer /analytics from counters that
+triggers keep current. This engine computes the same payload straight
+from the data. It does not run one GROUP BY per chart over the
+PatientCondition / Patient join. Instead it reads two cursors in
+patient_id order, in batches of fetchmany():
+
+  Patient LEFT JOIN PatientCondition   (one row per patient and condition)
+  PatientHospital                      (merged in by patient_id)
+
+It fills the counters of every condition, blood type, age and hospital
+chart in that one pass. Both are read in primary key order, so no
+temporary B-tree is needed. Vaccine uptake, the only chart over
+PatientImmunization, is one GROUP BY of its own. Set
+HEALTHCARE_ANALYTICS_MODE=scan to serve /analytics this way, e.g. while
+the summary tables are being rebuilt or when they are not installed.
+
+    python analytics_engine.py [path/to/db.sqlite]
+
+times both modes on a database and reports any chart where they differ.
+"""
+import sqlite3
+from bisect import bisect_right
+from collections import Counter
+from datetime import date
+from itertools import compress
+from operator import itemgetter, ne
+
+# rows per fetchmany() call
+BATCH_SIZE = 5000
+
+AGE_BINS = ("0-17", "18-34", "35-49", "50-64", "65+")
+
+
+# -------------------------------
+# STREAMS
+# -------------------------------
+def _batches(conn, sql, batch_size):
+    cursor = conn.execute(sql)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+class _Merge:
+    # A (patient_id, value) stream sorted by patient_id, read alongside the
+    # main scan: through(last) returns {patient_id: [values]} for every
+    # patient up to and including `last` not handed out yet.
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.rows = []
+        self.at = 0
+
+    def through(self, last):
+        values = {}
+        while True:
+            if self.at == len(self.rows):
+                self.rows = next(self.batches, None)
+                self.at = 0
+                if self.rows is None:
+                    self.rows = []
+                    return values
+            end = bisect_right(self.rows, last, self.at, key=itemgetter(0))
+            for patient_id, value in self.rows[self.at:end]:
+                if patient_id in values:
+                    values[patient_id].append(value)
+                else:
+                    values[patient_id] = [value]
+            self.at = end
+            if end < len(self.rows):
+                return values
+
+
+def _names(conn, table, id_column):
+    return dict(conn.execute(f"SELECT {id_column}, name FROM {table}"))
+
+
+# -------------------------------
+# ONE PASS
+# -------------------------------
+def scan(conn, batch_size=BATCH_SIZE):
+    # The raw counters, keyed by ids and column values, for payload().
+    # Each batch is turned into columns and counted with Counter.update,
+    # which runs in C; only the hospital pairs need a Python loop.
+    patients = _batches(conn, '''
+        SELECT p.patient_id, p.gender, p.blood_type, p.birth_year, pc.condition_id
+        FROM Patient p
+        LEFT JOIN PatientCondition pc ON pc.patient_id = p.patient_id
+        ORDER BY p.patient_id
+    ''', batch_size)
+    hospitals = _Merge(_batches(conn, '''
+        SELECT patient_id, hospital_id FROM PatientHospital ORDER BY patient_id
+    ''', batch_size))
+
+    blood = Counter()               # blood_type -> patients
+    birth_years = Counter()         # birth_year -> patients
+    condition_years = Counter()     # (condition_id, birth_year) -> patients
+    condition_gender = Counter()    # (condition_id, gender) -> patients
+    condition_blood = Counter()     # (condition_id, blood_type) -> patients
+    hospital_condition = Counter()  # (hospital_id, condition_id) -> patients
+
+    previous = None
+    carried = {}  # hospitals of the previous batch's last patient
+    for rows in patients:
+        pids, genders, bloods, years, cids = zip(*rows)
+        # a patient with several conditions spans several rows; only its
+        # first one counts towards the per-patient charts
+        first = list(map(ne, pids, (previous,) + pids[:-1]))
+        previous = pids[-1]
+        blood.update(compress(bloods, first))
+        birth_years.update(compress(years, first))
+        condition_years.update(zip(cids, years))
+        condition_gender.update(zip(cids, genders))
+        condition_blood.update(zip(cids, bloods))
+
+        # ... and its rows can run on into the next batch
+        patient_hospitals = hospitals.through(previous)
+        patient_hospitals.update(carried)
+        carried = {previous: patient_hospitals[previous]} if previous in patient_hospitals else {}
+        if patient_hospitals:
+            hospital_condition.update(
+                (hospital_id, condition_id)
+                for pid, condition_id in zip(pids, cids)
+                if condition_id is not None and pid in patient_hospitals
+                for hospital_id in patient_hospitals[pid]
+            )
+
+    # rows from the LEFT JOIN of patients without a condition
+    for counts in (condition_years, condition_gender, condition_blood):
+        for key in [key for key in counts if key[0] is None]:
+            del counts[key]
+    birth_years.pop(None, None)
+
+    condition = {}  # condition_id -> [patients, birth_year_sum, birth_year_count]
+    for (condition_id, birth_year), total in condition_years.items():
+        totals = condition.setdefault(condition_id, [0, 0, 0])
+        totals[0] += total
+        if birth_year is not None:
+            totals[1] += birth_year * total
+            totals[2] += total
+
+    # (vaccine_id, doses, patients)
+    vaccines = conn.execute('''
+        SELECT vaccine_id, COUNT(*), COUNT(DISTINCT patient_id)
+        FROM PatientImmunization
+        GROUP BY vaccine_id
+    ''').fetchall()
+
+    return dict(
+        blood=blood,
+        birth_years=birth_years,
+        condition=condition,
+        condition_gender=condition_gender,
+        condition_blood=condition_blood,
+        hospital_condition=hospital_condition,
+        vaccines=vaccines,
+    )
+
+
+# -------------------------------
+# PAYLOAD
+# -------------------------------
+def _top_per_group(counts):
+    # {group: (value, total)}: the value with the largest count in each
+    # group of {(group, value): total}; ties go to the smallest value,
+    # NULL first, as the summary queries read them in index order
+    best = {}
+    for (group, value), total in counts.items():
+        held = best.get(group)
+        if held is None or (-total, _nulls_first(value)) < (-held[1], _nulls_first(held[0])):
+            best[group] = (value, total)
+    return best
+
+
+def _nulls_first(value):
+    return (value is not None, value or "")
+
+
+def _largest_first(items):
+    # (id, ..., total) tuples by total, ties in id order like the SQL sorts
+    return sorted(sorted(items), key=lambda item: -item[-1])
+
+
+def compute(conn, batch_size=BATCH_SIZE, today=None):
+    # The template variables of analytics.html, as app.analytics_payload
+    # builds them from the summary tables.
+    return payload(conn, scan(conn, batch_size), today)
+
+
+def payload(conn, counts, today=None):
+    # The page built from scan()'s counters (or anything producing the
+    # same ones, such as cohort_store.CohortStore.counts()).
+    conditions = _names(conn, '"Condition"', "condition_id")
+    vaccine_names = _names(conn, "Vaccine", "vaccine_id")
+    hospitals = _names(conn, "Hospital", "hospital_id")
+    current_year = (today or date.today()).year
+
+    condition = {cid: totals for cid, totals in counts["condition"].items() if cid in conditions}
+    cond_rows = _largest_first((cid, totals[0]) for cid, totals in condition.items())
+    common_condition = (conditions[cond_rows[0][0]], cond_rows[0][1]) if cond_rows else None
+    cond_rows = cond_rows[:5]
+
+    common_blood = None
+    if counts["blood"]:
+        blood_type = min(counts["blood"], key=lambda b: (-counts["blood"][b], _nulls_first(b)))
+        common_blood = (blood_type, counts["blood"][blood_type])
+
+    vaccines = [row for row in counts["vaccines"] if row[0] in vaccine_names]
+    common_vaccine = None
+    if vaccines:
+        vid, doses = _largest_first((vid, doses) for vid, doses, _ in vaccines)[0]
+        common_vaccine = (vaccine_names[vid], doses)
+    vaccine_rows = _largest_first((vid, patients) for vid, _, patients in vaccines)
+
+    def top_per_condition(counts, column):
+        best = _top_per_group(counts)
+        return [
+            {"condition_name": conditions[cid], column: value, "total": total}
+            for cid, value, total in _largest_first(
+                (cid, value, total) for cid, (value, total) in best.items() if cid in conditions
+            )
+        ]
+
+    gender_top = top_per_condition(counts["condition_gender"], "gender")
+    blood_top = top_per_condition(counts["condition_blood"], "blood_type")
+
+    # grouped by hospital name, like the summary query's PARTITION BY
+    best = _top_per_group({
+        (hospitals[hid], (hid, cid)): total
+        for (hid, cid), total in counts["hospital_condition"].items()
+        if hid in hospitals and cid in conditions
+    })
+    hospital_top = [
+        {"hospital_name": name, "condition_name": conditions[cid], "total": total}
+        for name, ((_, cid), total) in sorted(best.items())
+    ]
+
+    age_bins = dict.fromkeys(AGE_BINS, 0)
+    for birth_year, total in counts["birth_years"].items():
+        if not birth_year:
+            continue
+        age = current_year - birth_year
+        if age <= 17:
+            age_bins["0-17"] += total
+        elif age <= 34:
+            age_bins["18-34"] += total
+        elif age <= 49:
+            age_bins["35-49"] += total
+        elif age <= 64:
+            age_bins["50-64"] += total
+        else:
+            age_bins["65+"] += total
+
+    avg_age = _largest_first(
+        (cid, current_year - year_sum / year_count)
+        for cid, (_, year_sum, year_count) in condition.items() if year_count
+    )
+
+    return dict(
+        common_condition=common_condition,
+        common_blood=common_blood,
+        common_vaccine=common_vaccine,
+        cond_labels=[conditions[cid] for cid, _ in cond_rows],
+        cond_values=[total for _, total in cond_rows],
+        gender_top=gender_top,
+        blood_top=blood_top,
+        vaccine_labels=[vaccine_names[vid] for vid, _ in vaccine_rows],
+        vaccine_values=[total for _, total in vaccine_rows],
+        age_labels=list(age_bins),
+        age_values=list(age_bins.values()),
+        avg_age_labels=[conditions[cid] for cid, _ in avg_age],
+        avg_age_values=[round(value, 1) for _, value in avg_age],
+        hospital_top=hospital_top,
+    )
+
+
+# -------------------------------
+# COMPARISON
+# -------------------------------
+def _multiset(rows, keys):
+    return sorted(tuple(str(row[k]) for k in keys) for row in rows)
+
+
+def differences(expected, actual):
+    # chart names whose contents differ. The SQL leaves rows with equal
+    # totals in no particular order, so only the totals have to line up
+    # exactly; labels are compared as sorted (label, value) pairs, except
+    # for the top-5 conditions, where a tie at the cut-off can pick a
+    # different name.
+    diff = []
+    for labels, values in (("cond_labels", "cond_values"),
+                           ("vaccine_labels", "vaccine_values"),
+                           ("age_labels", "age_values"),
+                           ("avg_age_labels", "avg_age_values")):
+        if expected[values] != actual[values]:
+            diff.append(labels)
+        elif labels != "cond_labels" and \
+                sorted(zip(expected[labels], expected[values])) != \
+                sorted(zip(actual[labels], actual[values])):
+            diff.append(labels)
+    for table, group in (("gender_top", "condition_name"),
+                         ("blood_top", "condition_name"),
+                         ("hospital_top", "hospital_name")):
+        if sorted((row[group], row["total"]) for row in expected[table]) != \
+                sorted((row[group], row["total"]) for row in actual[table]):
+            diff.append(table)
+    for card in ("common_condition", "common_blood", "common_vaccine"):
+        e, a = expected[card], actual[card]
+        if (e is None) != (a is None) or (e is not None and e[1] != a[1]):
+            diff.append(card)
+    return diff
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, "healthcare_analytics.sqlite")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    sys.path.insert(0, here)
+    from app import analytics_payload
+
+    started = time.perf_counter()
+    expected = analytics_payload(conn)
+    summary_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    actual = compute(conn)
+    scan_ms = (time.perf_counter() - started) * 1000
+    conn.close()
+
+    print(f"summary tables: {summary_ms:8.1f} ms")
+    print(f"single scan:    {scan_ms:8.1f} ms")
+    diff = differences(expected, actual)
+    for name in diff:
+        print(f"{name} differs from the summary tables")
+    if diff:
+        sys.exit(1)
+    print("single scan matches the summary tables")
@@ -1,38 +1,197 @@
-from flask import Flask, render_template, request, redirect, session
-import sqlite3
+from flask import (
+    Blueprint, Flask, Response, current_app, jsonify, redirect, render_template,
+    request, session,
+)
+import io
+import json
 import os
+import sqlite3
+import time
 from datetime import date
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "healthcare_analytics.sqlite")
+import analytics_engine
+import bitmap_index
+import bulk_import
+import cache
+import catalogs
+import charts
+import cohort_store
+import db
+import export
+import instrumentation
+import metrics
+import migrations
+import patients
+import search
+import slow_queries
+import tables
+from cache import bump_data_version
+from db import get_db, write
+from tables import TABLE_WHITELIST
 
-app = Flask(
-    __name__,
-    template_folder="templates",
-    static_folder="static",
-)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-app.secret_key = "super_secret_key_123"
+# every route lives on this blueprint; create_app() registers it
+views = Blueprint("views", __name__)
 
 
 # -------------------------------
-# DB CONNECTION
+# APPLICATION FACTORY
 # -------------------------------
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+def create_app(config=None):
+    # Build a configured app: settings from HEALTHCARE_* environment
+    # variables, then `config` (a dict) on top, then the subsystems.
+    # Opens no database connection that outlives the call, so a prefork
+    # server can call it once before forking (see serve.py).
+    app = Flask(
+        __name__,
+        template_folder="templates",
+        static_folder="static",
+    )
+
+    app.secret_key = os.environ.get("HEALTHCARE_SECRET_KEY", "super_secret_key_123")
+
+    # -------------------------------
+    # DB CONNECTION POOL
+    # -------------------------------
+    app.config["DATABASE"] = os.environ.get(
+        "HEALTHCARE_DB",
+        os.path.join(BASE_DIR, "healthcare_analytics.sqlite"),
+    )
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("HEALTHCARE_DB_POOL_SIZE", 8))
+    # WAL lets readers keep going while the single writer thread commits
+    app.config["DB_JOURNAL_MODE"] = os.environ.get("HEALTHCARE_DB_JOURNAL_MODE", "wal")
+    app.config["DB_BUSY_TIMEOUT_MS"] = int(os.environ.get("HEALTHCARE_DB_BUSY_TIMEOUT_MS", 5000))
+    app.config["DB_WRITER_QUEUE"] = os.environ.get("HEALTHCARE_DB_WRITER_QUEUE", "1") == "1"
+    # group commit: writes queued behind a COMMIT share the next one (one fsync);
+    # a window (ms) also holds each batch open for writes that arrive just after
+    app.config["DB_GROUP_COMMIT_WINDOW_MS"] = float(
+        os.environ.get("HEALTHCARE_DB_GROUP_COMMIT_WINDOW_MS", 0)
+    )
+    app.config["DB_GROUP_COMMIT_MAX_BATCH"] = int(
+        os.environ.get("HEALTHCARE_DB_GROUP_COMMIT_MAX_BATCH", 64)
+    )
+    app.config["DB_SYNCHRONOUS"] = os.environ.get("HEALTHCARE_DB_SYNCHRONOUS", "full")
+
+    # -------------------------------
+    # REQUEST INSTRUMENTATION
+    # -------------------------------
+    # per-request latency, template time and SQL statements, rolled up per
+    # endpoint on /stats; HEALTHCARE_REQUEST_LOG=1 also logs one JSON line each
+    app.config["INSTRUMENTATION"] = os.environ.get("HEALTHCARE_INSTRUMENTATION", "1") == "1"
+    app.config["INSTRUMENTATION_LOG"] = os.environ.get("HEALTHCARE_REQUEST_LOG", "0") == "1"
+    # statements slower than this are logged with their plan (empty: off)
+    slow_query_ms = os.environ.get("HEALTHCARE_SLOW_QUERY_MS", "100")
+    app.config["SLOW_QUERY_MS"] = float(slow_query_ms) if slow_query_ms else None
+    # /metrics is open to scrapers unless a bearer token is configured
+    app.config["METRICS_TOKEN"] = os.environ.get("HEALTHCARE_METRICS_TOKEN")
+
+    # -------------------------------
+    # ANALYTICS
+    # -------------------------------
+    # "summary" reads the trigger-maintained summary tables; "scan" computes
+    # the page in one pass over the patient tables (analytics_engine.py);
+    # "columnar" from an in-memory NumPy copy of them (cohort_store.py)
+    app.config["ANALYTICS_MODE"] = os.environ.get("HEALTHCARE_ANALYTICS_MODE", "summary")
+    app.config["ANALYTICS_BATCH_SIZE"] = int(
+        os.environ.get("HEALTHCARE_ANALYTICS_BATCH_SIZE", analytics_engine.BATCH_SIZE)
+    )
+
+    # -------------------------------
+    # RESULT CACHES
+    # -------------------------------
+    app.config["ANALYTICS_CACHE_TTL"] = int(os.environ.get("HEALTHCARE_ANALYTICS_CACHE_TTL", 60))
+    app.config["ANALYTICS_CACHE_SIZE"] = int(os.environ.get("HEALTHCARE_ANALYTICS_CACHE_SIZE", 16))
+    app.config["CHART_CACHE_MAX_BYTES"] = int(
+        os.environ.get("HEALTHCARE_CHART_CACHE_MB", 32)
+    ) * 1024 * 1024
+    app.config["CHART_CACHE_TTL"] = int(os.environ.get("HEALTHCARE_CHART_CACHE_TTL", 300))
+
+    # dropdown catalogs; set HEALTHCARE_CATALOG_TTL when other processes can
+    # insert names behind this one's back
+    catalog_ttl = os.environ.get("HEALTHCARE_CATALOG_TTL")
+    app.config["CATALOG_TTL"] = int(catalog_ttl) if catalog_ttl else None
+
+    # -------------------------------
+    # BROWSE PAGINATION
+    # -------------------------------
+    app.config["BROWSE_PAGE_SIZE"] = int(os.environ.get("HEALTHCARE_BROWSE_PAGE_SIZE", 50))
+    app.config["BROWSE_MAX_PAGE_SIZE"] = 500
+
+    # most MRNs /patient_charts will load in one request
+    app.config["CHART_BATCH_LIMIT"] = 1000
+
+    # most MRNs /delete_patients will remove in one request
+    app.config["DELETE_BATCH_LIMIT"] = 10000
+
+    # most suggestions /search returns
+    app.config["SEARCH_MAX_RESULTS"] = 25
+
+    # -------------------------------
+    # BULK IMPORT
+    # -------------------------------
+    # records per import transaction; other writes interleave between chunks
+    app.config["IMPORT_CHUNK_SIZE"] = int(os.environ.get("HEALTHCARE_IMPORT_CHUNK_SIZE", 5000))
+    app.config["MAX_CONTENT_LENGTH"] = 256 * 1024 * 1024
+
+    app.config.update(config or {})
+
+    # bring the schema up to date before any connection is handed out
+    migrations.migrate(app.config["DATABASE"], log=app.logger.info)
+    db.init_app(app)
+    instrumentation.init_app(app)
+    slow_queries.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    catalogs.init_app(app)
+    cohort_store.init_app(app)
+    bitmap_index.init_app(app)
+    app.register_blueprint(views)
+    return app
 
 
 def require_login():
     return "doctor_id" in session
 
 
+def data_changed(*patient_ids):
+    # Called after every write: drops the analytics payload and the cached
+    # charts of exactly the patients whose rows were touched.
+    bump_data_version()
+    cache.get_chart_cache().invalidate(*patient_ids)
+    cache.publish_change(*patient_ids)  # other worker processes, if any
+
+
+def get_chart(mrn):
+    chart_cache = cache.get_chart_cache()
+    chart = chart_cache.get_by_mrn(mrn)
+    if chart is None:
+        epoch = chart_cache.epoch()
+        chart = charts.load_chart(get_db(), mrn)
+        if chart:
+            chart_cache.put(chart, epoch)
+    return chart
+
+
+# -------------------------------
+# DATABASE BUSY
+# -------------------------------
+@views.app_errorhandler(sqlite3.OperationalError)
+def database_error(exc):
+    # A lock held past the busy timeout is load, not a bug: answer 503 with
+    # Retry-After so clients (and loadtest.py) can tell it from a crash.
+    if "locked" in str(exc) or "busy" in str(exc):
+        current_app.logger.warning("%s %s: %s", request.method, request.path, exc)
+        return Response("database is locked\n", status=503,
+                        headers={"Retry-After": "1"}, content_type="text/plain")
+    current_app.logger.error("%s %s failed", request.method, request.path, exc_info=exc)
+    return "Internal Server Error", 500
+
+
 # -------------------------------
 # ROOT → LOGIN
 # -------------------------------
-@app.route("/")
+@views.route("/")
 def index():
     return redirect("/doctor_login")
 
@@ -40,7 +199,7 @@ def index():
 # -------------------------------
 # LOGIN
 # -------------------------------
-@app.route("/doctor_login", methods=["GET", "POST"])
+@views.route("/doctor_login", methods=["GET", "POST"])
 def doctor_login():
     error = None
 
@@ -68,7 +227,7 @@ def doctor_login():
 # -------------------------------
 # DOCTOR DASHBOARD
 # -------------------------------
-@app.route("/doctor_dashboard")
+@views.route("/doctor_dashboard")
 def doctor_dashboard():
     if not require_login():
         return redirect("/doctor_login")
@@ -99,7 +258,7 @@ def doctor_dashboard():
 # -------------------------------
 # LOOKUP PATIENT BY MRN
 # -------------------------------
-@app.route("/lookup_patient", methods=["GET", "POST"])
+@views.route("/lookup_patient", methods=["GET", "POST"])
 def lookup_patient():
     if not require_login():
         return redirect("/doctor_login")
@@ -112,76 +271,13 @@ def lookup_patient():
     if request.method == "POST":
         mrn = request.form["mrn"].strip()
 
-        conn = get_db()
-        # 1. find the patient
-        cur = conn.execute(
-            "SELECT * FROM Patient WHERE medical_record_number = ?",
-            (mrn,),
-        )
-        patient = cur.fetchone()
-
-        if patient:
-            pid = patient["patient_id"]
-
-            # 2. conditions for this patient + meds used for each condition
-            conditions = conn.execute(
-                '''
-                SELECT
-                    c.name AS condition_name,
-                    pc.diagnosis_date,
-                    d.name AS doctor_name,
-                    GROUP_CONCAT(DISTINCT m.name) AS medications_for_condition
-                FROM PatientCondition pc
-                JOIN "Condition" c
-                    ON pc.condition_id = c.condition_id
-                JOIN Doctor d
-                    ON pc.doctor_id = d.doctor_id
-                LEFT JOIN MedicationCondition mc
-                    ON c.condition_id = mc.condition_id
-                LEFT JOIN Medication m
-                    ON mc.medication_id = m.medication_id
-                WHERE pc.patient_id = ?
-                GROUP BY c.condition_id, pc.diagnosis_date, d.name
-                ORDER BY pc.diagnosis_date DESC
-                ''',
-                (pid,),
-            ).fetchall()
-
-            # 3. medications for this patient + the specific condition each prescription is for
-            medications = conn.execute(
-                '''
-                SELECT
-                    m.name AS medication_name,
-                    pm.prescription_date,
-                    d.name AS doctor_name,
-                    c.name AS prescribed_for_condition
-                FROM PatientMedication pm
-                JOIN Medication m
-                    ON pm.medication_id = m.medication_id
-                JOIN Doctor d
-                    ON pm.doctor_id = d.doctor_id
-                LEFT JOIN "Condition" c
-                    ON pm.condition_id = c.condition_id
-                WHERE pm.patient_id = ?
-                ORDER BY pm.prescription_date DESC
-                ''',
-                (pid,),
-            ).fetchall()
-
-
-            # 4. vaccines for this patient
-            vaccines = conn.execute(
-                '''
-                SELECT v.name AS vaccine_name,
-                       pi.admin_date
-                FROM PatientImmunization pi
-                JOIN Vaccine v
-                    ON pi.vaccine_id = v.vaccine_id
-                WHERE pi.patient_id = ?
-                ORDER BY pi.admin_date DESC
-                ''',
-                (pid,),
-            ).fetchall()
+        # patient + conditions + medications + vaccines, cached per patient
+        chart = get_chart(mrn)
+        if chart:
+            patient = chart["patient"]
+            conditions = chart["conditions"]
+            medications = chart["medications"]
+            vaccines = chart["vaccines"]
 
     return render_template(
         "lookup_patient.html",
@@ -192,15 +288,99 @@ def lookup_patient():
     )
 
 
+# -------------------------------
+# BULK PATIENT CHARTS (JSON)
+# -------------------------------
+@views.route("/patient_charts", methods=["GET", "POST"])
+def patient_charts():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    # ?mrn=A&mrn=B, or a JSON body {"mrns": [...]}
+    if request.is_json:
+        mrns = (request.get_json(silent=True) or {}).get("mrns") or []
+    else:
+        mrns = request.values.getlist("mrn")
+    mrns = [str(m).strip() for m in mrns if str(m).strip()]
+
+    if len(mrns) > current_app.config["CHART_BATCH_LIMIT"]:
+        return jsonify(error="Too many MRNs in one request."), 400
+
+    # serve what the chart cache has, load the rest in one batch
+    chart_cache = cache.get_chart_cache()
+    found = {}
+    for mrn in mrns:
+        chart = chart_cache.get_by_mrn(mrn)
+        if chart is not None:
+            found[mrn] = chart
+    missing = [mrn for mrn in mrns if mrn not in found]
+    if missing:
+        epoch = chart_cache.epoch()
+        loaded = charts.load_charts(get_db(), missing)
+        for chart in loaded.values():
+            chart_cache.put(chart, epoch)
+        found.update(loaded)
+
+    return jsonify({mrn: found.get(mrn) for mrn in mrns})
+
+
+# -------------------------------
+# TYPEAHEAD SEARCH (JSON)
+# -------------------------------
+@views.route("/search")
+def search_terms():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    # ?q=diab&kind=condition&kind=medication&limit=10
+    q = request.args.get("q", "")
+    kinds = request.args.getlist("kind") or None
+    limit = request.args.get("limit", 10, type=int)
+    limit = max(1, min(limit, current_app.config["SEARCH_MAX_RESULTS"]))
+
+    return jsonify(results=search.search(get_db(), q, kinds, limit))
+
+
+# -------------------------------
+# COHORT QUERIES (JSON)
+# -------------------------------
+@views.route("/cohort")
+def cohort():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    # ?q=condition:Asthma AND NOT medication:Albuterol&limit=50
+    q = request.args.get("q", "")
+    limit = request.args.get("limit", 20, type=int)
+    limit = max(0, min(limit, current_app.config["COHORT_MAX_RESULTS"]))
+
+    started = time.perf_counter()
+    try:
+        found = bitmap_index.get_bitmap_index().query(q)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    count = len(found)
+    micros = round((time.perf_counter() - started) * 1e6)
+
+    # MRNs of the first patients, in patient_id order
+    ids = found.ids(limit)
+    rows = get_db().execute(
+        "SELECT medical_record_number FROM Patient WHERE patient_id IN (SELECT value FROM json_each(?)) "
+        "ORDER BY patient_id",
+        (json.dumps(ids),),
+    ).fetchall() if ids else []
+
+    return jsonify(query=q, count=count, micros=micros, patients=[row[0] for row in rows])
+
+
 # -------------------------------
 # ADD PATIENT
 # -------------------------------
-@app.route("/add_patient", methods=["GET", "POST"])
+@views.route("/add_patient", methods=["GET", "POST"])
 def add_patient():
     if not require_login():
         return redirect("/doctor_login")
 
-    conn = get_db()
     message = None
 
     if request.method == "POST":
@@ -209,15 +389,15 @@ def add_patient():
         gender = request.form["gender"]
         blood_type = request.form["blood_type"]
 
-        # ✅ check if MRN already exists
-        existing = conn.execute(
-            "SELECT 1 FROM Patient WHERE medical_record_number = ?",
-            (mrn,)
-        ).fetchone()
+        def insert_patient(conn):
+            # ✅ check if MRN already exists (inside the write so it can't race)
+            existing = conn.execute(
+                "SELECT 1 FROM Patient WHERE medical_record_number = ?",
+                (mrn,)
+            ).fetchone()
+            if existing:
+                return False
 
-        if existing:
-            message = "A patient with this MRN already exists."
-        else:
             conn.execute(
                 """
                 INSERT INTO Patient
@@ -226,8 +406,13 @@ def add_patient():
                 """,
                 (mrn, birth_year, gender, blood_type)
             )
-            conn.commit()
+            return True
+
+        if write(insert_patient):
+            data_changed()
             message = "Patient added successfully."
+        else:
+            message = "A patient with this MRN already exists."
 
     return render_template(
         "add_patient.html",
@@ -236,10 +421,56 @@ def add_patient():
 
 
 
+# -------------------------------
+# BULK IMPORT PATIENTS (CSV / NDJSON UPLOAD)
+# -------------------------------
+@views.route("/import_patients", methods=["GET", "POST"])
+def import_patients():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    report = None
+    message = None
+
+    if request.method == "POST":
+        upload = request.files.get("file")
+        read = None
+        if upload and upload.filename:
+            read = bulk_import.reader_for(upload.filename, request.form.get("format"))
+
+        if read is None:
+            message = "Upload a .csv or .ndjson file."
+        else:
+            lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+            importer = bulk_import.Importer(
+                doctor_id=session["doctor_id"],
+                create_catalog=request.form.get("create_catalog") == "1",
+            )
+            try:
+                bulk_import.run(
+                    read(lines),
+                    write,
+                    chunk_size=current_app.config["IMPORT_CHUNK_SIZE"],
+                    importer=importer,
+                )
+            finally:
+                # chunks committed before a failure are in the database
+                data_changed(*importer.patient_ids)
+                if importer.catalog_changed:
+                    catalogs.invalidate_all()
+            report = importer.report()
+
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify(report)
+
+    return render_template("import_patients.html", report=report, message=message)
+
+
+
 # -------------------------------
 # UPDATE PATIENT
 # -------------------------------
-@app.route("/update_patient", methods=["GET", "POST"])
+@views.route("/update_patient", methods=["GET", "POST"])
 def update_patient():
     if not require_login():
         return redirect("/doctor_login")
@@ -251,18 +482,20 @@ def update_patient():
         gender = request.form["gender"]
         blood_type = request.form["blood_type"]
 
-        conn = get_db()
-        cur = conn.execute(
-            "UPDATE Patient "
-            "SET birth_year = ?, gender = ?, blood_type = ? "
-            "WHERE medical_record_number = ?",
-            (birth_year, gender, blood_type, mrn),
+        updated = write(
+            lambda conn: conn.execute(
+                "UPDATE Patient "
+                "SET birth_year = ?, gender = ?, blood_type = ? "
+                "WHERE medical_record_number = ? "
+                "RETURNING patient_id",
+                (birth_year, gender, blood_type, mrn),
+            ).fetchall()
         )
-        conn.commit()
 
-        if cur.rowcount == 0:
+        if not updated:
             message = "No patient found with that MRN."
         else:
+            data_changed(updated[0]["patient_id"])
             message = "Patient successfully updated."
 
     return render_template("update_patient.html", message=message)
@@ -271,7 +504,7 @@ def update_patient():
 # -------------------------------
 # DELETE PATIENT (+ CHILD ROWS)
 # -------------------------------
-@app.route("/delete_patient", methods=["GET", "POST"])
+@views.route("/delete_patient", methods=["GET", "POST"])
 def delete_patient():
     if not require_login():
         return redirect("/doctor_login")
@@ -280,43 +513,55 @@ def delete_patient():
     if request.method == "POST":
         mrn = request.form["mrn"].strip()
 
-        conn = get_db()
-        cur = conn.execute(
-            "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
-            (mrn,),
-        )
-        row = cur.fetchone()
-
-        if row is None:
+        # child rows cascade from the Patient row
+        deleted = write(patients.delete_patients, [mrn])
+        if not deleted:
             message = "No patient found with that MRN."
         else:
-            pid = row["patient_id"]
-
-            conn.execute("DELETE FROM PatientDoctor WHERE patient_id = ?", (pid,))
-            conn.execute("DELETE FROM PatientHospital WHERE patient_id = ?", (pid,))
-            conn.execute("DELETE FROM PatientCondition WHERE patient_id = ?", (pid,))
-            conn.execute("DELETE FROM PatientMedication WHERE patient_id = ?", (pid,))
-            conn.execute("DELETE FROM PatientImmunization WHERE patient_id = ?", (pid,))
-
-            conn.execute("DELETE FROM Patient WHERE patient_id = ?", (pid,))
-            conn.commit()
+            data_changed(*deleted.values())
             message = "Patient and related records deleted."
 
     return render_template("delete_patient.html", message=message)
 
 
+# -------------------------------
+# DELETE PATIENTS IN BULK (JSON)
+# -------------------------------
+@views.route("/delete_patients", methods=["POST"])
+def delete_patients():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    # JSON body {"mrns": [...]}, or form fields mrn=A&mrn=B
+    if request.is_json:
+        mrns = (request.get_json(silent=True) or {}).get("mrns") or []
+    else:
+        mrns = request.form.getlist("mrn")
+    mrns = [str(m).strip() for m in mrns if str(m).strip()]
+
+    if len(mrns) > current_app.config["DELETE_BATCH_LIMIT"]:
+        return jsonify(error="Too many MRNs in one request."), 400
+
+    # one transaction, one statement, however many patients
+    deleted = write(patients.delete_patients, mrns)
+    if deleted:
+        data_changed(*deleted.values())
+
+    return jsonify(
+        deleted=sorted(deleted),
+        not_found=[m for m in dict.fromkeys(mrns) if m not in deleted],
+    )
+
+
 # -------------------------------
 # ADD CONDITION TO PATIENT
 # -------------------------------
-@app.route("/add_condition", methods=["GET", "POST"])
+@views.route("/add_condition", methods=["GET", "POST"])
 def add_condition():
     if not require_login():
         return redirect("/doctor_login")
 
-    conn = get_db()
-    all_conditions = conn.execute(
-        'SELECT condition_id, name FROM "Condition" ORDER BY name'
-    ).fetchall()
+    all_conditions = catalogs.get_catalog("Condition").rows()
 
     message = None
     if request.method == "POST":
@@ -331,35 +576,46 @@ def add_condition():
         if not condition_id and not new_condition_name:
             message = "Select an existing condition or enter a new one."
         else:
-            if new_condition_name:
+            doctor_id = session["doctor_id"]
+
+            def insert_condition(conn, condition_id):
+                if new_condition_name:
+                    cur = conn.execute(
+                        'INSERT INTO "Condition" (name) VALUES (?)',
+                        (new_condition_name,),
+                    )
+                    condition_id = cur.lastrowid
+
                 cur = conn.execute(
-                    'INSERT INTO "Condition" (name) VALUES (?)',
-                    (new_condition_name,),
+                    "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
+                    (mrn,),
                 )
-                conn.commit()
-                condition_id = cur.lastrowid
+                patient = cur.fetchone()
+                if patient is None:
+                    return None, condition_id
 
-            cur = conn.execute(
-                "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if patient is None:
-                message = "No patient found with that MRN."
-            else:
                 pid = patient["patient_id"]
-                doctor_id = session["doctor_id"]
-
                 conn.execute(
                     '''
-                    INSERT OR REPLACE INTO PatientCondition
+                    INSERT INTO PatientCondition
                         (patient_id, condition_id, diagnosis_date, doctor_id)
                     VALUES (?, ?, ?, ?)
+                    ON CONFLICT (patient_id, condition_id) DO UPDATE SET
+                        diagnosis_date = excluded.diagnosis_date,
+                        doctor_id = excluded.doctor_id
                     ''',
                     (pid, condition_id, diagnosis_date, doctor_id),
                 )
-                conn.commit()
+                return pid, condition_id
+
+            pid, condition_id = write(insert_condition, condition_id)
+            if new_condition_name:
+                catalogs.get_catalog("Condition").add(condition_id, new_condition_name)
+                all_conditions = catalogs.get_catalog("Condition").rows()
+            data_changed(pid)
+            if pid is None:
+                message = "No patient found with that MRN."
+            else:
                 message = "Condition added/updated for this patient."
 
     return render_template(
@@ -372,18 +628,13 @@ def add_condition():
 # -------------------------------
 # ADD MEDICATION TO PATIENT
 # -------------------------------
-@app.route("/add_medication", methods=["GET", "POST"])
+@views.route("/add_medication", methods=["GET", "POST"])
 def add_medication():
     if not require_login():
         return redirect("/doctor_login")
 
-    conn = get_db()
-    all_meds = conn.execute(
-        "SELECT medication_id, name FROM Medication ORDER BY name"
-    ).fetchall()
-    conditions = conn.execute(
-        'SELECT condition_id, name FROM "Condition" ORDER BY name'
-    ).fetchall()
+    all_meds = catalogs.get_catalog("Medication").rows()
+    conditions = catalogs.get_catalog("Condition").rows()
 
     message = None
     if request.method == "POST":
@@ -399,29 +650,27 @@ def add_medication():
         if not medication_id and not new_med_name:
             message = "Select an existing medication or enter a new one."
         else:
-            # If a new medication name is provided, insert it and use its id
-            if new_med_name:
+            doctor_id = session["doctor_id"]
+
+            def insert_medication(conn, medication_id):
+                # If a new medication name is provided, insert it and use its id
+                if new_med_name:
+                    cur = conn.execute(
+                        "INSERT INTO Medication (name) VALUES (?)",
+                        (new_med_name,),
+                    )
+                    medication_id = cur.lastrowid
+
+                # Look up the patient by MRN
                 cur = conn.execute(
-                    "INSERT INTO Medication (name) VALUES (?)",
-                    (new_med_name,),
+                    "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
+                    (mrn,),
                 )
-                conn.commit()
-                medication_id = cur.lastrowid
-
-            # Look up the patient by MRN
-            cur = conn.execute(
-                "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if patient is None:
-                message = "No patient found with that MRN."
-            elif not condition_id:
-                message = "Please select a condition for this medication."
-            else:
-                pid = patient["patient_id"]
-                doctor_id = session["doctor_id"]
+                patient = cur.fetchone()
+                if patient is None:
+                    return "no_patient", None, medication_id
+                if not condition_id:
+                    return "no_condition", None, medication_id
 
                 conn.execute(
                     '''
@@ -429,9 +678,21 @@ def add_medication():
                         (patient_id, medication_id, prescription_date, doctor_id, condition_id)
                     VALUES (?, ?, ?, ?, ?)
                     ''',
-                    (pid, medication_id, prescription_date, doctor_id, condition_id),
+                    (patient["patient_id"], medication_id, prescription_date,
+                     doctor_id, condition_id),
                 )
-                conn.commit()
+                return "ok", patient["patient_id"], medication_id
+
+            outcome, pid, medication_id = write(insert_medication, medication_id)
+            if new_med_name:
+                catalogs.get_catalog("Medication").add(medication_id, new_med_name)
+                all_meds = catalogs.get_catalog("Medication").rows()
+            data_changed(pid)
+            if outcome == "no_patient":
+                message = "No patient found with that MRN."
+            elif outcome == "no_condition":
+                message = "Please select a condition for this medication."
+            else:
                 message = "Medication added to patient history."
 
     return render_template(
@@ -445,7 +706,7 @@ def add_medication():
 # DELETE CONDITION
 #------------------------
 
-@app.route("/delete_condition", methods=["GET", "POST"])
+@views.route("/delete_condition", methods=["GET", "POST"])
 def delete_condition():
     if not require_login():
         return redirect("/doctor_login")
@@ -454,73 +715,31 @@ def delete_condition():
     conditions = []
     message = None
 
-    conn = get_db()
-
     if request.method == "POST":
+        mrn = request.form["mrn"].strip()
+
         # If this POST has pc_id, we're deleting a specific record
         if "pc_id" in request.form:
             pc_id = request.form["pc_id"]
-            mrn = request.form["mrn"].strip()
 
-            conn.execute(
-                "DELETE FROM PatientCondition WHERE rowid = ?",
-                (pc_id,),
+            deleted = write(
+                lambda conn: conn.execute(
+                    "DELETE FROM PatientCondition WHERE rowid = ? "
+                    "RETURNING patient_id",
+                    (pc_id,),
+                ).fetchall()
             )
-            conn.commit()
+            data_changed(*(row["patient_id"] for row in deleted))
             message = "Condition removed from patient record."
 
-            # Re-fetch patient + remaining conditions
-            cur = conn.execute(
-                "SELECT * FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if patient:
-                cur = conn.execute(
-                    '''
-                    SELECT pc.rowid AS pc_id,
-                           c.name AS condition_name,
-                           pc.diagnosis_date,
-                           d.name AS doctor_name
-                    FROM PatientCondition pc
-                    JOIN "Condition" c ON pc.condition_id = c.condition_id
-                    LEFT JOIN Doctor d ON pc.doctor_id = d.doctor_id
-                    WHERE pc.patient_id = ?
-                    ORDER BY pc.diagnosis_date DESC
-                    ''',
-                    (patient["patient_id"],),
-                )
-                conditions = cur.fetchall()
-
-        # Otherwise, this POST is just searching by MRN
-        else:
-            mrn = request.form["mrn"].strip()
-
-            cur = conn.execute(
-                "SELECT * FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if not patient:
-                message = "No patient found with that MRN."
-            else:
-                cur = conn.execute(
-                    '''
-                    SELECT pc.rowid AS pc_id,
-                           c.name AS condition_name,
-                           pc.diagnosis_date,
-                           d.name AS doctor_name
-                    FROM PatientCondition pc
-                    JOIN "Condition" c ON pc.condition_id = c.condition_id
-                    LEFT JOIN Doctor d ON pc.doctor_id = d.doctor_id
-                    WHERE pc.patient_id = ?
-                    ORDER BY pc.diagnosis_date DESC
-                    ''',
-                    (patient["patient_id"],),
-                )
-                conditions = cur.fetchall()
+        # Either way, show the patient + remaining conditions (the chart
+        # already carries pc_id for the delete buttons)
+        chart = get_chart(mrn)
+        if chart:
+            patient = chart["patient"]
+            conditions = chart["conditions"]
+        elif message is None:
+            message = "No patient found with that MRN."
 
     return render_template(
         "delete_condition.html",
@@ -528,7 +747,7 @@ def delete_condition():
         conditions=conditions,
         message=message,
     )
-@app.route("/delete_medication", methods=["GET", "POST"])
+@views.route("/delete_medication", methods=["GET", "POST"])
 def delete_medication():
     if not require_login():
         return redirect("/doctor_login")
@@ -537,73 +756,30 @@ def delete_medication():
     meds = []
     message = None
 
-    conn = get_db()
-
     if request.method == "POST":
+        mrn = request.form["mrn"].strip()
+
         # Deleting a specific medication entry
         if "pm_id" in request.form:
             pm_id = request.form["pm_id"]
-            mrn = request.form["mrn"].strip()
 
-            conn.execute(
-                "DELETE FROM PatientMedication WHERE rowid = ?",
-                (pm_id,),
+            deleted = write(
+                lambda conn: conn.execute(
+                    "DELETE FROM PatientMedication WHERE rowid = ? "
+                    "RETURNING patient_id",
+                    (pm_id,),
+                ).fetchall()
             )
-            conn.commit()
+            data_changed(*(row["patient_id"] for row in deleted))
             message = "Medication removed from patient record."
 
-            # Re-fetch patient + remaining meds
-            cur = conn.execute(
-                "SELECT * FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if patient:
-                cur = conn.execute(
-                    '''
-                    SELECT pm.rowid AS pm_id,
-                           m.name AS medication_name,
-                           pm.prescription_date,
-                           d.name AS doctor_name
-                    FROM PatientMedication pm
-                    JOIN Medication m ON pm.medication_id = m.medication_id
-                    LEFT JOIN Doctor d ON pm.doctor_id = d.doctor_id
-                    WHERE pm.patient_id = ?
-                    ORDER BY pm.prescription_date DESC
-                    ''',
-                    (patient["patient_id"],),
-                )
-                meds = cur.fetchall()
-
-        # Searching by MRN
-        else:
-            mrn = request.form["mrn"].strip()
-
-            cur = conn.execute(
-                "SELECT * FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
-
-            if not patient:
-                message = "No patient found with that MRN."
-            else:
-                cur = conn.execute(
-                    '''
-                    SELECT pm.rowid AS pm_id,
-                           m.name AS medication_name,
-                           pm.prescription_date,
-                           d.name AS doctor_name
-                    FROM PatientMedication pm
-                    JOIN Medication m ON pm.medication_id = m.medication_id
-                    LEFT JOIN Doctor d ON pm.doctor_id = d.doctor_id
-                    WHERE pm.patient_id = ?
-                    ORDER BY pm.prescription_date DESC
-                    ''',
-                    (patient["patient_id"],),
-                )
-                meds = cur.fetchall()
+        # Either way, show the patient + remaining meds from their chart
+        chart = get_chart(mrn)
+        if chart:
+            patient = chart["patient"]
+            meds = chart["medications"]
+        elif message is None:
+            message = "No patient found with that MRN."
 
     return render_template(
         "delete_medication.html",
@@ -616,15 +792,12 @@ def delete_medication():
 # -------------------------------
 # ADD VACCINE TO PATIENT
 # -------------------------------
-@app.route("/add_vaccine", methods=["GET", "POST"])
+@views.route("/add_vaccine", methods=["GET", "POST"])
 def add_vaccine():
     if not require_login():
         return redirect("/doctor_login")
 
-    conn = get_db()
-    all_vaccines = conn.execute(
-        "SELECT vaccine_id, name FROM Vaccine ORDER BY name"
-    ).fetchall()
+    all_vaccines = catalogs.get_catalog("Vaccine").rows()
 
     message = None
     if request.method == "POST":
@@ -639,25 +812,23 @@ def add_vaccine():
         if not vaccine_id and not new_vaccine_name:
             message = "Select an existing vaccine or enter a new one."
         else:
-            if new_vaccine_name:
+            def insert_vaccine(conn, vaccine_id):
+                if new_vaccine_name:
+                    cur = conn.execute(
+                        "INSERT INTO Vaccine (name) VALUES (?)",
+                        (new_vaccine_name,),
+                    )
+                    vaccine_id = cur.lastrowid
+
                 cur = conn.execute(
-                    "INSERT INTO Vaccine (name) VALUES (?)",
-                    (new_vaccine_name,),
+                    "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
+                    (mrn,),
                 )
-                conn.commit()
-                vaccine_id = cur.lastrowid
-
-            cur = conn.execute(
-                "SELECT patient_id FROM Patient WHERE medical_record_number = ?",
-                (mrn,),
-            )
-            patient = cur.fetchone()
+                patient = cur.fetchone()
+                if patient is None:
+                    return None, vaccine_id
 
-            if patient is None:
-                message = "No patient found with that MRN."
-            else:
                 pid = patient["patient_id"]
-
                 conn.execute(
                     '''
                     INSERT INTO PatientImmunization
@@ -666,7 +837,16 @@ def add_vaccine():
                     ''',
                     (pid, vaccine_id, admin_date),
                 )
-                conn.commit()
+                return pid, vaccine_id
+
+            pid, vaccine_id = write(insert_vaccine, vaccine_id)
+            if new_vaccine_name:
+                catalogs.get_catalog("Vaccine").add(vaccine_id, new_vaccine_name)
+                all_vaccines = catalogs.get_catalog("Vaccine").rows()
+            data_changed(pid)
+            if pid is None:
+                message = "No patient found with that MRN."
+            else:
                 message = "Vaccine added to patient history."
 
     return render_template(
@@ -680,198 +860,129 @@ def add_vaccine():
 # BROWSE TABLES
 # -------------------------------
 
-TABLE_WHITELIST = [
-    "Hospital",
-    "Doctor",
-    "Patient",
-    "Condition",          # actual table name is "Condition"
-    "Medication",
-    "Vaccine",
-    "PatientDoctor",
-    "PatientHospital",
-    "PatientCondition",
-    "PatientMedication",
-    "PatientImmunization",
-    "MedicationCondition",
-]
-
-
-@app.route("/browse_tables", methods=["GET", "POST"])
+@views.route("/browse_tables", methods=["GET", "POST"])
 def browse_tables():
     if not require_login():
         return redirect("/doctor_login")
 
-    selected = None
-    table_data = None
-    columns = None
+    selected = request.values.get("table_name")
+    view = tables.VIEWS.get(selected)
+    page = None
+    filters = {}
+    approx_total = None
+    page_size = current_app.config["BROWSE_PAGE_SIZE"]
 
-    if request.method == "POST":
-        selected = request.form["table_name"]
+    if view is not None:
         conn = get_db()
-
-        # More informative + sorted views for relationship tables
-        if selected == "PatientHospital":
-            sql = """
-                SELECT
-                    ph.patient_id,
-                    p.medical_record_number,
-                    ph.hospital_id,
-                    h.name AS hospital_name,
-                    h.city AS hospital_city
-                FROM PatientHospital ph
-                JOIN Patient p ON ph.patient_id = p.patient_id
-                JOIN Hospital h ON ph.hospital_id = h.hospital_id
-                ORDER BY
-                    p.medical_record_number,
-                    h.name
-
-            """
-        elif selected == "PatientCondition":
-            sql = """
-                SELECT
-                    pc.patient_id,
-                    p.medical_record_number,
-                    c.name AS condition_name,
-                    pc.diagnosis_date,
-                    d.name AS doctor_name
-                FROM PatientCondition pc
-                JOIN Patient p ON pc.patient_id = p.patient_id
-                JOIN "Condition" c ON pc.condition_id = c.condition_id
-                JOIN Doctor d ON pc.doctor_id = d.doctor_id
-                ORDER BY
-                    p.medical_record_number,
-                    c.name,
-                    pc.diagnosis_date DESC
-            """
-        elif selected == "PatientMedication":
-            sql = """
-                SELECT
-                    pm.patient_id,
-                    p.medical_record_number,
-                    m.name AS medication_name,
-                    c.name AS condition_name,
-                    pm.prescription_date,
-                    d.name AS doctor_name
-                FROM PatientMedication pm
-                JOIN Patient p
-                    ON pm.patient_id = p.patient_id
-                JOIN Medication m
-                    ON pm.medication_id = m.medication_id
-                JOIN Doctor d
-                    ON pm.doctor_id = d.doctor_id
-                LEFT JOIN "Condition" c
-                    ON pm.condition_id = c.condition_id
-                ORDER BY
-                    p.medical_record_number,
-                    pm.prescription_date DESC,
-                    m.name
-            """
-    
-
-
-        elif selected == "PatientImmunization":
-            sql = """
-                SELECT
-                    pi.patient_id,
-                    p.medical_record_number,
-                    v.name AS vaccine_name,
-                    pi.admin_date
-                FROM PatientImmunization pi
-                JOIN Patient p ON pi.patient_id = p.patient_id
-                JOIN Vaccine v ON pi.vaccine_id = v.vaccine_id
-                ORDER BY
-                    p.medical_record_number,
-                    pi.admin_date DESC,
-                    v.name
-            """
-        elif selected == "MedicationCondition":
-            sql = """
-                SELECT
-                    mc.medication_id,
-                    m.name AS medication_name,
-                    mc.condition_id,
-                    c.name AS condition_name
-                FROM MedicationCondition mc
-                JOIN Medication m ON mc.medication_id = m.medication_id
-                JOIN "Condition" c ON mc.condition_id = c.condition_id
-                ORDER BY
-                    m.name,
-                    c.name
-            """
-        elif selected == "PatientDoctor":
-            sql = """
-                SELECT
-                    pd.patient_id,
-                    p.medical_record_number,
-                    pd.doctor_id,
-                    d.name AS doctor_name,
-                    d.specialty AS doctor_specialty,
-                    h.name AS hospital_name,
-                    h.city AS hospital_city
-                FROM PatientDoctor pd
-                JOIN Patient p ON pd.patient_id = p.patient_id
-                JOIN Doctor d ON pd.doctor_id = d.doctor_id
-                JOIN Hospital h ON d.hospital_id = h.hospital_id
-                ORDER BY
-                    d.name,
-                    p.medical_record_number
-            """
-        elif selected == "Doctor":
-            # Hide password; show hospital info instead
-            sql = """
-                SELECT
-                    d.doctor_id,
-                    d.name,
-                    d.specialty,
-                    h.name AS hospital_name,
-                    h.city AS hospital_city
-                FROM Doctor d
-                JOIN Hospital h ON d.hospital_id = h.hospital_id
-                ORDER BY
-                    d.name
-            """
-        else:
-            # Default: simple SELECT * (with proper quoting for Condition)
-            if selected == "Condition":
-                sql_table = '"Condition"'
-            else:
-                sql_table = selected
-            sql = f"SELECT * FROM {sql_table}"
-
-        cur = conn.execute(sql)
-        table_data = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
+        n_keys = len(view.keys)
+
+        page_size = request.values.get("page_size", type=int) or page_size
+        page_size = max(1, min(page_size, current_app.config["BROWSE_MAX_PAGE_SIZE"]))
+
+        # f_<column>=value narrows the view with a WHERE clause
+        filters = {
+            label: request.values[f"f_{label}"].strip()
+            for label in view.labels
+            if request.values.get(f"f_{label}", "").strip()
+        }
+
+        after = request.values.get("after")
+        before = request.values.get("before")
+        page = tables.fetch_page(
+            conn,
+            view,
+            filters,
+            page_size,
+            after=tables.decode_cursor(after, n_keys) if after else None,
+            before=tables.decode_cursor(before, n_keys) if before else None,
+        )
+        if not filters:
+            approx_total = tables.approx_row_count(conn, view)
 
     return render_template(
         "browse_tables.html",
         tables=TABLE_WHITELIST,
-        selected=selected,
-        table_data=table_data,
-        columns=columns,
+        selected=selected if view is not None else None,
+        table_data=page["rows"] if page else None,
+        columns=page["columns"] if page else None,
+        next_cursor=page["next_cursor"] if page else None,
+        prev_cursor=page["prev_cursor"] if page else None,
+        filters=filters,
+        page_size=page_size,
+        approx_total=approx_total,
+        # everything but the cursor, for the previous / next page links
+        page_args=dict(
+            table_name=selected,
+            page_size=page_size,
+            **{f"f_{label}": value for label, value in filters.items()},
+        ),
     )
 
 
 
 # -------------------------------
-# ANALYTICS
+# EXPORT (STREAMING CSV / NDJSON)
 # -------------------------------
+@views.route("/export/<table_name>")
+def export_table(table_name):
+    if not require_login():
+        return redirect("/doctor_login")
+
+    view = tables.VIEWS.get(table_name)
+    fmt = request.args.get("format", "csv")
+    if view is None or fmt not in export.FORMATS:
+        return "Unknown table or format.", 404
+
+    filters = {
+        label: request.args[f"f_{label}"].strip()
+        for label in view.labels
+        if request.args.get(f"f_{label}", "").strip()
+    }
+    gzip = request.args.get("gzip") == "1"
+
+    filename = f"{table_name}.{fmt}" + (".gz" if gzip else "")
+    return Response(
+        export.stream(db.get_pool(), view, filters, fmt, gzip=gzip),
+        mimetype="application/gzip" if gzip else export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # -------------------------------
 # ANALYTICS
 # -------------------------------
-@app.route("/analytics")
+@views.route("/analytics")
 def analytics():
     if not require_login():
         return redirect("/doctor_login")
 
-    conn = get_db()
+    # Analytics only change when a write route bumps the data version, so
+    # repeat views between writes are served straight from the cache.
+    mode = current_app.config["ANALYTICS_MODE"]
+    if mode == "scan":
+        batch_size = current_app.config["ANALYTICS_BATCH_SIZE"]
+        compute = lambda: analytics_engine.compute(get_db(), batch_size)
+    elif mode == "columnar":
+        store = cohort_store.get_cohort_store()
+        compute = lambda: analytics_engine.payload(get_db(), store.counts())
+    else:
+        compute = lambda: analytics_payload(get_db())
+    payload = cache.get_analytics_cache().get_or_compute(
+        ("analytics", cache.data_version()), compute,
+    )
+    return render_template("analytics.html", **payload)
+
+
+def analytics_payload(conn):
+    # Every query below reads the trigger-maintained summary tables
+    # (summaries.py) rather than aggregating the relationship tables.
 
     # Simple "most common" stats for potential cards (you can ignore in HTML if not used)
     common_condition = conn.execute(
         '''
-        SELECT c.name, COUNT(*) AS total
-        FROM PatientCondition pc
-        JOIN "Condition" c ON pc.condition_id = c.condition_id
-        GROUP BY c.condition_id
+        SELECT c.name, s.total_patients AS total
+        FROM summary_condition s
+        JOIN "Condition" c ON s.condition_id = c.condition_id
         ORDER BY total DESC
         LIMIT 1
         '''
@@ -879,9 +990,8 @@ def analytics():
 
     common_blood = conn.execute(
         '''
-        SELECT blood_type, COUNT(*) AS total
-        FROM Patient
-        GROUP BY blood_type
+        SELECT blood_type, total
+        FROM summary_blood_type
         ORDER BY total DESC
         LIMIT 1
         '''
@@ -889,10 +999,9 @@ def analytics():
 
     common_vaccine = conn.execute(
         '''
-        SELECT v.name, COUNT(*) AS total
-        FROM PatientImmunization pi
-        JOIN Vaccine v ON pi.vaccine_id = v.vaccine_id
-        GROUP BY v.vaccine_id
+        SELECT v.name, s.total_doses AS total
+        FROM summary_vaccine s
+        JOIN Vaccine v ON s.vaccine_id = v.vaccine_id
         ORDER BY total DESC
         LIMIT 1
         '''
@@ -902,11 +1011,10 @@ def analytics():
     cond_rows = conn.execute(
         '''
         SELECT c.name AS condition_name,
-               COUNT(DISTINCT pc.patient_id) AS total_patients
-        FROM PatientCondition pc
-        JOIN "Condition" c ON pc.condition_id = c.condition_id
-        GROUP BY c.condition_id
-        ORDER BY total_patients DESC
+               s.total_patients
+        FROM summary_condition s
+        JOIN "Condition" c ON s.condition_id = c.condition_id
+        ORDER BY s.total_patients DESC
         LIMIT 5
         '''
     ).fetchall()
@@ -920,16 +1028,14 @@ def analytics():
         FROM (
             SELECT
                 c.name AS condition_name,
-                p.gender,
-                COUNT(*) AS total,
+                s.gender,
+                s.total,
                 ROW_NUMBER() OVER (
-                    PARTITION BY c.condition_id
-                    ORDER BY COUNT(*) DESC
+                    PARTITION BY s.condition_id
+                    ORDER BY s.total DESC
                 ) AS rn
-            FROM PatientCondition pc
-            JOIN Patient p ON pc.patient_id = p.patient_id
-            JOIN "Condition" c ON pc.condition_id = c.condition_id
-            GROUP BY c.condition_id, p.gender
+            FROM summary_condition_gender s
+            JOIN "Condition" c ON s.condition_id = c.condition_id
         )
         WHERE rn = 1
         ORDER BY total DESC;
@@ -943,16 +1049,14 @@ def analytics():
         FROM (
             SELECT
                 c.name AS condition_name,
-                p.blood_type,
-                COUNT(*) AS total,
+                s.blood_type,
+                s.total,
                 ROW_NUMBER() OVER (
-                    PARTITION BY c.condition_id
-                    ORDER BY COUNT(*) DESC
+                    PARTITION BY s.condition_id
+                    ORDER BY s.total DESC
                 ) AS rn
-            FROM PatientCondition pc
-            JOIN Patient p ON pc.patient_id = p.patient_id
-            JOIN "Condition" c ON pc.condition_id = c.condition_id
-            GROUP BY c.condition_id, p.blood_type
+            FROM summary_condition_blood s
+            JOIN "Condition" c ON s.condition_id = c.condition_id
         )
         WHERE rn = 1
         ORDER BY total DESC;
@@ -963,26 +1067,23 @@ def analytics():
     vaccine_rows = conn.execute(
         '''
         SELECT v.name AS vaccine_name,
-               COUNT(DISTINCT pi.patient_id) AS total_patients
-        FROM PatientImmunization pi
-        JOIN Vaccine v ON pi.vaccine_id = v.vaccine_id
-        GROUP BY v.vaccine_id
-        ORDER BY total_patients DESC;
+               s.total_patients
+        FROM summary_vaccine s
+        JOIN Vaccine v ON s.vaccine_id = v.vaccine_id
+        ORDER BY s.total_patients DESC;
         '''
     ).fetchall()
     vaccine_labels = [row["vaccine_name"] for row in vaccine_rows]
     vaccine_values = [row["total_patients"] for row in vaccine_rows]
 
     # Age groups from birth_year (pie chart)
-    all_birth_years = conn.execute(
+    birth_year_counts = conn.execute(
         '''
-        SELECT birth_year
-        FROM Patient
-        WHERE birth_year IS NOT NULL
+        SELECT birth_year, total
+        FROM summary_birth_year
         '''
     ).fetchall()
 
-    from datetime import date
     current_year = date.today().year
 
     age_bins = {
@@ -993,21 +1094,21 @@ def analytics():
         "65+": 0,
     }
 
-    for row in all_birth_years:
+    for row in birth_year_counts:
         by = row["birth_year"]
         if not by:
             continue
         age = current_year - by
         if age <= 17:
-            age_bins["0-17"] += 1
+            age_bins["0-17"] += row["total"]
         elif age <= 34:
-            age_bins["18-34"] += 1
+            age_bins["18-34"] += row["total"]
         elif age <= 49:
-            age_bins["35-49"] += 1
+            age_bins["35-49"] += row["total"]
         elif age <= 64:
-            age_bins["50-64"] += 1
+            age_bins["50-64"] += row["total"]
         else:
-            age_bins["65+"] += 1
+            age_bins["65+"] += row["total"]
 
     age_labels = list(age_bins.keys())
     age_values = list(age_bins.values())
@@ -1017,12 +1118,11 @@ def analytics():
         """
         SELECT
             c.name AS condition_name,
-            AVG(CAST(strftime('%Y','now') AS INTEGER) - p.birth_year) AS avg_age
-        FROM PatientCondition pc
-        JOIN Patient p ON pc.patient_id = p.patient_id
-        JOIN "Condition" c ON pc.condition_id = c.condition_id
-        WHERE p.birth_year IS NOT NULL
-        GROUP BY c.condition_id
+            CAST(strftime('%Y','now') AS INTEGER)
+                - CAST(s.birth_year_sum AS REAL) / s.birth_year_count AS avg_age
+        FROM summary_condition s
+        JOIN "Condition" c ON s.condition_id = c.condition_id
+        WHERE s.birth_year_count > 0
         ORDER BY avg_age DESC;
         """
     ).fetchall()
@@ -1033,27 +1133,18 @@ def analytics():
     # 🔹 NEW: Most common condition per hospital (table)
     hospital_top = conn.execute(
         """
-        WITH cond_counts AS (
+        WITH ranked AS (
             SELECT
                 h.name AS hospital_name,
                 c.name AS condition_name,
-                COUNT(DISTINCT ph.patient_id) AS total
-            FROM PatientHospital ph
-            JOIN PatientCondition pc ON ph.patient_id = pc.patient_id
-            JOIN "Condition" c ON pc.condition_id = c.condition_id
-            JOIN Hospital h ON ph.hospital_id = h.hospital_id
-            GROUP BY h.hospital_id, c.condition_id
-        ),
-        ranked AS (
-            SELECT
-                hospital_name,
-                condition_name,
-                total,
+                s.total,
                 ROW_NUMBER() OVER (
-                    PARTITION BY hospital_name
-                    ORDER BY total DESC
+                    PARTITION BY h.name
+                    ORDER BY s.total DESC
                 ) AS rn
-            FROM cond_counts
+            FROM summary_hospital_condition s
+            JOIN "Condition" c ON s.condition_id = c.condition_id
+            JOIN Hospital h ON s.hospital_id = h.hospital_id
         )
         SELECT hospital_name, condition_name, total
         FROM ranked
@@ -1062,8 +1153,7 @@ def analytics():
         """
     ).fetchall()
 
-    return render_template(
-        "analytics.html",
+    return dict(
         common_condition=common_condition,
         common_blood=common_blood,
         common_vaccine=common_vaccine,
@@ -1082,16 +1172,89 @@ def analytics():
 
 
 
+# -------------------------------
+# RUNTIME STATS
+# -------------------------------
+@views.route("/stats")
+def stats():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    writer = db.get_writer()
+    slow_log = slow_queries.get_slow_log()
+    store = cohort_store.get_cohort_store()
+    index = bitmap_index.get_bitmap_index()
+    return jsonify(
+        db_pool=db.get_pool().stats(),
+        db_writer=writer.stats() if writer else None,
+        analytics_cache=cache.get_analytics_cache().stats(),
+        chart_cache=cache.get_chart_cache().stats(),
+        catalogs=catalogs.stats(),
+        data_version=cache.data_version(),
+        requests=instrumentation.stats(),
+        slow_queries=slow_log.stats() if slow_log else None,
+        shared_changes=cache.shared_changes_stats(),
+        cohort_store=store.stats() if store else None,
+        bitmap_index=index.stats(),
+        pid=os.getpid(),
+    )
+
+
+@views.route("/slow_queries")
+def slow_query_log():
+    if not require_login():
+        return redirect("/doctor_login")
+
+    slow_log = slow_queries.get_slow_log()
+    return jsonify(slow_log.entries()[::-1] if slow_log else [])
+
+
+# -------------------------------
+# PROMETHEUS METRICS
+# -------------------------------
+@views.route("/metrics")
+def prometheus_metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+
+    # under serve.py, every worker's counters, whichever worker answers
+    sample = metrics.collect()
+    workers = 1
+    shared = metrics.get_shared_metrics()
+    if shared is not None:
+        samples = shared.samples(sample)
+        sample, workers = metrics.combine(samples), len(samples)
+    text = metrics.render(sample, current_app.config["DATABASE"], workers)
+    return Response(text, content_type=metrics.CONTENT_TYPE)
+
+
+# -------------------------------
+# HEALTH CHECK
+# -------------------------------
+@views.route("/healthz")
+def healthz():
+    # for load balancers and serve.py's startup probe; no login needed
+    try:
+        get_db().execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    except sqlite3.Error as exc:
+        return jsonify(status="error", error=str(exc), pid=os.getpid()), 503
+    return jsonify(status="ok", pid=os.getpid())
+
+
 # -------------------------------
 # LOGOUT
 # -------------------------------
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     session.clear()
     return redirect("/doctor_login")
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # the production launcher; `flask --app app run --debug` for development
+    import serve
+
+    serve.main()
 
 
@@ -0,0 +1,307 @@
+"""Route-level benchmark of app.py on synthetic databases of several sizes.
+
+For each scale the database comes from generate_data.py. It is built
+once into --data-dir and reused, and every run works on a fresh copy. A
+doctor logs in through the Flask test client. Then each route below is
+timed:
+
+  lookup_patient, add_condition, add_medication, delete_condition,
+  browse_tables (first page of every table), analytics
+
+Each route gets --warmup untimed requests, then --iterations timed ones.
+Reads and writes rotate over different patients, so the patient chart
+cache does not answer every lookup. For each route it reports:
+
+  p50 / p95 / p99 / mean latency (ms) and sequential throughput (req/s)
+  SQL statements per request, from the app's instrumentation
+  peak Python memory of one request (tracemalloc, measured in separate
+  requests so that tracing does not slow down the timed ones)
+
+Each scale runs in its own process, with a fresh app and caches, and
+also reports its peak RSS. Results go to --out as JSON; --compare prints
+the change against an earlier results file.
+
+    python bench.py [--scales 10000,100000] [--iterations 50] [--warmup 5]
+                    [--data-dir DIR] [--out bench.json] [--compare OLD.json]
+"""
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+import generate_data
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# requests per route used for the tracemalloc peak
+MEMORY_SAMPLES = 3
+
+
+# -------------------------------
+# SCENARIOS
+# -------------------------------
+def sample_targets(path, n):
+    # n patients with a condition to delete, spread over the table
+    conn = sqlite3.connect(path)
+    try:
+        total = conn.execute("SELECT MAX(patient_id) FROM Patient").fetchone()[0]
+        step = max(1, total // (n * 2))
+        rows = conn.execute(
+            "SELECT p.medical_record_number, MIN(pc.rowid) FROM Patient p "
+            "JOIN PatientCondition pc ON pc.patient_id = p.patient_id "
+            "WHERE p.patient_id % ? = 0 GROUP BY p.patient_id "
+            "ORDER BY p.patient_id LIMIT ?",
+            (step, n),
+        ).fetchall()
+    finally:
+        conn.close()
+    if len(rows) < n:
+        sys.exit(f"{path}: only {len(rows)} patients with conditions, need {n}")
+    return rows
+
+
+def scenarios(path, n):
+    # label -> function(i) returning (method, url, request kwargs)
+    import tables
+
+    targets = sample_targets(path, n)
+    first_day = date(2024, 1, 1)
+
+    def day(i):
+        return (first_day + timedelta(days=i)).isoformat()
+
+    out = {
+        "lookup_patient": lambda i: (
+            "POST", "/lookup_patient", {"data": {"mrn": targets[i][0]}}),
+        "add_condition": lambda i: (
+            "POST", "/add_condition", {"data": {
+                "mrn": targets[i][0], "condition_id": "1", "diagnosis_date": day(i)}}),
+        "add_medication": lambda i: (
+            "POST", "/add_medication", {"data": {
+                "mrn": targets[i][0], "medication_id": "1", "condition_id": "1",
+                "prescription_date": day(i)}}),
+        "delete_condition": lambda i: (
+            "POST", "/delete_condition", {"data": {
+                "mrn": targets[i][0], "pc_id": str(targets[i][1])}}),
+    }
+    for name in tables.VIEWS:
+        out[f"browse {name}"] = lambda i, name=name: (
+            "POST", "/browse_tables", {"data": {"table_name": name}})
+    out["analytics"] = lambda i: ("GET", "/analytics", {})
+    return out
+
+
+# -------------------------------
+# ONE SCALE (child process)
+# -------------------------------
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def _sql_count(app, endpoint):
+    stats = app.extensions["instrumentation"].endpoints.get(endpoint)
+    return (stats.sql_count, stats.latency.count) if stats else (0, 0)
+
+
+def run_scale(path, iterations, warmup):
+    os.environ["HEALTHCARE_DB"] = path
+    os.environ["HEALTHCARE_INSTRUMENTATION"] = "1"
+    os.environ["HEALTHCARE_SLOW_QUERY_MS"] = ""  # no EXPLAIN work in the timings
+    sys.path.insert(0, HERE)
+    import app as app_module
+
+    app = app_module.create_app()
+    client = app.test_client()
+    response = client.post("/doctor_login", data={"doctor_id": "1", "password": "alice_pw"})
+    if response.status_code != 302:
+        sys.exit(f"login failed with status {response.status_code}")
+
+    urls = app.url_map.bind("localhost")
+    per_route = warmup + iterations + MEMORY_SAMPLES
+    results = {}
+    for label, request_for in scenarios(path, per_route).items():
+        method, url, _ = request_for(0)
+        endpoint = urls.match(url, method=method)[0]
+
+        def send(i):
+            method, url, kwargs = request_for(i)
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()
+            return response.status_code
+
+        errors = 0
+        for i in range(warmup):
+            errors += send(i) >= 400
+
+        sql_before, count_before = _sql_count(app, endpoint)
+        latencies = []
+        started = time.perf_counter()
+        for i in range(warmup, warmup + iterations):
+            t = time.perf_counter()
+            errors += send(i) >= 400
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        sql_after, count_after = _sql_count(app, endpoint)
+
+        peaks = []
+        tracemalloc.start()
+        for i in range(warmup + iterations, per_route):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            errors += send(i) >= 400
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+        ordered = sorted(latencies)
+        results[label] = {
+            "requests": iterations,
+            "errors": errors,
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+            "mean_ms": round(sum(latencies) / iterations * 1000, 3),
+            "rps": round(iterations / elapsed, 1),
+            "sql_per_request": round(
+                (sql_after - sql_before) / max(1, count_after - count_before), 2
+            ),
+            "peak_kb": round(max(peaks) / 1024, 1),
+        }
+
+    import resource
+    return {
+        "routes": results,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+# -------------------------------
+# DRIVER
+# -------------------------------
+def dataset(data_dir, patients, seed):
+    path = os.path.join(data_dir, f"bench_{patients}_{seed}.sqlite")
+    if not os.path.exists(path):
+        print(f"building {path}", flush=True)
+        generate_data.generate(path, patients, seed=seed)
+    return path
+
+
+def row_counts(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in generate_data.PATIENT_TABLES
+        }
+    finally:
+        conn.close()
+
+
+def meta(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "warmup": args.warmup,
+        "seed": args.seed,
+    }
+
+
+def compare(old, new):
+    # p50 / p95 / rps change per route, for every scale in both runs
+    for scale, run in new["scales"].items():
+        before = old["scales"].get(scale)
+        if before is None:
+            continue
+        print(f"\n{int(scale):,} patients vs {old['meta'].get('commit') or 'previous'}")
+        print(f"{'route':<28} {'p50 ms':>16} {'p95 ms':>16} {'req/s':>16}")
+        for label, r in run["routes"].items():
+            b = before["routes"].get(label)
+            if b is None:
+                continue
+            cells = []
+            for key in ("p50_ms", "p95_ms", "rps"):
+                change = (r[key] - b[key]) / b[key] * 100 if b[key] else 0.0
+                cells.append(f"{r[key]:>8} {change:+6.0f}%")
+            print(f"{label:<28} " + " ".join(f"{c:>16}" for c in cells))
+
+
+def report(results):
+    for scale, run in results["scales"].items():
+        print(f"\n{int(scale):,} patients (peak RSS {run['peak_rss_mb']} MB)")
+        print(f"{'route':<28} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} "
+              f"{'sql/req':>8} {'peak KB':>8} {'err':>4}")
+        for label, r in run["routes"].items():
+            print(f"{label:<28} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+                  f"{r['rps']:>8} {r['sql_per_request']:>8} {r['peak_kb']:>8} "
+                  f"{r['errors']:>4}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the routes of app.py.")
+    parser.add_argument("--scales", default="10000,100000",
+                        help="comma-separated patient counts")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=111)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "healthcare_bench"),
+                        help="where the synthetic databases are kept between runs")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="an earlier --out file to compare against")
+    parser.add_argument("--scale-db", help=argparse.SUPPRESS)  # child process
+    args = parser.parse_args()
+
+    if args.scale_db:
+        json.dump(run_scale(args.scale_db, args.iterations, args.warmup), sys.stdout)
+        sys.exit(0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {"meta": meta(args), "scales": {}}
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for patients in [int(s) for s in args.scales.split(",")]:
+            source = dataset(args.data_dir, patients, args.seed)
+            path = os.path.join(workdir, "bench.sqlite")
+            shutil.copy(source, path)
+            print(f"benchmarking {patients:,} patients", flush=True)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--scale-db", path,
+                 "--iterations", str(args.iterations), "--warmup", str(args.warmup)],
+                capture_output=True, text=True,
+            )
+            if child.returncode != 0:
+                sys.exit(child.stderr)
+            run = json.loads(child.stdout)
+            run["rows"] = row_counts(source)
+            results["scales"][str(patients)] = run
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    report(results)
+    print(f"\nresults written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,442 @@
+"""In-memory inverted index from conditions, medications and vaccines to patients.
+
+Each condition_id, medication_id and vaccine_id maps to a bitmap of the
+patients that have it. A bitmap keeps one Python int per 65,536-id chunk
+of the patient_id space. Empty chunks are left out, and each int is only
+as long as its highest set bit. Set algebra is a few big-int operations
+per chunk, and a count is int.bit_count(). A question such as
+
+    condition:"Type 2 Diabetes" AND condition:Hypertension AND NOT medication:Metformin
+
+is answered in microseconds without touching SQLite. /cohort?q=... takes
+such an expression and returns the count and the first MRNs.
+
+Expressions combine kind:value terms with AND, OR, NOT and parentheses.
+NOT binds tightest, then AND, then OR. A value is an id, a name, or a
+"quoted name" when it has spaces; names match case-insensitively.
+
+The index is loaded on first use and kept current from change_log.py.
+Before each query it rereads only the patients logged since the last
+one. Writes from the add_/delete_ routes, other workers and imports
+therefore show up in the next answer.
+
+    python bitmap_index.py [path/to/db.sqlite] 'EXPRESSION' ...
+"""
+import re
+import threading
+import time
+
+from flask import current_app
+
+import change_log
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# kind -> (relationship table, id column, catalog table)
+KINDS = {
+    "condition": ("PatientCondition", "condition_id", '"Condition"'),
+    "medication": ("PatientMedication", "medication_id", "Medication"),
+    "vaccine": ("PatientImmunization", "vaccine_id", "Vaccine"),
+}
+
+# a refresh rereads at most this many patients; more reload everything
+MAX_PATIENT_REFRESH = 20000
+
+# rows per fetchmany() call while loading
+BATCH_SIZE = 50000
+
+
+# -------------------------------
+# BITMAP
+# -------------------------------
+class Bitmap:
+    # A set of patient ids as {chunk number: int with bit (id & CHUNK_MASK)
+    # set}. The operators return new bitmaps and never change their inputs.
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks=None):
+        self.chunks = chunks if chunks is not None else {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        lows = {}
+        for patient_id in ids:
+            lows.setdefault(patient_id >> CHUNK_BITS, []).append(patient_id & CHUNK_MASK)
+        chunks = {}
+        for chunk, values in lows.items():
+            bits = bytearray((max(values) >> 3) + 1)
+            for low in values:
+                bits[low >> 3] |= 1 << (low & 7)
+            chunks[chunk] = int.from_bytes(bits, "little")
+        return cls(chunks)
+
+    def __contains__(self, patient_id):
+        bits = self.chunks.get(patient_id >> CHUNK_BITS, 0)
+        return bool(bits >> (patient_id & CHUNK_MASK) & 1)
+
+    def update(self, other):
+        # add other's ids, in place
+        for chunk, bits in other.chunks.items():
+            self.chunks[chunk] = self.chunks.get(chunk, 0) | bits
+
+    def difference_update(self, other):
+        # remove other's ids, in place: one AND per chunk finds the ones
+        # this bitmap holds, however many there are
+        for chunk, drop in other.chunks.items():
+            bits = self.chunks.get(chunk)
+            if bits is None:
+                continue
+            held = bits & drop
+            if not held:
+                continue
+            bits ^= held
+            if bits:
+                self.chunks[chunk] = bits
+            else:
+                del self.chunks[chunk]
+
+    def __and__(self, other):
+        if len(other.chunks) < len(self.chunks):
+            self, other = other, self
+        chunks = {}
+        for chunk, bits in self.chunks.items():
+            bits &= other.chunks.get(chunk, 0)
+            if bits:
+                chunks[chunk] = bits
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for chunk, bits in other.chunks.items():
+            chunks[chunk] = chunks.get(chunk, 0) | bits
+        return Bitmap(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for chunk, bits in self.chunks.items():
+            drop = other.chunks.get(chunk)
+            if drop:
+                bits ^= bits & drop  # a & ~b without building ~b
+            if bits:
+                chunks[chunk] = bits
+        return Bitmap(chunks)
+
+    def __len__(self):
+        return sum(bits.bit_count() for bits in self.chunks.values())
+
+    def ids(self, limit=None):
+        # ascending patient ids, the first `limit` of them
+        out = []
+        for chunk in sorted(self.chunks):
+            bits, base = self.chunks[chunk], chunk << CHUNK_BITS
+            while bits and (limit is None or len(out) < limit):
+                lowest = bits & -bits
+                out.append(base + lowest.bit_length() - 1)
+                bits ^= lowest
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+
+    def nbytes(self):
+        return sum((bits.bit_length() + 7) // 8 for bits in self.chunks.values())
+
+
+# -------------------------------
+# EXPRESSIONS
+# -------------------------------
+# ( ) | kind:value | kind:"quoted value" | AND / OR / NOT | anything else
+TOKEN = re.compile(r'\s*(?:(\()|(\))|(\w+)\s*:\s*("[^"]*"|[^\s()]+)|([^\s()]+))')
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None:  # an unterminated quote
+            raise ValueError(f"cannot read {expression[position:].strip()!r}")
+        opening, closing, kind, value, word = match.groups()
+        if opening or closing:
+            tokens.append(opening or closing)
+        elif kind:
+            tokens.append((kind.lower(), value.strip('"')))
+        elif word.upper() in ("AND", "OR", "NOT"):
+            tokens.append(word.upper())
+        else:
+            raise ValueError(f"expected kind:value, AND, OR or NOT, got {word!r}")
+        position = match.end()
+    return tokens
+
+
+class _Evaluator:
+    # Recursive descent over the tokens, computing the bitmap as it goes:
+    #   expr := term (OR term)*    term := factor (AND factor)*
+    #   factor := NOT factor | ( expr ) | kind:value
+
+    def __init__(self, tokens, leaf, universe):
+        self.tokens = tokens
+        self.at = 0
+        self.leaf = leaf
+        self.universe = universe
+
+    def peek(self):
+        return self.tokens[self.at] if self.at < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("expression ends too early")
+        self.at += 1
+        return token
+
+    def run(self):
+        if not self.tokens:
+            raise ValueError("empty expression")
+        result = self.expr()
+        if self.peek() is not None:
+            raise ValueError(f"unexpected {self.peek()!r}")
+        return result
+
+    def expr(self):
+        result = self.term()
+        while self.peek() == "OR":
+            self.take()
+            result = result | self.term()
+        return result
+
+    def term(self):
+        result = self.factor()
+        while self.peek() == "AND":
+            self.take()
+            if self.peek() == "NOT":  # A AND NOT B without building NOT B
+                self.take()
+                result = result - self.factor()
+            else:
+                result = result & self.factor()
+        return result
+
+    def factor(self):
+        token = self.take()
+        if token == "NOT":
+            return self.universe - self.factor()
+        if token == "(":
+            result = self.expr()
+            if self.peek() != ")":
+                raise ValueError("missing )")
+            self.take()
+            return result
+        if isinstance(token, tuple):
+            return self.leaf(*token)
+        raise ValueError(f"unexpected {token!r}")
+
+
+# -------------------------------
+# INDEX
+# -------------------------------
+def _rows(conn, sql, params=()):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+    cursor.close()
+
+
+def _chunks(ids, size=500):
+    ids = sorted(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+class BitmapIndex:
+    def __init__(self, pool):
+        self.pool = pool
+        self.seq = None  # change_log position applied; None until loaded
+        self.patients = Bitmap()
+        self.bitmaps = {kind: {} for kind in KINDS}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.refreshes = 0
+        self.patients_refreshed = 0
+        self.queries = 0
+        self.last_load_ms = None
+
+    def _load(self, conn):
+        started = time.perf_counter()
+        self.seq = change_log.latest(conn)
+        self.patients = Bitmap.from_ids(
+            patient_id for (patient_id,) in _rows(conn, "SELECT patient_id FROM Patient")
+        )
+        for kind, (table, column, _) in KINDS.items():
+            members = {}
+            for item_id, patient_id in _rows(conn, f"SELECT {column}, patient_id FROM {table}"):
+                members.setdefault(item_id, []).append(patient_id)
+            self.bitmaps[kind] = {
+                item_id: Bitmap.from_ids(ids) for item_id, ids in members.items()
+            }
+        self.loads += 1
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def _reload_patients(self, conn, patient_ids):
+        # Clear the changed patients from the bitmaps they were in, then
+        # add back what they have now. The changed patients form one
+        # bitmap, so clearing costs one AND per bitmap and chunk, not one
+        # bit operation per patient and bitmap.
+        changed = Bitmap.from_ids(patient_ids)
+        self.patients.difference_update(changed)
+        for bitmaps in self.bitmaps.values():
+            for bitmap in bitmaps.values():
+                bitmap.difference_update(changed)
+
+        patients = []
+        members = {kind: {} for kind in KINDS}
+        for chunk in _chunks(patient_ids):
+            marks = ",".join("?" * len(chunk))
+            patients.extend(
+                patient_id for (patient_id,) in _rows(
+                    conn, f"SELECT patient_id FROM Patient WHERE patient_id IN ({marks})", chunk
+                )
+            )
+            for kind, (table, column, _) in KINDS.items():
+                for item_id, patient_id in _rows(
+                    conn,
+                    f"SELECT {column}, patient_id FROM {table} WHERE patient_id IN ({marks})",
+                    chunk,
+                ):
+                    members[kind].setdefault(item_id, []).append(patient_id)
+
+        self.patients.update(Bitmap.from_ids(patients))
+        for kind, items in members.items():
+            bitmaps = self.bitmaps[kind]
+            for item_id, ids in items.items():
+                bitmaps.setdefault(item_id, Bitmap()).update(Bitmap.from_ids(ids))
+        self.refreshes += 1
+        self.patients_refreshed += len(patient_ids)
+
+    def _refresh(self, conn):
+        if self.seq is None:
+            change_log.ensure(conn)  # the log runs once it has a reader
+        # one read transaction, so the log position matches the rows read
+        conn.execute("BEGIN")
+        try:
+            if self.seq is None:
+                self._load(conn)
+                return
+            changed, last = change_log.since(conn, self.seq)
+            if changed is None or len(changed) > MAX_PATIENT_REFRESH:
+                self._load(conn)
+                return
+            if changed:
+                self._reload_patients(conn, changed)
+            self.seq = last
+        finally:
+            conn.execute("COMMIT")
+
+    def refresh(self):
+        conn = self.pool.acquire()
+        try:
+            with self._lock:
+                self._refresh(conn)
+        finally:
+            self.pool.release(conn)
+
+    def _item_id(self, conn, kind, value):
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind {kind!r}; use one of {', '.join(KINDS)}")
+        if value.isdigit():
+            return int(value)
+        _, column, catalog = KINDS[kind]
+        row = conn.execute(
+            f"SELECT {column} FROM {catalog} WHERE name = ? COLLATE NOCASE "
+            f"ORDER BY {column} LIMIT 1",
+            (value,),
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"no {kind} named {value!r}")
+        return row[0]
+
+    def query(self, expression):
+        # the patients matching the expression (a new Bitmap); ValueError
+        # for an expression that can't be read
+        tokens = tokenize(expression)
+        conn = self.pool.acquire()
+        try:
+            with self._lock:
+                self._refresh(conn)
+
+                def leaf(kind, value):
+                    item_id = self._item_id(conn, kind, value)
+                    return self.bitmaps[kind].get(item_id) or Bitmap()
+
+                result = _Evaluator(tokens, leaf, self.patients).run()
+                # a bare term is the stored bitmap itself; hand out a copy
+                result = Bitmap(dict(result.chunks))
+                self.queries += 1
+                return result
+        finally:
+            self.pool.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "seq": self.seq,
+                "patients": len(self.patients),
+                "bitmaps": {kind: len(bitmaps) for kind, bitmaps in self.bitmaps.items()},
+                "bytes": self.patients.nbytes() + sum(
+                    bitmap.nbytes()
+                    for bitmaps in self.bitmaps.values() for bitmap in bitmaps.values()
+                ),
+                "loads": self.loads,
+                "refreshes": self.refreshes,
+                "patients_refreshed": self.patients_refreshed,
+                "queries": self.queries,
+                "last_load_ms": self.last_load_ms,
+            }
+
+
+# -------------------------------
+# FLASK WIRING
+# -------------------------------
+def init_app(app):
+    # needs db.init_app(app) to have run first; loads on the first query
+    app.config.setdefault("COHORT_MAX_RESULTS", 500)
+    app.extensions["bitmap_index"] = BitmapIndex(app.extensions["db_pool"])
+
+
+def get_bitmap_index():
+    return current_app.extensions["bitmap_index"]
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    import db
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    args = sys.argv[1:]
+    path = os.path.join(here, "healthcare_analytics.sqlite")
+    if args and os.path.exists(args[0]):
+        path = args.pop(0)
+    pool = db.ConnectionPool(path, size=1)
+    index = BitmapIndex(pool)
+    index.refresh()
+    stats = index.stats()
+    print(f"loaded in {stats['last_load_ms']} ms: {stats['patients']:,} patients, "
+          f"{sum(stats['bitmaps'].values())} bitmaps, {stats['bytes'] / 2**20:.1f} MB")
+    for expression in args:
+        try:
+            started = time.perf_counter()
+            patients = index.query(expression)
+            count = len(patients)
+            micros = (time.perf_counter() - started) * 1e6
+        except ValueError as exc:
+            print(f"{expression}: {exc}")
+            continue
+        print(f"{expression}: {count:,} patients in {micros:,.0f} us")
+    pool.close_all()
@@ -0,0 +1,464 @@
+"""Bulk import of patients with their conditions, medications and
+immunizations.
+
+Two input formats:
+
+  NDJSON  one patient per line, children nested:
+          {"mrn": "MRN-1", "birth_year": 1980, "gender": "Female",
+           "blood_type": "O+",
+           "conditions":    [{"condition": "Asthma", "diagnosis_date": "2024-01-02"}],
+           "medications":   [{"medication": "Albuterol", "condition": "Asthma"}],
+           "immunizations": [{"vaccine": "Influenza", "admin_date": "2024-10-01"}]}
+  CSV     one record per row; a record_type column (patient, condition,
+          medication, immunization) says which, and every row carries mrn
+
+Catalog entries may be given by name (condition, medication, vaccine) or
+id (condition_id, ...). Blank dates default to today and a blank doctor_id
+to the importing doctor, as on the add_* forms. Records are processed in
+chunks; each chunk is validated with a handful of set-based lookups and
+written with executemany inside one transaction. Rows that fail validation
+are reported by input line and skipped; the rest of the chunk still loads.
+
+    python bulk_import.py FILE [--db PATH] [--doctor-id N]
+                          [--create-catalog] [--chunk-size N]
+"""
+import csv
+import json
+import sqlite3
+import sys
+from datetime import date
+
+RECORD_TYPES = ("patient", "condition", "medication", "immunization")
+
+# NDJSON key holding nested children -> their record type
+NESTED = {
+    "conditions": "condition",
+    "medications": "medication",
+    "immunizations": "immunization",
+}
+
+# catalog -> (table, id column)
+CATALOG_TABLES = {
+    "condition": ('"Condition"', "condition_id"),
+    "medication": ("Medication", "medication_id"),
+    "vaccine": ("Vaccine", "vaccine_id"),
+}
+
+MRN_LOOKUP_SQL = '''
+    SELECT p.medical_record_number, p.patient_id
+    FROM json_each(?) AS j
+    CROSS JOIN Patient p
+        ON p.medical_record_number = j.value
+'''
+
+
+# -------------------------------
+# READERS
+# -------------------------------
+# Both yield (line number, record type, fields). A line that can't be
+# parsed comes through with record type None and fields {"error": ...}.
+def read_ndjson(lines):
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, {"error": f"invalid JSON: {e}"}
+            continue
+        if not isinstance(obj, dict):
+            yield line_no, None, {"error": "expected a JSON object"}
+            continue
+
+        # flat records (with record_type) are accepted too
+        if "record_type" in obj:
+            yield line_no, str(obj["record_type"]).strip().lower(), obj
+            continue
+
+        yield line_no, "patient", obj
+        for key, record_type in NESTED.items():
+            children = obj.get(key) or []
+            if not isinstance(children, list):
+                yield line_no, None, {"error": f"{key} must be a list"}
+                continue
+            for child in children:
+                if not isinstance(child, dict):
+                    yield line_no, None, {"error": f"{key} entries must be objects"}
+                    continue
+                yield line_no, record_type, dict(child, mrn=obj.get("mrn"))
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        record_type = (row.get("record_type") or "patient").strip().lower()
+        yield reader.line_num, record_type, row
+
+
+def reader_for(filename, fmt=None):
+    fmt = fmt or filename.rsplit(".", 1)[-1].lower()
+    if fmt == "csv":
+        return read_csv
+    if fmt in ("ndjson", "jsonl", "json"):
+        return read_ndjson
+    return None
+
+
+# -------------------------------
+# FIELD PARSING
+# -------------------------------
+class RowError(Exception):
+    pass
+
+
+def _text(fields, key):
+    value = fields.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int(fields, key):
+    value = _text(fields, key)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{key} must be a whole number, got {value!r}")
+
+
+def _date(fields, key):
+    value = _text(fields, key)
+    if value is None:
+        return date.today().isoformat()
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise RowError(f"{key} must be a YYYY-MM-DD date, got {value!r}")
+
+
+# -------------------------------
+# IMPORTER
+# -------------------------------
+class Importer:
+    # Accumulates counts and errors across chunks. load_chunk() is shaped as
+    # a write job (conn first) so it runs inside whatever transaction the
+    # caller opens for it -- db.write() in the app, BEGIN IMMEDIATE here.
+
+    def __init__(self, doctor_id=None, create_catalog=False, max_errors=1000):
+        self.doctor_id = doctor_id
+        self.create_catalog = create_catalog
+        self.max_errors = max_errors
+        self.counts = dict.fromkeys(RECORD_TYPES, 0)
+        self.duplicates = 0
+        self.errors = []  # (line, message), first max_errors of them
+        self.error_count = 0
+        self.patient_ids = set()  # existing patients given new rows
+        self.catalog_changed = False
+        self._catalogs = None  # catalog -> {casefolded name: id}
+        self._catalog_ids = None  # catalog -> {ids}
+        self._doctors = None
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    def _load_reference_data(self, conn):
+        self._catalogs = {}
+        self._catalog_ids = {}
+        for catalog, (table, id_col) in CATALOG_TABLES.items():
+            rows = conn.execute(f"SELECT {id_col}, name FROM {table}").fetchall()
+            self._catalogs[catalog] = {row[1].casefold(): row[0] for row in rows}
+            self._catalog_ids[catalog] = {row[0] for row in rows}
+        self._doctors = {
+            row[0] for row in conn.execute("SELECT doctor_id FROM Doctor")
+        }
+
+    def _catalog_id(self, conn, catalog, fields, created):
+        # id column wins over name; unknown names are created only when
+        # create_catalog is on (new ids are kept in `created` until commit)
+        table, id_col = CATALOG_TABLES[catalog]
+        ref_id = _int(fields, id_col)
+        if ref_id is not None:
+            if (ref_id not in self._catalog_ids[catalog]
+                    and ref_id not in created[catalog].values()):
+                raise RowError(f"unknown {id_col} {ref_id}")
+            return ref_id
+
+        name = _text(fields, catalog)
+        if name is None:
+            raise RowError(f"{catalog} or {id_col} is required")
+        key = name.casefold()
+        ref_id = self._catalogs[catalog].get(key, created[catalog].get(key))
+        if ref_id is None:
+            if not self.create_catalog:
+                raise RowError(f"unknown {catalog} {name!r}")
+            ref_id = conn.execute(
+                f"INSERT INTO {table} (name) VALUES (?)", (name,)
+            ).lastrowid
+            created[catalog][key] = ref_id
+        return ref_id
+
+    def _doctor(self, fields):
+        doctor_id = _int(fields, "doctor_id")
+        if doctor_id is None:
+            doctor_id = self.doctor_id
+        if doctor_id is None:
+            raise RowError("doctor_id is required")
+        if doctor_id not in self._doctors:
+            raise RowError(f"unknown doctor_id {doctor_id}")
+        return doctor_id
+
+    def load_chunk(self, conn, records):
+        if self._catalogs is None:
+            self._load_reference_data(conn)
+
+        errors = []
+        counts = dict.fromkeys(RECORD_TYPES, 0)
+        created = {catalog: {} for catalog in CATALOG_TABLES}
+
+        # 1. every MRN in the chunk, resolved in one idx_patient_mrn pass
+        mrns = {_text(fields, "mrn") for _, rt, fields in records if rt}
+        mrns.discard(None)
+        known = dict(conn.execute(MRN_LOOKUP_SQL, (json.dumps(sorted(mrns)),)))
+
+        # 2. new patients
+        patients = {}
+        for line, record_type, fields in records:
+            if record_type != "patient":
+                continue
+            try:
+                mrn = _text(fields, "mrn")
+                if mrn is None:
+                    raise RowError("mrn is required")
+                if mrn in known or mrn in patients:
+                    raise RowError(f"a patient with MRN {mrn!r} already exists")
+                patients[mrn] = (
+                    mrn,
+                    _int(fields, "birth_year"),
+                    _text(fields, "gender"),
+                    _text(fields, "blood_type"),
+                )
+            except RowError as e:
+                errors.append((line, str(e)))
+
+        if patients:
+            conn.executemany(
+                "INSERT INTO Patient "
+                "(medical_record_number, birth_year, gender, blood_type) "
+                "VALUES (?, ?, ?, ?)",
+                list(patients.values()),
+            )
+            new_ids = dict(conn.execute(MRN_LOOKUP_SQL, (json.dumps(list(patients)),)))
+            counts["patient"] = len(new_ids)
+        else:
+            new_ids = {}
+
+        # 3. child rows, grouped per table
+        conditions, medications, immunizations = [], [], []
+        touched = set()
+        for line, record_type, fields in records:
+            if record_type == "patient":
+                continue
+            if record_type is None:
+                errors.append((line, fields["error"]))
+                continue
+            try:
+                if record_type not in RECORD_TYPES:
+                    raise RowError(f"unknown record_type {record_type!r}")
+                mrn = _text(fields, "mrn")
+                pid = new_ids.get(mrn, known.get(mrn))
+                if pid is None:
+                    raise RowError(f"no patient found with MRN {mrn!r}")
+
+                if record_type == "condition":
+                    conditions.append((
+                        pid,
+                        self._catalog_id(conn, "condition", fields, created),
+                        _date(fields, "diagnosis_date"),
+                        self._doctor(fields),
+                    ))
+                elif record_type == "medication":
+                    if not (_text(fields, "condition")
+                            or _text(fields, "condition_id")):
+                        raise RowError("a condition is required for each medication")
+                    medications.append((
+                        pid,
+                        self._catalog_id(conn, "medication", fields, created),
+                        _date(fields, "prescription_date"),
+                        self._doctor(fields),
+                        self._catalog_id(conn, "condition", fields, created),
+                    ))
+                else:
+                    immunizations.append((
+                        pid,
+                        self._catalog_id(conn, "vaccine", fields, created),
+                        _date(fields, "admin_date"),
+                    ))
+                if mrn in known:
+                    touched.add(pid)
+            except RowError as e:
+                errors.append((line, str(e)))
+
+        # a condition row updates the existing diagnosis, like add_condition
+        duplicates = 0
+        if conditions:
+            conn.executemany(
+                '''
+                INSERT INTO PatientCondition
+                    (patient_id, condition_id, diagnosis_date, doctor_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (patient_id, condition_id) DO UPDATE SET
+                    diagnosis_date = excluded.diagnosis_date,
+                    doctor_id = excluded.doctor_id
+                ''',
+                conditions,
+            )
+            counts["condition"] = len(conditions)
+        if medications:
+            cur = conn.executemany(
+                '''
+                INSERT INTO PatientMedication
+                    (patient_id, medication_id, prescription_date, doctor_id, condition_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                ''',
+                medications,
+            )
+            counts["medication"] = cur.rowcount
+            duplicates += len(medications) - cur.rowcount
+        if immunizations:
+            cur = conn.executemany(
+                '''
+                INSERT INTO PatientImmunization (patient_id, vaccine_id, admin_date)
+                VALUES (?, ?, ?)
+                ON CONFLICT DO NOTHING
+                ''',
+                immunizations,
+            )
+            counts["immunization"] = cur.rowcount
+            duplicates += len(immunizations) - cur.rowcount
+
+        # every statement went through; fold this chunk into the totals
+        for record_type, n in counts.items():
+            self.counts[record_type] += n
+        self.duplicates += duplicates
+        for line, message in sorted(errors):
+            self.error(line, message)
+        self.patient_ids |= touched
+        for catalog, names in created.items():
+            if names:
+                self._catalogs[catalog].update(names)
+                self._catalog_ids[catalog].update(names.values())
+                self.catalog_changed = True
+
+    def report(self):
+        return {
+            "imported": dict(self.counts),
+            "duplicates": self.duplicates,
+            "error_count": self.error_count,
+            "errors": [{"line": line, "error": msg} for line, msg in self.errors],
+        }
+
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def readable(records, importer):
+    # Stop at input that can't be read (bytes that aren't UTF-8, a broken
+    # CSV quote, a dropped upload) and report it. The records before it
+    # still load: the chunk in progress is flushed as usual.
+    line_no = 0
+    try:
+        for record in records:
+            line_no = record[0]
+            yield record
+    except (UnicodeDecodeError, csv.Error, OSError) as e:
+        importer.error(line_no + 1, f"cannot read the file after line {line_no}, "
+                                    f"the rest was not imported: {e}")
+
+
+def run(records, submit, chunk_size=5000, importer=None, **options):
+    # submit(fn, *args) runs fn(conn, *args) in one transaction -- db.write
+    # in the app. A chunk that fails at the database level is rolled back
+    # and reported; the import carries on with the next one. Pass an
+    # Importer to see what was loaded even if this raises.
+    importer = importer or Importer(**options)
+    for chunk in chunked(readable(records, importer), chunk_size):
+        try:
+            submit(importer.load_chunk, chunk)
+        except sqlite3.DatabaseError as e:
+            importer.error(
+                chunk[0][0],
+                f"lines {chunk[0][0]}-{chunk[-1][0]} rolled back: {e}",
+            )
+            # reload catalogs in case the failure came after they were merged
+            importer._catalogs = None
+    return importer
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    import db
+    import migrations
+
+    default = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "healthcare_analytics.sqlite"
+    )
+    parser = argparse.ArgumentParser(description="Bulk import patients.")
+    parser.add_argument("file")
+    parser.add_argument("--db", default=os.environ.get("HEALTHCARE_DB", default))
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--doctor-id", type=int)
+    parser.add_argument("--create-catalog", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    read = reader_for(args.file, args.format)
+    if read is None:
+        sys.exit("can't tell the format; use --format csv|ndjson")
+
+    migrations.migrate(args.db)
+    conn = db.connect(args.db)
+    conn.isolation_level = None
+
+    def submit(fn, *fn_args):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn(conn, *fn_args)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        importer = run(
+            read(f),
+            submit,
+            chunk_size=args.chunk_size,
+            doctor_id=args.doctor_id,
+            create_catalog=args.create_catalog,
+        )
+    conn.close()
+
+    report = importer.report()
+    for error in report["errors"]:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    print(json.dumps(
+        {k: v for k, v in report.items() if k != "errors"}, indent=2
+    ))
+    sys.exit(1 if importer.error_count else 0)
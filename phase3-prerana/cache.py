@@ -0,0 +1,324 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+_MISSING = object()
+
+
+# -------------------------------
+# DATA VERSION
+# -------------------------------
+class DataVersion:
+    # Bumped by every write route. Cached results are keyed by the version
+    # they were computed at, so a write makes them unreachable at once.
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+# -------------------------------
+# RESULT CACHE (TTL + SIZE BOUND)
+# -------------------------------
+class ResultCache:
+    def __init__(self, max_entries=16, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # computed outside the lock; two requests racing on a cold key
+            # both compute, which is cheaper than serialising every miss
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+# -------------------------------
+# PATIENT CHART CACHE (LRU, BYTE BOUND)
+# -------------------------------
+def approx_size(value):
+    # rough in-memory footprint; good enough to keep the cache bounded
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approx_size(v) for v in value)
+    if isinstance(value, str):
+        return 49 + len(value)
+    return 28
+
+
+class ChartCache:
+    # Assembled patient charts keyed by patient_id, with an MRN index so
+    # lookups by MRN hit too. Least recently used charts are evicted once
+    # the estimated size passes max_bytes.
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._charts = OrderedDict()  # patient_id -> (expires_at, size, chart)
+        self._by_mrn = {}
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, pid):
+        _, size, chart = self._charts.pop(pid)
+        self._by_mrn.pop(chart["patient"]["medical_record_number"], None)
+        self.bytes -= size
+
+    def get_by_mrn(self, mrn):
+        with self._lock:
+            pid = self._by_mrn.get(mrn)
+            entry = self._charts.get(pid) if pid is not None else None
+            if entry is not None and entry[0] > time.monotonic():
+                self._charts.move_to_end(pid)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._drop(pid)
+            self.misses += 1
+            return None
+
+    def epoch(self):
+        # taken before loading a chart from the database; see put()
+        return self._epoch
+
+    def put(self, chart, epoch):
+        size = approx_size(chart)
+        pid = chart["patient"]["patient_id"]
+        with self._lock:
+            # an invalidation landed while this chart was being loaded, so
+            # it may already be stale; don't cache it
+            if epoch != self._epoch or size > self.max_bytes:
+                return
+            if pid in self._charts:
+                self._drop(pid)
+            self._charts[pid] = (time.monotonic() + self.ttl, size, chart)
+            self._by_mrn[chart["patient"]["medical_record_number"]] = pid
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._charts)))
+                self.evictions += 1
+
+    def invalidate(self, *patient_ids):
+        with self._lock:
+            self._epoch += 1
+            for pid in patient_ids:
+                if pid in self._charts:
+                    self._drop(pid)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._charts.clear()
+            self._by_mrn.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._charts),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+# -------------------------------
+# CROSS-PROCESS CHANGES
+# -------------------------------
+class SharedChanges:
+    # Patient ids written by any worker of a prefork server, in a ring in
+    # shared memory. Created before the fork so every worker maps the same
+    # pages; each worker replays the entries it hasn't seen at the start
+    # of a request and drops those patients' charts and its analytics
+    # payload, the way its own writes already do. A worker that falls a
+    # whole ring behind clears its chart cache instead.
+
+    ANY = 0  # entry for a write that touched no particular patient
+
+    def __init__(self, capacity=4096):
+        ctx = multiprocessing.get_context("fork")
+        self.capacity = capacity
+        self._ids = ctx.RawArray("q", capacity)
+        self._origins = ctx.RawArray("q", capacity)  # pid of the writing process
+        self._seq = ctx.RawValue("Q", 0)
+        self._lock = ctx.Lock()
+        self._seen = 0  # per process: copied at fork, then private
+        self._seen_lock = threading.Lock()
+        self.replayed = 0
+        self.overflows = 0
+
+    def publish(self, patient_ids):
+        ids = [pid for pid in patient_ids if pid is not None] or [self.ANY]
+        origin = os.getpid()
+        with self._lock:
+            seq = self._seq.value
+            for pid in ids:
+                self._ids[seq % self.capacity] = pid
+                self._origins[seq % self.capacity] = origin
+                seq += 1
+            self._seq.value = seq
+
+    def pending(self):
+        # ([patient ids], overflowed) written by other processes since the
+        # last call; ([], False) when nothing new
+        if self._seq.value == self._seen:
+            return [], False
+        origin = os.getpid()
+        with self._seen_lock, self._lock:
+            seq = self._seq.value
+            if seq - self._seen > self.capacity:
+                self._seen = seq
+                self.overflows += 1
+                return [], True
+            ids = [
+                self._ids[i % self.capacity]
+                for i in range(self._seen, seq)
+                if self._origins[i % self.capacity] != origin
+            ]
+            self._seen = seq
+        self.replayed += len(ids)
+        return ids, False
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "published": self._seq.value,
+            "replayed": self.replayed,
+            "overflows": self.overflows,
+        }
+
+
+# -------------------------------
+# FLASK INTEGRATION
+# -------------------------------
+def init_app(app):
+    app.config.setdefault("ANALYTICS_CACHE_SIZE", 16)
+    app.config.setdefault("ANALYTICS_CACHE_TTL", 60)
+    app.config.setdefault("CHART_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    app.config.setdefault("CHART_CACHE_TTL", 300)
+
+    app.extensions["data_version"] = DataVersion()
+    app.extensions["analytics_cache"] = ResultCache(
+        max_entries=app.config["ANALYTICS_CACHE_SIZE"],
+        ttl=app.config["ANALYTICS_CACHE_TTL"],
+    )
+    app.extensions["chart_cache"] = ChartCache(
+        max_bytes=app.config["CHART_CACHE_MAX_BYTES"],
+        ttl=app.config["CHART_CACHE_TTL"],
+    )
+
+    # set by a prefork server (serve.py) whose workers each keep caches
+    app.config.setdefault("SHARED_CHANGES", 0)
+    if app.config["SHARED_CHANGES"]:
+        shared = SharedChanges(app.config["SHARED_CHANGES"])
+        app.extensions["shared_changes"] = shared
+        app.before_request(catch_up)
+
+
+def data_version():
+    return current_app.extensions["data_version"].value
+
+
+def bump_data_version():
+    return current_app.extensions["data_version"].bump()
+
+
+def get_analytics_cache():
+    return current_app.extensions["analytics_cache"]
+
+
+def get_chart_cache():
+    return current_app.extensions["chart_cache"]
+
+
+def publish_change(*patient_ids):
+    shared = current_app.extensions.get("shared_changes")
+    if shared is not None:
+        shared.publish(patient_ids)
+
+
+def catch_up():
+    # apply the writes other worker processes made since this one last looked
+    ids, overflowed = current_app.extensions["shared_changes"].pending()
+    if not ids and not overflowed:
+        return
+    bump_data_version()
+    if overflowed:
+        get_chart_cache().clear()
+    else:
+        get_chart_cache().invalidate(*(pid for pid in ids if pid != SharedChanges.ANY))
+
+
+def shared_changes_stats():
+    shared = current_app.extensions.get("shared_changes")
+    return shared.stats() if shared else None
@@ -0,0 +1,121 @@
+import bisect
+import threading
+import time
+
+from flask import current_app
+
+# -------------------------------
+# CATALOG TABLES
+# -------------------------------
+# name -> (SQL table, id column). Each catalog is the dropdown list of an
+# add_* form, sorted by name the way ORDER BY name sorts it.
+CATALOGS = {
+    "Condition": ('"Condition"', "condition_id"),
+    "Medication": ("Medication", "medication_id"),
+    "Vaccine": ("Vaccine", "vaccine_id"),
+}
+
+
+class Catalog:
+    # Sorted (id, name) list of one catalog table, loaded once and kept in
+    # step by add() when a route inserts a new name. ttl (seconds) is an
+    # optional safety net for rows written by another process.
+
+    def __init__(self, pool, table, id_column, ttl=None):
+        self.pool = pool
+        self.table = table
+        self.id_column = id_column
+        self.ttl = ttl
+        self._rows = None
+        self._keys = []  # (name, id) for bisect, parallel to _rows
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+        self.adds = 0
+
+    def _load(self):
+        conn = self.pool.acquire()
+        try:
+            rows = conn.execute(
+                f"SELECT {self.id_column}, name FROM {self.table} ORDER BY name"
+            ).fetchall()
+        finally:
+            self.pool.release(conn)
+
+        rows = [dict(row) for row in rows]
+        # SQLite leaves equal names in any order; pin them by id
+        rows.sort(key=lambda row: (row["name"], row[self.id_column]))
+        self._rows = rows
+        self._keys = [(row["name"], row[self.id_column]) for row in rows]
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    def _stale(self):
+        if self._rows is None:
+            return True
+        return self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+
+    def rows(self):
+        with self._lock:
+            if self._stale():
+                self._load()
+            else:
+                self.hits += 1
+            return self._rows
+
+    def add(self, row_id, name):
+        with self._lock:
+            if self._rows is None:
+                return  # next rows() call loads it, new row included
+            key = (name, row_id)
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                return
+            # copy-on-write: a page rendering the old list keeps a stable one
+            row = {self.id_column: row_id, "name": name}
+            self._rows = self._rows[:i] + [row] + self._rows[i:]
+            self._keys.insert(i, key)
+            self.adds += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._rows) if self._rows is not None else None,
+                "loads": self.loads,
+                "hits": self.hits,
+                "adds": self.adds,
+            }
+
+
+# -------------------------------
+# FLASK INTEGRATION
+# -------------------------------
+def init_app(app):
+    # needs db.init_app(app) to have run first
+    app.config.setdefault("CATALOG_TTL", None)
+    pool = app.extensions["db_pool"]
+    app.extensions["catalogs"] = {
+        name: Catalog(pool, table, id_column, ttl=app.config["CATALOG_TTL"])
+        for name, (table, id_column) in CATALOGS.items()
+    }
+
+
+def get_catalog(name):
+    return current_app.extensions["catalogs"][name]
+
+
+def invalidate_all():
+    for catalog in current_app.extensions["catalogs"].values():
+        catalog.invalidate()
+
+
+def stats():
+    return {
+        name: catalog.stats()
+        for name, catalog in current_app.extensions["catalogs"].items()
+    }
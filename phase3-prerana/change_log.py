@@ -0,0 +1,185 @@
+"""Log of patient writes, for in-memory copies of the patient tables.
+
+Triggers on Patient and the four patient relationship tables append the
+patient_id of every row they insert, update or delete to change_log. A
+process that keeps its own copy of that data (cohort_store.py,
+bitmap_index.py) remembers the last seq it applied and rereads only the
+patients logged after it.
+
+The triggers cost every patient write two more statements (the log
+INSERT and its trim). So migration 6 only creates the table, and each
+reader calls ensure() before its first load, which installs them. A
+database that nothing reads the log from pays nothing. Once installed,
+they stay. With the server stopped, `python change_log.py --drop`
+removes them, and the next reader to load puts them back.
+
+seq is an AUTOINCREMENT key, so it only ever grows, one at a time. The
+log keeps its last KEEP entries: each insert deletes the one entry KEEP
+behind it, by key, so the trim is a rowid lookup whatever sqlite_stat1
+says about the table. A reader that falls further behind must reload
+everything, and so must one that meets a reset entry (patient_id NULL).
+Bulk loads that run without the triggers write a reset entry.
+
+    python change_log.py [--drop] [path/to/db.sqlite]
+"""
+import sqlite3
+import sys
+
+# entries kept; older ones are trimmed as new ones arrive
+KEEP = 100000
+
+CREATE = '''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER
+    )
+'''
+
+# table -> columns whose update changes what a copy of the table holds
+TABLES = {
+    "Patient": "patient_id, birth_year, gender, blood_type",
+    "PatientCondition": "patient_id, condition_id",
+    "PatientMedication": "patient_id, medication_id",
+    "PatientImmunization": "patient_id, vaccine_id",
+    "PatientHospital": "patient_id, hospital_id",
+}
+
+
+# -------------------------------
+# TRIGGERS
+# -------------------------------
+def _log(row):
+    return f"INSERT INTO change_log (patient_id) VALUES ({row}.patient_id)"
+
+
+def triggers():
+    # name -> (trigger header, statements)
+    out = {
+        # An equality on seq, not `seq <= NEW.seq - KEEP`: after an ANALYZE
+        # that saw a near-empty log the planner turns the range into a full
+        # scan of change_log, run on every logged write.
+        "trg_change_log_trim": (
+            "AFTER INSERT ON change_log",
+            [f"DELETE FROM change_log WHERE seq = NEW.seq - {KEEP}"],
+        ),
+    }
+    for table, columns in TABLES.items():
+        name = table.lower()
+        out[f"trg_change_log_{name}_insert"] = (f"AFTER INSERT ON {table}", [_log("NEW")])
+        out[f"trg_change_log_{name}_delete"] = (f"AFTER DELETE ON {table}", [_log("OLD")])
+        out[f"trg_change_log_{name}_update"] = (
+            f"AFTER UPDATE OF {columns} ON {table}",
+            [_log("OLD"), _log("NEW")],
+        )
+    return out
+
+
+def _create_sql(name, header, statements):
+    body = ";\n".join(statements)
+    return f"CREATE TRIGGER {name} {header}\nBEGIN\n{body};\nEND"
+
+
+def install_triggers(conn):
+    for name, (header, statements) in triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(_create_sql(name, header, statements))
+
+
+def drop_triggers(conn):
+    for name in triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def install(conn):
+    conn.execute(CREATE)
+    install_triggers(conn)
+
+
+def installed(conn):
+    # every trigger present and as this module writes it, so a database
+    # with an older definition (the range trim) gets the current one
+    current = dict(
+        conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_change_log_%'"
+        )
+    )
+    return all(
+        current.get(name) == _create_sql(name, header, statements)
+        for name, (header, statements) in triggers().items()
+    )
+
+
+def ensure(conn):
+    # Called by a reader before it loads: install the triggers if no
+    # reader has yet. The reset entry makes any reader that loaded while
+    # they were missing reload. True if this call installed them.
+    if installed(conn):
+        return False
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if installed(conn):  # another process got there first
+            conn.execute("COMMIT")
+            return False
+        install(conn)
+        reset(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+# -------------------------------
+# READERS
+# -------------------------------
+def reset(conn):
+    # tell every reader to reload (after writes the triggers did not see)
+    conn.execute("INSERT INTO change_log (patient_id) VALUES (NULL)")
+
+
+def latest(conn):
+    # seq of the newest entry, 0 for an empty log
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def since(conn, seq):
+    # (patient ids changed after seq, newest seq). The ids are None when
+    # the caller has to reload everything: entries it needed were trimmed,
+    # a reset entry came after seq, or the log is behind seq (another
+    # database file was put in place).
+    rows = conn.execute(
+        "SELECT seq, patient_id FROM change_log WHERE seq > ? ORDER BY seq", (seq,)
+    ).fetchall()
+    if not rows:
+        newest = latest(conn)
+        return (set() if newest == seq else None), newest
+    last = rows[-1][0]
+    if rows[0][0] != seq + 1 or any(patient_id is None for _, patient_id in rows):
+        return None, last
+    return {patient_id for _, patient_id in rows}, last
+
+
+if __name__ == "__main__":
+    import os
+
+    default = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "healthcare_analytics.sqlite"
+    )
+    args = sys.argv[1:]
+    drop = "--drop" in args
+    args = [arg for arg in args if arg != "--drop"]
+    path = args[0] if args else default
+    if drop:
+        conn = sqlite3.connect(path)
+        with conn:
+            drop_triggers(conn)
+        conn.close()
+        print("change_log triggers dropped; readers reinstall them on their next load")
+        sys.exit(0)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    first, count = conn.execute("SELECT MIN(seq), COUNT(*) FROM change_log").fetchone()
+    print(f"latest seq {latest(conn)}, {count} entries kept"
+          + (f" (from seq {first})" if count else "")
+          + ("" if installed(conn) else "; triggers not installed"))
+    conn.close()
@@ -0,0 +1,112 @@
+import json
+
+# -------------------------------
+# PATIENT CHART LOADING
+# -------------------------------
+# A chart is the patient row plus their conditions, medications and
+# vaccines. Charts for any number of MRNs load in four queries: the id
+# list goes in as one JSON parameter and json_each() expands it, so the
+# statement text (and plan) is the same for one patient or a thousand.
+
+# CROSS JOIN pins json_each as the outer loop so every MRN is an
+# idx_patient_mrn lookup, whatever the planner guesses about the list size
+PATIENTS_SQL = '''
+    SELECT p.*
+    FROM json_each(?) AS j
+    CROSS JOIN Patient p
+        ON p.medical_record_number = j.value
+'''
+
+CONDITIONS_SQL = '''
+    SELECT
+        pc.patient_id,
+        pc.rowid AS pc_id,
+        c.name AS condition_name,
+        pc.diagnosis_date,
+        d.name AS doctor_name,
+        GROUP_CONCAT(DISTINCT m.name) AS medications_for_condition
+    FROM PatientCondition pc
+    JOIN "Condition" c
+        ON pc.condition_id = c.condition_id
+    LEFT JOIN Doctor d
+        ON pc.doctor_id = d.doctor_id
+    LEFT JOIN MedicationCondition mc
+        ON c.condition_id = mc.condition_id
+    LEFT JOIN Medication m
+        ON mc.medication_id = m.medication_id
+    WHERE pc.patient_id IN (SELECT value FROM json_each(?))
+    GROUP BY pc.patient_id, pc.condition_id
+    ORDER BY pc.patient_id, pc.diagnosis_date DESC
+'''
+
+MEDICATIONS_SQL = '''
+    SELECT
+        pm.patient_id,
+        pm.rowid AS pm_id,
+        m.name AS medication_name,
+        pm.prescription_date,
+        d.name AS doctor_name,
+        c.name AS prescribed_for_condition
+    FROM PatientMedication pm
+    JOIN Medication m
+        ON pm.medication_id = m.medication_id
+    LEFT JOIN Doctor d
+        ON pm.doctor_id = d.doctor_id
+    LEFT JOIN "Condition" c
+        ON pm.condition_id = c.condition_id
+    WHERE pm.patient_id IN (SELECT value FROM json_each(?))
+    ORDER BY pm.patient_id, pm.prescription_date DESC
+'''
+
+VACCINES_SQL = '''
+    SELECT
+        pi.patient_id,
+        v.name AS vaccine_name,
+        pi.admin_date
+    FROM PatientImmunization pi
+    JOIN Vaccine v
+        ON pi.vaccine_id = v.vaccine_id
+    WHERE pi.patient_id IN (SELECT value FROM json_each(?))
+    ORDER BY pi.patient_id, pi.admin_date DESC
+'''
+
+
+def load_charts(conn, mrns):
+    # MRN -> chart dict for every MRN that exists; unknown MRNs are absent
+    mrns = list(dict.fromkeys(mrns))
+    if not mrns:
+        return {}
+
+    patients = [
+        dict(row) for row in conn.execute(PATIENTS_SQL, (json.dumps(mrns),))
+    ]
+    if not patients:
+        return {}
+
+    by_id = {
+        p["patient_id"]: {
+            "patient": p,
+            "conditions": [],
+            "medications": [],
+            "vaccines": [],
+        }
+        for p in patients
+    }
+    ids = json.dumps(list(by_id))
+
+    for section, sql in (
+        ("conditions", CONDITIONS_SQL),
+        ("medications", MEDICATIONS_SQL),
+        ("vaccines", VACCINES_SQL),
+    ):
+        for row in conn.execute(sql, (ids,)):
+            by_id[row["patient_id"]][section].append(dict(row))
+
+    return {
+        chart["patient"]["medical_record_number"]: chart
+        for chart in by_id.values()
+    }
+
+
+def load_chart(conn, mrn):
+    return load_charts(conn, [mrn]).get(mrn)
@@ -0,0 +1,423 @@
+"""In-memory columnar copy of the patient tables (optional, needs NumPy).
+
+Patient is held as arrays indexed by patient_id: a present mask,
+birth_year (0 for NULL), and gender and blood_type as small integer
+codes. Each relationship table (conditions, medications, immunizations,
+hospitals) is a pair of int32 arrays, patient_id and the foreign key,
+with a live mask. Group-bys are bincounts over combined integer keys,
+and the age histogram is a bincount of birth years, so /analytics built
+this way takes milliseconds even with millions of patients.
+
+The copy is loaded once and then kept current from change_log.py. Each
+refresh reads the patient ids logged since the last one and rereads only
+those patients. When the log has been trimmed past it, or when too many
+patients changed, it reloads everything instead.
+
+Set HEALTHCARE_ANALYTICS_MODE=columnar to serve /analytics from it.
+Without NumPy the setting falls back to the summary tables.
+
+    python cohort_store.py [path/to/db.sqlite]
+
+loads a database, times the analytics counters and checks them against
+analytics_engine.scan().
+"""
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional: only ANALYTICS_MODE=columnar needs it
+    np = None
+
+from flask import current_app
+
+import change_log
+
+# rows per fetchmany() call while loading
+BATCH_SIZE = 50000
+
+# a refresh rereads at most this many patients; more reload everything
+MAX_PATIENT_REFRESH = 20000
+
+# name -> (table, foreign key column)
+PAIRS = {
+    "conditions": ("PatientCondition", "condition_id"),
+    "medications": ("PatientMedication", "medication_id"),
+    "immunizations": ("PatientImmunization", "vaccine_id"),
+    "hospitals": ("PatientHospital", "hospital_id"),
+}
+
+# bincount over combined keys up to this many buckets, np.unique above
+MAX_BUCKETS = 1 << 22
+
+
+# -------------------------------
+# COLUMNS
+# -------------------------------
+class _Codes:
+    # Small integer codes for the values of a text column; 0 is NULL.
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Pairs:
+    # (patient_id, foreign key) rows of one relationship table. Rows of a
+    # changed patient are masked out and its current rows appended; the
+    # arrays are compacted once a quarter of them are dead.
+
+    def __init__(self):
+        self.patient = np.empty(0, np.int32)
+        self.item = np.empty(0, np.int32)
+        self.live = np.empty(0, bool)
+        self.size = 0
+
+    def extend(self, rows):
+        if not len(rows):
+            return
+        need = self.size + len(rows)
+        if need > len(self.patient):
+            capacity = max(need, 2 * len(self.patient))
+            for name in ("patient", "item", "live"):
+                grown = np.empty(capacity, getattr(self, name).dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self.patient[self.size:need] = rows[:, 0]
+        self.item[self.size:need] = rows[:, 1]
+        self.live[self.size:need] = True
+        self.size = need
+
+    def drop(self, patient_ids):
+        live = self.live[:self.size]
+        live &= ~np.isin(self.patient[:self.size], patient_ids)
+        dead = self.size - int(np.count_nonzero(live))
+        if dead > max(1024, self.size // 4):
+            keep = live.copy()
+            n = int(np.count_nonzero(keep))
+            self.patient[:n] = self.patient[:self.size][keep]
+            self.item[:n] = self.item[:self.size][keep]
+            self.live[:n] = True
+            self.size = n
+
+    def rows(self):
+        live = self.live[:self.size]
+        return self.patient[:self.size][live], self.item[:self.size][live]
+
+    def nbytes(self):
+        return self.patient.nbytes + self.item.nbytes + self.live.nbytes
+
+
+def _fetch(conn, sql, params=()):
+    # rows as an (n, 2+) int64 array, read in batches
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        parts.append(np.array(rows, dtype=np.int64))
+    cursor.close()
+    return np.concatenate(parts) if parts else np.empty((0, 2), np.int64)
+
+
+def _chunks(ids, size=500):
+    ids = sorted(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+# -------------------------------
+# VECTORIZED OPERATIONS
+# -------------------------------
+def _pair_counts(a, b):
+    # (a values, b values, counts) of the distinct (a, b) pairs
+    if not len(a):
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty
+    width = int(b.max()) + 1
+    keys = a.astype(np.int64) * width + b
+    if (int(a.max()) + 1) * width <= MAX_BUCKETS:
+        counts = np.bincount(keys)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        keys, counts = np.unique(keys, return_counts=True)
+    return keys // width, keys % width, counts
+
+
+# -------------------------------
+# STORE
+# -------------------------------
+class CohortStore:
+    def __init__(self, pool):
+        self.pool = pool
+        self.seq = None  # change_log position applied; None until loaded
+        self.gender_codes = _Codes()
+        self.blood_codes = _Codes()
+        self.present = np.empty(0, bool)
+        self.birth_year = np.empty(0, np.int16)
+        self.gender = np.empty(0, np.int16)
+        self.blood = np.empty(0, np.int16)
+        self.pairs = {name: _Pairs() for name in PAIRS}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.refreshes = 0
+        self.patients_refreshed = 0
+        self.last_load_ms = None
+        self.last_refresh_ms = None
+        self._version = 0  # bumped by every load or reread
+        self._counted = None  # (_version, counts())
+
+    # ---- loading ----
+    def _grow(self, max_id):
+        if max_id < len(self.present):
+            return
+        capacity = max(max_id + 1, 2 * len(self.present))
+        for name in ("present", "birth_year", "gender", "blood"):
+            old = getattr(self, name)
+            grown = np.zeros(capacity, old.dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def _set_patients(self, conn, where="", params=()):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(
+            f"SELECT patient_id, birth_year, gender, blood_type FROM Patient {where}", params
+        )
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            ids, years, genders, bloods = zip(*rows)
+            ids = np.array(ids, dtype=np.int64)
+            self._grow(int(ids.max()))
+            self.present[ids] = True
+            self.birth_year[ids] = [year or 0 for year in years]
+            self.gender[ids] = [self.gender_codes.encode(g) for g in genders]
+            self.blood[ids] = [self.blood_codes.encode(b) for b in bloods]
+        cursor.close()
+
+    def _load(self, conn):
+        started = time.perf_counter()
+        self.seq = change_log.latest(conn)
+        for name in ("present", "birth_year", "gender", "blood"):
+            setattr(self, name, getattr(self, name)[:0])
+        self._grow(conn.execute("SELECT IFNULL(MAX(patient_id), 0) FROM Patient").fetchone()[0])
+        self._set_patients(conn)
+        for name, (table, column) in PAIRS.items():
+            pairs = self.pairs[name] = _Pairs()
+            pairs.extend(_fetch(conn, f"SELECT patient_id, {column} FROM {table}"))
+        self.loads += 1
+        self._version += 1
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def _reload_patients(self, conn, patient_ids):
+        started = time.perf_counter()
+        ids = np.array(sorted(patient_ids), dtype=np.int64)
+        self._grow(int(ids.max()))
+        self.present[ids] = False
+        for pairs in self.pairs.values():
+            pairs.drop(ids)
+        for chunk in _chunks(patient_ids):
+            marks = ",".join("?" * len(chunk))
+            self._set_patients(conn, f"WHERE patient_id IN ({marks})", chunk)
+            for name, (table, column) in PAIRS.items():
+                self.pairs[name].extend(_fetch(
+                    conn,
+                    f"SELECT patient_id, {column} FROM {table} WHERE patient_id IN ({marks})",
+                    chunk,
+                ))
+        self.refreshes += 1
+        self._version += 1
+        self.patients_refreshed += len(ids)
+        self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def _refresh(self, conn):
+        if self.seq is None:
+            change_log.ensure(conn)  # the log runs once it has a reader
+        # one read transaction, so the log position matches the rows read
+        conn.execute("BEGIN")
+        try:
+            if self.seq is None:
+                self._load(conn)
+                return
+            changed, last = change_log.since(conn, self.seq)
+            if changed is None or len(changed) > MAX_PATIENT_REFRESH:
+                self._load(conn)
+                return
+            if changed:
+                self._reload_patients(conn, changed)
+            self.seq = last
+        finally:
+            conn.execute("COMMIT")
+
+    def refresh(self):
+        conn = self.pool.acquire()
+        try:
+            with self._lock:
+                self._refresh(conn)
+        finally:
+            self.pool.release(conn)
+
+    # ---- queries ----
+    def _known(self, patient_ids):
+        # mask of ids that are rows of Patient (relationship rows of other
+        # ids are left out, as a join with Patient would)
+        inside = patient_ids < len(self.present)
+        known = inside.copy()
+        known[inside] = self.present[patient_ids[inside]]
+        return known
+
+    def counts(self, refresh=True):
+        # analytics_engine.scan()'s counters, from the arrays; kept until
+        # the next refresh that changes something
+        if refresh:
+            self.refresh()
+        with self._lock:
+            if self._counted is None or self._counted[0] != self._version:
+                self._counted = (self._version, self._counts())
+            return self._counted[1]
+
+    def _counts(self):
+        present = self.present
+        genders = self.gender_codes.values
+        bloods = self.blood_codes.values
+
+        blood = np.bincount(self.blood[present])
+        years = np.bincount(self.birth_year[present].astype(np.int64), minlength=1)
+        years[0] = 0  # NULL
+
+        patients, conditions = self.pairs["conditions"].rows()
+        known = self._known(patients)
+        patients, conditions = patients[known], conditions[known]
+        birth_years = self.birth_year[patients].astype(np.int64)
+        has_year = birth_years > 0
+        per_condition = np.bincount(conditions)
+        year_sum = np.bincount(conditions[has_year], weights=birth_years[has_year],
+                               minlength=len(per_condition))
+        year_count = np.bincount(conditions[has_year], minlength=len(per_condition))
+
+        # every (hospital row, condition row) pair of the same patient: the
+        # hospital rows sorted by patient, with each patient's range in them
+        h_patients, h_ids = self.pairs["hospitals"].rows()
+        h_ids = h_ids[np.argsort(h_patients, kind="stable")]
+        per_patient = np.bincount(h_patients, minlength=len(present))[:len(present)]
+        n = per_patient[patients]
+        left = (np.cumsum(per_patient) - per_patient)[patients]
+        starts = np.repeat(left - (np.cumsum(n) - n), n)
+        hospital_ids = h_ids[starts + np.arange(int(n.sum()))]
+
+        v_patients, vaccines = self.pairs["immunizations"].rows()
+        doses = np.bincount(vaccines)
+        vaccinated, _, _ = _pair_counts(vaccines, v_patients)
+        vaccinated = np.bincount(vaccinated, minlength=len(doses))
+
+        def pairs(a, b, decode=None):
+            return {
+                (int(x), decode[y] if decode else int(y)): int(total)
+                for x, y, total in zip(*_pair_counts(a, b))
+            }
+
+        return dict(
+            blood={bloods[code]: int(total) for code, total in enumerate(blood) if total},
+            birth_years={int(year): int(years[year]) for year in np.flatnonzero(years)},
+            condition={
+                int(cid): [int(per_condition[cid]), int(year_sum[cid]), int(year_count[cid])]
+                for cid in np.flatnonzero(per_condition)
+            },
+            condition_gender=pairs(conditions, self.gender[patients], genders),
+            condition_blood=pairs(conditions, self.blood[patients], bloods),
+            hospital_condition=pairs(hospital_ids, np.repeat(conditions, n)),
+            vaccines=[
+                (int(vid), int(doses[vid]), int(vaccinated[vid]))
+                for vid in np.flatnonzero(doses)
+            ],
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "seq": self.seq,
+                "patients": int(np.count_nonzero(self.present)),
+                "rows": {name: int(np.count_nonzero(p.live[:p.size]))
+                         for name, p in self.pairs.items()},
+                "bytes": sum(p.nbytes() for p in self.pairs.values())
+                + sum(getattr(self, name).nbytes
+                      for name in ("present", "birth_year", "gender", "blood")),
+                "loads": self.loads,
+                "refreshes": self.refreshes,
+                "patients_refreshed": self.patients_refreshed,
+                "last_load_ms": self.last_load_ms,
+                "last_refresh_ms": self.last_refresh_ms,
+            }
+
+
+# -------------------------------
+# FLASK WIRING
+# -------------------------------
+def init_app(app):
+    # needs db.init_app(app) to have run first
+    if app.config.get("ANALYTICS_MODE") != "columnar":
+        return
+    if np is None:
+        app.logger.warning(
+            "HEALTHCARE_ANALYTICS_MODE=columnar needs NumPy; using the summary tables"
+        )
+        app.config["ANALYTICS_MODE"] = "summary"
+        return
+    app.extensions["cohort_store"] = CohortStore(app.extensions["db_pool"])
+
+
+def get_cohort_store():
+    return current_app.extensions.get("cohort_store")
+
+
+if __name__ == "__main__":
+    import os
+    import sqlite3
+    import sys
+
+    import analytics_engine
+    import db
+
+    if np is None:
+        sys.exit("cohort_store.py needs NumPy")
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, "healthcare_analytics.sqlite")
+    pool = db.ConnectionPool(path, size=1)
+    store = CohortStore(pool)
+
+    store.refresh()
+    print(f"loaded in {store.last_load_ms} ms, {store.stats()['bytes'] / 2**20:.1f} MB")
+    started = time.perf_counter()
+    counts = store.counts(refresh=False)
+    print(f"counters: {(time.perf_counter() - started) * 1000:8.1f} ms")
+    started = time.perf_counter()
+    store.refresh()
+    print(f"refresh with no changes: {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    expected = analytics_engine.scan(conn)
+    conn.close()
+    pool.close_all()
+    diff = [
+        name for name in expected
+        if (sorted(expected[name]) != sorted(counts[name]) if isinstance(expected[name], list)
+            else expected[name] != counts[name])
+    ]
+    for name in diff:
+        print(f"{name} differs from analytics_engine.scan()")
+    if diff:
+        sys.exit(1)
+    print("counters match analytics_engine.scan()")
@@ -0,0 +1,374 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app, g
+
+import instrumentation
+
+
+# -------------------------------
+# CONNECTION SETUP
+# -------------------------------
+def connect(path, busy_timeout_ms=5000, check_same_thread=False,
+            synchronous=None):
+    # check_same_thread is off because a pooled connection may be handed to
+    # a different worker thread the next time it leaves the pool
+    conn = sqlite3.connect(
+        path,
+        timeout=busy_timeout_ms / 1000,
+        check_same_thread=check_same_thread,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    # durability per commit: FULL fsyncs every commit; NORMAL in WAL mode
+    # only fsyncs at checkpoints (a power cut can lose the last commits,
+    # never corrupt the file)
+    if synchronous:
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+    return conn
+
+
+def set_journal_mode(path, mode):
+    # journal_mode is stored in the database file, so one connection is enough
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"PRAGMA journal_mode = {mode}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# -------------------------------
+# CONNECTION POOL
+# -------------------------------
+class ConnectionPool:
+    def __init__(self, path, size=8, busy_timeout_ms=5000, synchronous=None):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.on_connect = None  # called with every new connection
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.in_use = 0
+
+    def _connect(self):
+        # per-connection setup runs once, not once per request
+        conn = connect(self.path, self.busy_timeout_ms, synchronous=self.synchronous)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            hit = True
+        except queue.Empty:
+            conn = self._connect()
+            hit = False
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self.in_use -= 1
+
+        # never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "in_use": self.in_use,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# -------------------------------
+# SINGLE WRITER THREAD
+# -------------------------------
+class Writer:
+    # All writes go through one thread and one connection, so writers queue
+    # up in-process instead of fighting over the SQLite write lock.
+    #
+    # Group commit: jobs that arrive within window_ms of the first one (up to
+    # max_batch) share one transaction and one COMMIT, so one fsync covers
+    # them all. Each job runs in its own SAVEPOINT; a job that raises is
+    # rolled back on its own and the rest of the batch still commits. Every
+    # caller gets its own result or exception, and only after the COMMIT.
+
+    def __init__(self, path, busy_timeout_ms=5000, window_ms=0, max_batch=64,
+                 synchronous=None):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.window_ms = window_ms
+        self.max_batch = max(1, max_batch)
+        self.synchronous = synchronous
+        self.on_connect = None
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.commits = 0
+        self.largest_batch = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="sqlite-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _gather(self, first):
+        # first job plus whatever arrives before the window closes; jobs
+        # already waiting in the queue are always taken (up to max_batch)
+        batch = [first]
+        deadline = time.monotonic() + self.window_ms / 1000
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    job = self._jobs.get(timeout=remaining)
+                else:
+                    job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+            if job is None:
+                break
+        return batch
+
+    def _run_batch(self, conn, batch):
+        settled = []  # (future, result, exc) waiting on the COMMIT
+        for at, (fn, args, future, trace) in enumerate(batch):
+            try:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                conn.execute("SAVEPOINT job")
+            except BaseException as exc:
+                # the write lock stayed taken past busy_timeout (another
+                # process holds it): fail this job, the rest of the batch
+                # and the earlier jobs whose transaction goes with it
+                self._abort(conn)
+                settled = [(f, None, e or exc) for f, _, e in settled]
+                settled += [(job[2], None, exc) for job in batch[at:]]
+                self._settle(settled)
+                return
+            try:
+                # the job's statements count towards the submitting request
+                with instrumentation.bind(trace):
+                    result = fn(conn, *args)
+            except BaseException as exc:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                else:
+                    # SQLite rolled back the whole transaction (disk full,
+                    # I/O error), taking the earlier jobs' work with it
+                    settled = [(f, None, e or exc) for f, _, e in settled]
+                    self._settle(settled)
+                    settled = []
+                settled.append((future, None, exc))
+            else:
+                conn.execute("RELEASE job")
+                settled.append((future, result, None))
+
+        if conn.in_transaction:
+            try:
+                conn.execute("COMMIT")
+            except BaseException as exc:
+                self._abort(conn)
+                settled = [(f, None, e or exc) for f, _, e in settled]
+            else:
+                self.commits += 1
+        self._settle(settled)
+
+    def _abort(self, conn):
+        if conn.in_transaction:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass  # SQLite may have rolled back on its own already
+
+    def _settle(self, settled):
+        for future, result, exc in settled:
+            if exc is not None:
+                self.jobs_failed += 1
+                future.set_exception(exc)
+            else:
+                self.jobs_done += 1
+                future.set_result(result)
+
+    def _run(self):
+        conn = connect(
+            self.path, self.busy_timeout_ms, check_same_thread=True,
+            synchronous=self.synchronous,
+        )
+        conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves
+        if self.on_connect is not None:
+            self.on_connect(conn)
+
+        running = True
+        while running:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = self._gather(job)
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            batch = [
+                job for job in batch if job[2].set_running_or_notify_cancel()
+            ]
+            if batch:
+                self.largest_batch = max(self.largest_batch, len(batch))
+                try:
+                    self._run_batch(conn, batch)
+                except BaseException as exc:
+                    # whatever broke, no caller is left waiting on this
+                    # batch and the thread stays up for the next one
+                    self._abort(conn)
+                    self._settle([(job[2], None, exc) for job in batch if not job[2].done()])
+
+        conn.close()
+
+    def submit(self, fn, *args):
+        self._start()
+        future = Future()
+        self._jobs.put((fn, args, future, instrumentation.current()))
+        return future.result()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            thread.join()
+
+    def stats(self):
+        done = self.jobs_done + self.jobs_failed
+        return {
+            "queued": self._jobs.qsize(),
+            "done": self.jobs_done,
+            "failed": self.jobs_failed,
+            "commits": self.commits,
+            "jobs_per_commit": round(done / self.commits, 2) if self.commits else None,
+            "largest_batch": self.largest_batch,
+            "window_ms": self.window_ms,
+        }
+
+
+# -------------------------------
+# FLASK INTEGRATION
+# -------------------------------
+def init_app(app):
+    app.config.setdefault("DB_POOL_SIZE", 8)
+    app.config.setdefault("DB_JOURNAL_MODE", "wal")
+    app.config.setdefault("DB_BUSY_TIMEOUT_MS", 5000)
+    app.config.setdefault("DB_WRITER_QUEUE", True)
+    app.config.setdefault("DB_SYNCHRONOUS", None)
+    app.config.setdefault("DB_GROUP_COMMIT_WINDOW_MS", 0)
+    app.config.setdefault("DB_GROUP_COMMIT_MAX_BATCH", 64)
+
+    path = app.config["DATABASE"]
+    busy_timeout_ms = app.config["DB_BUSY_TIMEOUT_MS"]
+    synchronous = app.config["DB_SYNCHRONOUS"]
+
+    if app.config["DB_JOURNAL_MODE"]:
+        set_journal_mode(path, app.config["DB_JOURNAL_MODE"])
+
+    app.extensions["db_pool"] = ConnectionPool(
+        path,
+        size=app.config["DB_POOL_SIZE"],
+        busy_timeout_ms=busy_timeout_ms,
+        synchronous=synchronous,
+    )
+    if app.config["DB_WRITER_QUEUE"]:
+        app.extensions["db_writer"] = Writer(
+            path,
+            busy_timeout_ms,
+            window_ms=app.config["DB_GROUP_COMMIT_WINDOW_MS"],
+            max_batch=app.config["DB_GROUP_COMMIT_MAX_BATCH"],
+            synchronous=synchronous,
+        )
+    app.teardown_appcontext(close_db)
+
+
+def shutdown(app):
+    # Drain and stop the writer thread and close the idle pooled
+    # connections; both reopen on next use. A prefork master calls this
+    # before forking (a child inherits no thread, and must not share a
+    # connection), and each worker calls it on its way out.
+    writer = app.extensions.get("db_writer")
+    if writer is not None:
+        writer.stop()
+    app.extensions["db_pool"].close_all()
+
+
+def get_pool():
+    return current_app.extensions["db_pool"]
+
+
+def get_writer():
+    return current_app.extensions.get("db_writer")
+
+
+def get_db():
+    # one pooled connection per app context, shared by every call in it
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def write(fn, *args):
+    # Run fn(conn, *args) inside one write transaction and return its result.
+    # With the writer queue on, the job runs on the writer thread; otherwise
+    # it runs on this request's own connection.
+    writer = get_writer()
+    if writer is not None:
+        return writer.submit(fn, *args)
+
+    conn = get_db()
+    try:
+        result = fn(conn, *args)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
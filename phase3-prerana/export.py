@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+import zlib
+
+import tables
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+# -------------------------------
+# ROW STREAMING
+# -------------------------------
+def iter_rows(conn, view, filters, batch_size=1000):
+    # fetchmany keeps at most one batch of rows in Python at a time
+    where, params = tables.where_sql(view, filters)
+    cur = conn.execute(f"{view.select_sql()} {where} {view.order_sql()}", params)
+    n = len(view.labels)  # drop the hidden cursor-key columns
+    try:
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            yield [tuple(row)[:n] for row in batch]
+    finally:
+        cur.close()
+
+
+def _csv_chunks(view, batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(view.labels)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _ndjson_chunks(view, batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(view.labels, row)), separators=(",", ":")) + "\n"
+            for row in batch
+        )
+
+
+def _gzip(chunks):
+    # wbits=31 -> gzip container, compressed incrementally as rows arrive
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(pool, view, filters, fmt, gzip=False, batch_size=1000):
+    # Generator for a streaming response. It takes its own pooled connection
+    # and gives it back when the client finishes (or disconnects), since it
+    # runs after the request handler has returned.
+    conn = pool.acquire()
+    try:
+        batches = iter_rows(conn, view, filters, batch_size)
+        if fmt == "csv":
+            chunks = _csv_chunks(view, batches)
+        else:
+            chunks = _ndjson_chunks(view, batches)
+
+        if gzip:
+            yield from _gzip(chunks)
+        else:
+            for chunk in chunks:
+                yield chunk.encode()
+    finally:
+        pool.release(conn)
@@ -0,0 +1,578 @@
+"""Seeded synthetic data for the healthcare schema, from 10k to 10M patients.
+
+Starts from a copy of the shipped healthcare_analytics.sqlite, so the demo
+doctors and patients and their logins keep working, migrates it to the
+latest schema, and then adds:
+
+  catalogs   50 conditions, their first-line medications (linked through
+             MedicationCondition), 13 vaccines with dose schedules
+  hospitals  about one per 20k patients, one doctor per 500 patients
+  patients   ages drawn from a population pyramid, US blood type mix;
+             conditions from a Zipf-like prevalence curve shifted by life
+             stage (asthma in children, heart failure in the elderly),
+             medications for most conditions, immunizations that follow
+             each vaccine's schedule for the patient's age
+
+Everything comes from one random.Random(seed) consumed in patient order,
+so the same seed, patient count and --as-of date give the same database
+whatever the chunk size. Known patterns for scripts: synthetic MRNs are
+SYN-00000041 (zero-padded patient_id), and synthetic doctors log in with
+doctor<id>_pw.
+
+The load is a bulk path: summary, search and change-log triggers and
+secondary indexes are dropped, rows go in with executemany in large
+transactions with synchronous off, and afterwards the indexes are
+rebuilt, the summary tables and search index recomputed in one pass
+each, ANALYZE run and then a change-log reset written. The
+database is built under OUT.partial and renamed when complete.
+
+    python generate_data.py OUT.sqlite [--patients N] [--seed S]
+                            [--chunk-size N] [--as-of YYYY-MM-DD] [--force]
+"""
+import os
+import shutil
+import sqlite3
+import time
+from datetime import date
+from random import Random
+
+import change_log
+import migrations
+import search
+import summaries
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, "healthcare_analytics.sqlite")
+
+# tables whose secondary indexes are dropped during the load
+PATIENT_TABLES = (
+    "Patient",
+    "PatientHospital",
+    "PatientDoctor",
+    "PatientCondition",
+    "PatientMedication",
+    "PatientImmunization",
+)
+
+# clinical history starts here; no older diagnoses or doses are recorded
+RECORDS_FROM = date(2000, 1, 1)
+
+
+# -------------------------------
+# CATALOGS
+# -------------------------------
+# (condition, life stage it concentrates in, first-line medications), most
+# prevalent first; prevalence falls off as 1 / rank ** ZIPF_S
+CONDITIONS = [
+    ("Hypertension", "senior", ["Lisinopril 10mg", "Amlodipine 5mg"]),
+    ("Hyperlipidemia", "senior", ["Atorvastatin 20mg", "Rosuvastatin 10mg"]),
+    ("Seasonal Allergies", None, ["Cetirizine 10mg", "Fluticasone Nasal Spray"]),
+    ("Obesity", "adult", []),
+    ("Type 2 Diabetes", "senior", ["Metformin 500mg", "Insulin Glargine"]),
+    ("Anxiety Disorder", "adult", ["Escitalopram 10mg", "Alprazolam 0.5mg"]),
+    ("Depression", "adult", ["Sertraline 50mg", "Escitalopram 10mg"]),
+    ("Gastroesophageal Reflux Disease", "adult", ["Omeprazole 20mg"]),
+    ("Osteoarthritis", "senior", ["Ibuprofen 400mg", "Naproxen 500mg"]),
+    ("Chronic Low Back Pain", "adult", ["Naproxen 500mg", "Cyclobenzaprine 10mg"]),
+    ("Asthma", "child", ["Albuterol Inhaler", "Fluticasone Inhaler"]),
+    ("Hypothyroidism", "adult", ["Levothyroxine 100mcg"]),
+    ("Insomnia", "adult", ["Trazodone 50mg", "Melatonin 3mg"]),
+    ("Migraine", "adult", ["Sumatriptan 50mg", "Topiramate 25mg"]),
+    ("Eczema", "child", ["Hydrocortisone 1% Cream", "Triamcinolone 0.1% Cream"]),
+    ("Otitis Media", "child", ["Amoxicillin 500mg"]),
+    ("Urinary Tract Infection", None, ["Nitrofurantoin 100mg"]),
+    ("Iron Deficiency Anemia", None, ["Ferrous Sulfate 325mg"]),
+    ("Coronary Artery Disease", "senior", ["Aspirin 81mg", "Clopidogrel 75mg"]),
+    ("Attention Deficit Hyperactivity Disorder", "child", ["Methylphenidate 10mg"]),
+    ("Sleep Apnea", "senior", []),
+    ("Chronic Kidney Disease", "senior", ["Furosemide 40mg"]),
+    ("Atrial Fibrillation", "senior", ["Apixaban 5mg", "Metoprolol Succinate 50mg"]),
+    ("Osteoporosis", "senior", ["Alendronate 70mg"]),
+    ("Chronic Obstructive Pulmonary Disease", "senior", ["Albuterol Inhaler", "Tiotropium Inhaler"]),
+    ("Irritable Bowel Syndrome", "adult", ["Dicyclomine 20mg"]),
+    ("Benign Prostatic Hyperplasia", "senior", ["Tamsulosin 0.4mg"]),
+    ("Gout", "senior", ["Allopurinol 100mg", "Colchicine 0.6mg"]),
+    ("Cataract", "senior", []),
+    ("Glaucoma", "senior", ["Latanoprost 0.005% Drops"]),
+    ("Psoriasis", "adult", ["Clobetasol 0.05% Cream"]),
+    ("Congestive Heart Failure", "senior", ["Furosemide 40mg", "Spironolactone 25mg"]),
+    ("Rheumatoid Arthritis", "adult", ["Methotrexate 2.5mg", "Hydroxychloroquine 200mg"]),
+    ("Type 1 Diabetes", "child", ["Insulin Glargine", "Insulin Lispro"]),
+    ("Epilepsy", None, ["Levetiracetam 500mg"]),
+    ("Bipolar Disorder", "adult", ["Lithium 300mg"]),
+    ("Celiac Disease", None, []),
+    ("Hepatitis C", "adult", ["Sofosbuvir-Velpatasvir 400/100mg"]),
+    ("Alzheimer's Disease", "senior", ["Donepezil 10mg"]),
+    ("Parkinson's Disease", "senior", ["Carbidopa-Levodopa 25/100mg"]),
+    ("HIV Infection", "adult", ["Bictegravir-Emtricitabine-Tenofovir"]),
+    ("Multiple Sclerosis", "adult", ["Dimethyl Fumarate 240mg"]),
+    ("Systemic Lupus Erythematosus", "adult", ["Hydroxychloroquine 200mg"]),
+    ("Crohn's Disease", "adult", ["Mesalamine 1.2g"]),
+    ("Ulcerative Colitis", "adult", ["Mesalamine 1.2g"]),
+    ("Tuberculosis", None, ["Isoniazid 300mg"]),
+    ("Cystic Fibrosis", "child", ["Dornase Alfa Inhalation"]),
+    ("Sickle Cell Disease", "child", ["Hydroxyurea 500mg"]),
+    ("Hemophilia", "child", []),
+    ("Amyotrophic Lateral Sclerosis", "senior", ["Riluzole 50mg"]),
+]
+ZIPF_S = 1.1
+
+# weight multiplier of a condition of life stage (column) for a patient
+# of life stage (row)
+STAGE_WEIGHT = {
+    "child": {"child": 4.0, "adult": 0.15, "senior": 0.02, None: 1.0},
+    "adult": {"child": 0.4, "adult": 1.5, "senior": 0.5, None: 1.0},
+    "senior": {"child": 0.2, "adult": 1.0, "senior": 3.0, None: 1.0},
+}
+
+# vaccine -> (first year available, doses); a dose is (age in years,
+# coverage) or ("yearly", first age, coverage by life stage) or
+# ("campaign", year, minimum age, coverage)
+VACCINES = {
+    "Hepatitis B": (1982, [(0.0, 0.9), (0.2, 0.9), (0.5, 0.88)]),
+    "Polio (IPV)": (1955, [(0.2, 0.93), (0.4, 0.93), (1.2, 0.92), (5.0, 0.9)]),
+    "MMR": (1971, [(1.0, 0.92), (5.0, 0.9)]),
+    "Varicella": (1995, [(1.0, 0.9), (5.0, 0.88)]),
+    "Hepatitis A": (1996, [(1.0, 0.8), (1.5, 0.75)]),
+    "Tdap (Tetanus, Diphtheria, Pertussis)": (2005, [(11.0, 0.85), (21.0, 0.4), (31.0, 0.35), (41.0, 0.3), (51.0, 0.3), (61.0, 0.3)]),
+    "HPV": (2006, [(11.5, 0.6), (12.0, 0.55)]),
+    "Meningococcal": (2005, [(11.5, 0.85), (16.0, 0.6)]),
+    "Pneumococcal": (1983, [(65.0, 0.65)]),
+    "Shingles (Recombinant Zoster)": (2018, [(50.0, 0.3), (50.3, 0.25)]),
+    "Influenza (Flu Shot)": (1945, [("yearly", 0.5, {"child": 0.55, "adult": 0.38, "senior": 0.7})]),
+    "COVID-19 mRNA": (2020, [("campaign", 2021, 5, 0.68), ("campaign", 2021.2, 5, 0.64),
+                             ("campaign", 2022, 12, 0.35), ("campaign", 2023.8, 12, 0.2)]),
+    "RSV": (2023, [("campaign", 2023.7, 60, 0.2)]),
+}
+
+# share of the population per five-year age band, 0-4 up to 85-99
+AGE_PYRAMID = [5.7, 6.0, 6.3, 6.4, 6.6, 7.0, 6.9, 6.6, 6.1, 6.0, 6.2, 6.6,
+               6.3, 5.5, 4.6, 3.1, 2.0, 2.1]
+
+BLOOD_TYPES = ["O+", "A+", "B+", "AB+", "O-", "A-", "B-", "AB-"]
+BLOOD_WEIGHTS = [37.4, 35.7, 8.5, 3.4, 6.6, 6.3, 1.5, 0.6]
+
+CITIES = [
+    "Merced", "Fresno", "Modesto", "Stockton", "Sacramento", "Bakersfield",
+    "Visalia", "Turlock", "Madera", "Hanford", "Tracy", "Lodi", "Oakland",
+    "San Jose", "Salinas", "Santa Cruz", "Monterey", "Redding", "Chico",
+    "Davis", "Roseville", "Vallejo", "Napa", "Santa Rosa", "Eureka",
+    "San Luis Obispo", "Santa Maria", "Ventura", "Riverside", "Ontario",
+]
+HOSPITAL_KINDS = [
+    "General Hospital", "Medical Center", "Community Hospital",
+    "Regional Medical Center", "Memorial Hospital", "Family Clinic",
+]
+SPECIALTIES = [
+    ("Family Medicine", 30), ("Internal Medicine", 25), ("Pediatrics", 12),
+    ("Cardiology", 6), ("Endocrinology", 4), ("Pulmonology", 4),
+    ("Psychiatry", 5), ("Neurology", 3), ("Gastroenterology", 3),
+    ("Nephrology", 2), ("Rheumatology", 2), ("Dermatology", 2),
+    ("Geriatrics", 2),
+]
+FIRST_NAMES = [
+    "Maria", "James", "Ana", "Robert", "Priya", "Michael", "Mei", "David",
+    "Fatima", "Carlos", "Aisha", "Daniel", "Sofia", "Kevin", "Grace",
+    "Luis", "Hannah", "Omar", "Elena", "Thomas", "Nadia", "Samuel", "Julia",
+    "Andre", "Leila", "Victor", "Rosa", "Hiro", "Irene", "Marcus",
+]
+LAST_NAMES = [
+    "Garcia", "Smith", "Nguyen", "Patel", "Johnson", "Kim", "Martinez",
+    "Chen", "Brown", "Singh", "Lopez", "Williams", "Hernandez", "Khan",
+    "Davis", "Rodriguez", "Wong", "Miller", "Ali", "Wilson", "Gonzalez",
+    "Tran", "Anderson", "Cruz", "Thomas", "Moore", "Park", "Jackson",
+]
+
+
+def _life_stage(age):
+    return "child" if age < 18 else "adult" if age < 65 else "senior"
+
+
+def _ids_by_name(conn, table, id_col):
+    return {name: row_id for row_id, name in conn.execute(f"SELECT {id_col}, name FROM {table}")}
+
+
+def ensure_catalogs(conn):
+    # add the catalog entries above that the database doesn't have yet
+    conditions = _ids_by_name(conn, '"Condition"', "condition_id")
+    medications = _ids_by_name(conn, "Medication", "medication_id")
+    for name, _, meds in CONDITIONS:
+        if name not in conditions:
+            conditions[name] = conn.execute(
+                'INSERT INTO "Condition" (name) VALUES (?)', (name,)
+            ).lastrowid
+        for med in meds:
+            if med not in medications:
+                medications[med] = conn.execute(
+                    "INSERT INTO Medication (name) VALUES (?)", (med,)
+                ).lastrowid
+            conn.execute(
+                "INSERT OR IGNORE INTO MedicationCondition (medication_id, condition_id) "
+                "VALUES (?, ?)",
+                (medications[med], conditions[name]),
+            )
+
+    vaccines = _ids_by_name(conn, "Vaccine", "vaccine_id")
+    for name in VACCINES:
+        if name not in vaccines:
+            vaccines[name] = conn.execute(
+                "INSERT INTO Vaccine (name) VALUES (?)", (name,)
+            ).lastrowid
+
+    treatments = {}
+    for medication_id, condition_id in conn.execute(
+        "SELECT medication_id, condition_id FROM MedicationCondition "
+        "ORDER BY condition_id, medication_id"
+    ):
+        treatments.setdefault(condition_id, []).append(medication_id)
+    return conditions, vaccines, treatments
+
+
+def ensure_staff(conn, rng, patients):
+    # hospitals and doctors in proportion to the patient count
+    hospitals = [r[0] for r in conn.execute("SELECT hospital_id FROM Hospital ORDER BY 1")]
+    names = {r[0] for r in conn.execute("SELECT name FROM Hospital")}
+    want = max(len(hospitals), patients // 20000)
+    n = 0
+    while len(hospitals) < want:
+        city = CITIES[n % len(CITIES)]
+        name = f"{city} {HOSPITAL_KINDS[(n // len(CITIES)) % len(HOSPITAL_KINDS)]}"
+        if n >= len(CITIES) * len(HOSPITAL_KINDS):
+            name += f" #{n // (len(CITIES) * len(HOSPITAL_KINDS)) + 1}"
+        n += 1
+        if name in names:
+            continue
+        names.add(name)
+        hospitals.append(conn.execute(
+            "INSERT INTO Hospital (name, city) VALUES (?, ?)", (name, city)
+        ).lastrowid)
+
+    doctors = conn.execute("SELECT COUNT(*) FROM Doctor").fetchone()[0]
+    specialties = [s for s, _ in SPECIALTIES]
+    weights = [w for _, w in SPECIALTIES]
+    rows = []
+    first_id = conn.execute("SELECT IFNULL(MAX(doctor_id), 0) + 1 FROM Doctor").fetchone()[0]
+    for doctor_id in range(first_id, first_id + max(0, patients // 500 - doctors)):
+        rows.append((
+            doctor_id,
+            f"Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            rng.choices(specialties, weights)[0],
+            rng.choice(hospitals),
+            f"doctor{doctor_id}_pw",
+        ))
+    conn.executemany(
+        "INSERT INTO Doctor (doctor_id, name, specialty, hospital_id, password) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+
+    by_hospital = {}
+    for doctor_id, hospital_id in conn.execute(
+        "SELECT doctor_id, hospital_id FROM Doctor ORDER BY doctor_id"
+    ):
+        by_hospital.setdefault(hospital_id, []).append(doctor_id)
+    all_doctors = [d for ds in by_hospital.values() for d in ds]
+    return hospitals, by_hospital, all_doctors
+
+
+# -------------------------------
+# PATIENTS
+# -------------------------------
+class PatientFactory:
+    # Draws one patient and all of their rows at a time.
+
+    def __init__(self, rng, as_of, conditions, vaccines, treatments,
+                 hospitals, doctors_by_hospital, all_doctors):
+        self.rng = rng
+        self.as_of = as_of
+        self.as_of_ordinal = as_of.toordinal()
+        self.records_from = RECORDS_FROM.toordinal()
+        self.treatments = treatments
+        self.hospitals = hospitals
+        self.doctors_by_hospital = doctors_by_hospital
+        self.all_doctors = all_doctors
+
+        # cumulative condition weights per life stage, for rng.choices
+        self.condition_ids = [conditions[name] for name, _, _ in CONDITIONS]
+        self.condition_cum = {}
+        for stage, multipliers in STAGE_WEIGHT.items():
+            total, cum = 0.0, []
+            for rank, (_, condition_stage, _) in enumerate(CONDITIONS, 1):
+                total += multipliers[condition_stage] / rank ** ZIPF_S
+                cum.append(total)
+            self.condition_cum[stage] = cum
+
+        self.age_bands = list(range(len(AGE_PYRAMID)))
+        self.age_cum = []
+        total = 0.0
+        for share in AGE_PYRAMID:
+            total += share
+            self.age_cum.append(total)
+        self.blood_cum = []
+        total = 0.0
+        for share in BLOOD_WEIGHTS:
+            total += share
+            self.blood_cum.append(total)
+
+        # each vaccine's doses as (days after birth, coverage) and
+        # (first day, days of spread, minimum age in days, coverage by stage)
+        self.schedules = []
+        for name, (first_year, doses) in VACCINES.items():
+            by_age, dated = [], []
+            for dose in doses:
+                if dose[0] == "yearly":
+                    # one shot per flu season over the last five seasons
+                    _, min_age, coverage = dose
+                    for season in range(as_of.year - 5, as_of.year):
+                        start = date(season, 10, 1).toordinal()
+                        dated.append((start, 60, int(min_age * 365.25), coverage))
+                elif dose[0] == "campaign":
+                    _, year, min_age, coverage = dose
+                    start = date(int(year), 1, 1).toordinal() + int(year % 1 * 365)
+                    coverage = dict.fromkeys(STAGE_WEIGHT, coverage)
+                    dated.append((start, 90, int(min_age * 365.25), coverage))
+                else:
+                    at_age, coverage = dose
+                    by_age.append((int(at_age * 365.25), coverage))
+            first_day = max(self.records_from, date(first_year, 1, 1).toordinal())
+            self.schedules.append((vaccines[name], first_day, by_age, dated))
+        self._iso = {}
+
+    def iso(self, ordinal):
+        # ISO date strings repeat a lot; format each day once
+        text = self._iso.get(ordinal)
+        if text is None:
+            text = self._iso[ordinal] = date.fromordinal(ordinal).isoformat()
+        return text
+
+    def _day(self, lo, hi):
+        # ordinal uniformly in [lo, hi]
+        return lo + int(self.rng.random() * (max(lo, hi) - lo + 1))
+
+    def _poisson(self, lam):
+        rng = self.rng
+        limit, k, p = pow(2.718281828459045, -lam), 0, rng.random()
+        while p > limit:
+            k += 1
+            p *= rng.random()
+        return k
+
+    def patient(self, patient_id):
+        rng = self.rng
+        band = rng.choices(self.age_bands, cum_weights=self.age_cum)[0]
+        age = band * 5 + rng.randint(0, 14 if band == len(AGE_PYRAMID) - 1 else 4)
+        birth_year = self.as_of.year - age
+        born = date(birth_year, 1, 1).toordinal() + rng.randint(0, 364)
+        stage = _life_stage(age)
+
+        patient = (
+            patient_id,
+            f"SYN-{patient_id:08d}",
+            birth_year,
+            "Female" if rng.random() < 0.505 else "Male",
+            rng.choices(BLOOD_TYPES, cum_weights=self.blood_cum)[0],
+        )
+
+        hospitals = [rng.choice(self.hospitals)]
+        if rng.random() < 0.15:
+            other = rng.choice(self.hospitals)
+            if other != hospitals[0]:
+                hospitals.append(other)
+        doctors = []
+        for hospital_id in hospitals:
+            doctors.append(rng.choice(
+                self.doctors_by_hospital.get(hospital_id) or self.all_doctors
+            ))
+        doctors = sorted(set(doctors))
+        primary = doctors[0]
+
+        # conditions: count grows with age, which one by life-stage prevalence
+        first_day = max(born + 180, self.records_from)
+        conditions, medications = [], []
+        n = self._poisson(0.25 + age * 0.035)
+        if n:
+            picked = set(rng.choices(
+                self.condition_ids, cum_weights=self.condition_cum[stage], k=n
+            ))
+            prescribed = set()
+            for condition_id in sorted(picked):
+                doctor_id = primary if rng.random() < 0.8 else rng.choice(self.all_doctors)
+                diagnosed = self._day(first_day, self.as_of_ordinal)
+                conditions.append((patient_id, condition_id, self.iso(diagnosed), doctor_id))
+                options = self.treatments.get(condition_id)
+                if options and rng.random() < 0.75:
+                    medication_id = rng.choice(options)
+                    day = self.iso(self._day(diagnosed, min(diagnosed + 30, self.as_of_ordinal)))
+                    if (medication_id, day) not in prescribed:
+                        prescribed.add((medication_id, day))
+                        medications.append(
+                            (patient_id, medication_id, day, doctor_id, condition_id)
+                        )
+
+        immunizations = self._immunizations(patient_id, born, stage)
+
+        return (
+            patient,
+            [(patient_id, h) for h in hospitals],
+            [(patient_id, d) for d in doctors],
+            conditions,
+            medications,
+            immunizations,
+        )
+
+    def _immunizations(self, patient_id, born, stage):
+        rand = self.rng.random
+        rows = []
+        today = self.as_of_ordinal
+        for vaccine_id, first_day, by_age, dated in self.schedules:
+            days = set()
+            for offset, coverage in by_age:
+                day = born + offset
+                if day > today:
+                    break
+                if rand() < coverage:
+                    days.add(day + int(rand() * 61))
+            for start, spread, min_age, coverage in dated:
+                day = start + int(rand() * (spread + 1))
+                if day - born >= min_age and rand() < coverage[stage]:
+                    days.add(day)
+            for day in sorted(days):
+                if first_day <= day <= today:
+                    rows.append((patient_id, vaccine_id, self.iso(day)))
+        return rows
+
+
+# -------------------------------
+# BULK LOAD
+# -------------------------------
+INSERTS = [
+    "INSERT INTO Patient (patient_id, medical_record_number, birth_year, gender, blood_type) "
+    "VALUES (?, ?, ?, ?, ?)",
+    "INSERT INTO PatientHospital (patient_id, hospital_id) VALUES (?, ?)",
+    "INSERT INTO PatientDoctor (patient_id, doctor_id) VALUES (?, ?)",
+    "INSERT INTO PatientCondition (patient_id, condition_id, diagnosis_date, doctor_id) "
+    "VALUES (?, ?, ?, ?)",
+    "INSERT INTO PatientMedication "
+    "(patient_id, medication_id, prescription_date, doctor_id, condition_id) "
+    "VALUES (?, ?, ?, ?, ?)",
+    "INSERT INTO PatientImmunization (patient_id, vaccine_id, admin_date) VALUES (?, ?, ?)",
+]
+
+
+def _secondary_indexes(conn):
+    marks = ",".join("?" * len(PATIENT_TABLES))
+    return conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+        f"AND sql IS NOT NULL AND tbl_name IN ({marks}) ORDER BY name",
+        PATIENT_TABLES,
+    ).fetchall()
+
+
+def generate(path, patients, seed=111, chunk_size=50000, as_of=date(2025, 1, 1),
+             log=None):
+    # Build the database at path; returns {table: rows added}.
+    log = log or (lambda message: None)
+    partial = path + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    shutil.copy(SOURCE, partial)
+    migrations.migrate(partial)
+
+    rng = Random(seed)
+    conn = sqlite3.connect(partial, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = OFF")  # rows are generated consistent
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    conn.execute("BEGIN")
+    conditions, vaccines, treatments = ensure_catalogs(conn)
+    hospitals, by_hospital, all_doctors = ensure_staff(conn, rng, patients)
+    summaries.drop_triggers(conn)
+    search.drop_triggers(conn)
+    logged = change_log.installed(conn)
+    change_log.drop_triggers(conn)
+    indexes = _secondary_indexes(conn)
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    conn.execute("COMMIT")
+
+    factory = PatientFactory(
+        rng, as_of, conditions, vaccines, treatments, hospitals, by_hospital, all_doctors
+    )
+    first = conn.execute("SELECT IFNULL(MAX(patient_id), 0) + 1 FROM Patient").fetchone()[0]
+    counts = [0] * len(INSERTS)
+    started = time.perf_counter()
+    for chunk_start in range(first, first + patients, chunk_size):
+        batches = [[] for _ in INSERTS]
+        for patient_id in range(chunk_start, min(chunk_start + chunk_size, first + patients)):
+            patient, *children = factory.patient(patient_id)
+            batches[0].append(patient)
+            for batch, rows in zip(batches[1:], children):
+                batch.extend(rows)
+        conn.execute("BEGIN")
+        for i, (sql, rows) in enumerate(zip(INSERTS, batches)):
+            conn.executemany(sql, rows)
+            counts[i] += len(rows)
+        conn.execute("COMMIT")
+        done = chunk_start - first + len(batches[0])
+        elapsed = time.perf_counter() - started
+        log(f"{done:,} / {patients:,} patients, {sum(counts):,} rows, "
+            f"{sum(counts) / elapsed:,.0f} rows/s")
+
+    log("rebuilding indexes, summary tables and search index")
+    conn.execute("BEGIN")
+    for _, sql in indexes:
+        conn.execute(sql)
+    summaries.rebuild(conn)
+    summaries.install_triggers(conn)
+    if search.fts_tables(conn)[0]:
+        search.rebuild(conn)
+        search.install_triggers(conn)
+    if logged:
+        change_log.install_triggers(conn)
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    # the reset goes in after ANALYZE: stats for a one-entry change_log
+    # would describe it as tiny however large it grows (and one left by
+    # an earlier ANALYZE of this file is dropped for the same reason)
+    conn.execute("BEGIN")
+    conn.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'change_log'")
+    change_log.reset(conn)
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    os.replace(partial, path)
+    tables = [sql.split()[2] for sql in INSERTS]
+    return dict(zip(tables, counts))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic healthcare database.")
+    parser.add_argument("out")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=111)
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date(2025, 1, 1),
+                        help="the 'today' of the generated records")
+    parser.add_argument("--force", action="store_true", help="overwrite OUT")
+    args = parser.parse_args()
+
+    if os.path.exists(args.out) and not args.force:
+        sys.exit(f"{args.out} exists; pass --force to overwrite it")
+    started = time.perf_counter()
+    counts = generate(
+        args.out, args.patients, seed=args.seed, chunk_size=args.chunk_size,
+        as_of=args.as_of, log=print,
+    )
+    for table, n in counts.items():
+        print(f"{table:<20} {n:>12,}")
+    print(f"{args.out}: done in {time.perf_counter() - started:.1f}s")
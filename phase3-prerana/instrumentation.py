@@ -0,0 +1,347 @@
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import before_render_template, current_app, g, request, template_rendered
+
+log = logging.getLogger("healthcare.requests")
+
+# the trace of the request being served on this thread (the writer thread
+# binds the submitting request's trace while it runs that request's job)
+_local = threading.local()
+
+# latency histogram bucket bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# recent requests kept per endpoint for the percentiles on /stats
+RECENT = 1000
+
+# statements listed per request in the log line
+TOP_STATEMENTS = 3
+
+
+# -------------------------------
+# SQL TEXT
+# -------------------------------
+# The trace callback sees the SQL with its parameters filled in. Literals
+# are folded back to ? so one query is one entry however it was called,
+# and no MRN or name ends up in a log line.
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b", re.I)
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    return _SPACE.sub(" ", LITERALS.sub("?", sql)).strip()
+
+
+# -------------------------------
+# PER-REQUEST TRACE
+# -------------------------------
+class RequestTrace:
+    # SQLite calls statement() as each statement starts and tick() every
+    # few hundred VM instructions while it runs, so a statement's time is
+    # the span from its start to the last tick seen before the next one
+    # starts: time SQLite spent on it, including lazy fetches, but not the
+    # Python work done on the rows afterwards. Statements shorter than one
+    # tick (SQL_PROGRESS_OPS instructions, a few microseconds) count as 0.
+
+    def __init__(self, slow_threshold=None):
+        self.started = time.perf_counter()
+        self.slow_threshold = slow_threshold  # seconds; None: don't collect
+        self.slow = []  # (sql as run, seconds) for the slow query log
+        self.statements = {}  # normalized sql -> [count, seconds]
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self._render_started = None
+        self._sql = None
+        self._sql_started = 0.0
+        self._last_tick = 0.0
+
+    def statement(self, sql):
+        # SQLite reports the running statement again as each trigger fires,
+        # and nested programs (triggers, FTS5 internals) as "-- ..." lines;
+        # both are part of the statement already open
+        if sql.startswith("--") or sql == self._sql:
+            return
+        self.close_statement()
+        self._sql = sql
+        self._sql_started = self._last_tick = time.perf_counter()
+
+    def tick(self):
+        self._last_tick = time.perf_counter()
+
+    def close_statement(self):
+        if self._sql is None:
+            return
+        seconds = self._last_tick - self._sql_started
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            self.slow.append((self._sql, seconds))
+        key = normalize_sql(self._sql)
+        entry = self.statements.get(key)
+        if entry is None:
+            self.statements[key] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        self._sql = None
+
+    def render_started(self):
+        self.close_statement()
+        self._render_started = time.perf_counter()
+
+    def render_finished(self):
+        if self._render_started is not None:
+            self.render_seconds += time.perf_counter() - self._render_started
+            self._render_started = None
+
+    def top(self, n=TOP_STATEMENTS):
+        ranked = sorted(self.statements.items(), key=lambda kv: -kv[1][1])
+        return [
+            {"sql": sql, "n": count, "ms": round(seconds * 1000, 3)}
+            for sql, (count, seconds) in ranked[:n]
+        ]
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def bind(trace):
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        if trace is not None:
+            trace.close_statement()
+        _local.trace = previous
+
+
+def _on_statement(sql):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.statement(sql)
+
+
+def _on_progress():
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.tick()
+    # returning a false value lets the statement continue
+
+
+def attach(conn, progress_ops=1000):
+    # install the callbacks on a new connection (pool and writer hook)
+    conn.set_trace_callback(_on_statement)
+    conn.set_progress_handler(_on_progress, progress_ops)
+
+
+# -------------------------------
+# ROLLING ENDPOINT STATS
+# -------------------------------
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.recent = deque(maxlen=RECENT)
+        self.errors = 0
+        self.statuses = {}  # status code -> count
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statements = {}  # normalized sql -> [count, seconds]
+
+    def record(self, trace, seconds, status):
+        self.latency.observe(seconds)
+        self.recent.append(seconds)
+        if status >= 500:
+            self.errors += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.sql_count += trace.sql_count
+        self.sql_seconds += trace.sql_seconds
+        self.render_seconds += trace.render_seconds
+        for sql, (count, spent) in trace.statements.items():
+            entry = self.statements.setdefault(sql, [0, 0.0])
+            entry[0] += count
+            entry[1] += spent
+
+    def summary(self):
+        n = self.latency.count
+        ordered = sorted(self.recent)
+        ranked = sorted(self.statements.items(), key=lambda kv: -kv[1][1])
+        return {
+            "requests": n,
+            "errors": self.errors,
+            "mean_ms": round(self.latency.sum / n * 1000, 3),
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+            "sql_per_request": round(self.sql_count / n, 2),
+            "sql_ms_per_request": round(self.sql_seconds / n * 1000, 3),
+            "render_ms_per_request": round(self.render_seconds / n * 1000, 3),
+            "histogram": dict(
+                zip([str(b) for b in self.latency.buckets] + ["+Inf"],
+                    self.latency.counts)
+            ),
+            "top_statements": [
+                {"sql": sql, "n": count, "ms": round(spent * 1000, 3)}
+                for sql, (count, spent) in ranked[:5]
+            ],
+        }
+
+
+class Instrumentation:
+    def __init__(self, log_requests=False):
+        self.log_requests = log_requests
+        self.slow_threshold = None  # set by slow_queries.init_app
+        self.slow_log = None
+        self.endpoints = {}  # endpoint -> EndpointStats
+        self._lock = threading.Lock()
+
+    def finish(self, trace, endpoint, status):
+        trace.close_statement()
+        seconds = time.perf_counter() - trace.started
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.record(trace, seconds, status)
+
+        if trace.slow and self.slow_log is not None:
+            self.slow_log.record(endpoint, trace.slow)
+
+        if self.log_requests:
+            log.info(json.dumps({
+                "event": "request",
+                "method": request.method,
+                "path": request.path,
+                "endpoint": endpoint,
+                "status": status,
+                "ms": round(seconds * 1000, 3),
+                "render_ms": round(trace.render_seconds * 1000, 3),
+                "sql_count": trace.sql_count,
+                "sql_ms": round(trace.sql_seconds * 1000, 3),
+                "top_sql": trace.top(),
+            }))
+
+    def snapshot(self):
+        # consistent copy of the raw counters, for /metrics
+        with self._lock:
+            return {
+                endpoint: {
+                    "statuses": dict(stats.statuses),
+                    "buckets": stats.latency.buckets,
+                    "bucket_counts": list(stats.latency.counts),
+                    "count": stats.latency.count,
+                    "sum": stats.latency.sum,
+                    "sql_count": stats.sql_count,
+                    "sql_seconds": stats.sql_seconds,
+                    "render_seconds": stats.render_seconds,
+                }
+                for endpoint, stats in self.endpoints.items()
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: stats.summary()
+                for endpoint, stats in sorted(self.endpoints.items())
+            }
+
+
+# -------------------------------
+# FLASK INTEGRATION
+# -------------------------------
+def init_app(app):
+    # needs db.init_app(app) to have run first
+    app.config.setdefault("INSTRUMENTATION", True)
+    app.config.setdefault("INSTRUMENTATION_LOG", False)
+    app.config.setdefault("SQL_PROGRESS_OPS", 1000)
+    if not app.config["INSTRUMENTATION"]:
+        return
+
+    instrumentation = Instrumentation(app.config["INSTRUMENTATION_LOG"])
+    app.extensions["instrumentation"] = instrumentation
+    if instrumentation.log_requests:
+        log.setLevel(logging.INFO)
+        if not log.handlers:
+            log.addHandler(logging.StreamHandler())
+
+    progress_ops = app.config["SQL_PROGRESS_OPS"]
+
+    def hook(conn):
+        attach(conn, progress_ops)
+
+    app.extensions["db_pool"].on_connect = hook
+    writer = app.extensions.get("db_writer")
+    if writer is not None:
+        writer.on_connect = hook
+
+    @app.before_request
+    def start_trace():
+        g.trace = RequestTrace(instrumentation.slow_threshold)
+        _local.trace = g.trace
+
+    @app.after_request
+    def note_status(response):
+        g.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_trace(exc=None):
+        trace = g.pop("trace", None)
+        _local.trace = None
+        if trace is None:
+            return
+        status = 500 if exc is not None else g.pop("status", 200)
+        instrumentation.finish(trace, request.endpoint or "unmatched", status)
+
+    def render_started(sender, **extra):
+        trace = current()
+        if trace is not None:
+            trace.render_started()
+
+    def render_finished(sender, **extra):
+        trace = current()
+        if trace is not None:
+            trace.render_finished()
+
+    # weak=False: the receivers are closures that would otherwise be
+    # collected as soon as init_app returns
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+
+def stats():
+    instrumentation = current_app.extensions.get("instrumentation")
+    return instrumentation.stats() if instrumentation else None
+
+
+def snapshot():
+    instrumentation = current_app.extensions.get("instrumentation")
+    return instrumentation.snapshot() if instrumentation else None
@@ -0,0 +1,449 @@
+"""Load test a running server with a fleet of concurrent doctor sessions.
+
+Each simulated doctor is a thread with its own keep-alive connection and
+session cookie. It logs in, then loops over a weighted mix of actions,
+optionally pausing between them (--think-ms):
+
+  lookup            POST /lookup_patient
+  browse            POST /browse_tables, first page of a random table
+  analytics         GET  /analytics
+  add_condition     POST /add_condition
+  add_medication    POST /add_medication
+  add_vaccine       POST /add_vaccine
+  delete_condition  POST /delete_condition to list a patient's conditions,
+                    then delete one of them by its pc_id
+  delete_medication the same for /delete_medication and pm_id
+
+Patients and catalog ids are sampled read-only from the database the
+server runs on (--db). The load runs in stages of "users:seconds"; each
+stage adds sessions to (or parks sessions of) the previous one. For each
+stage it reports:
+
+  throughput, p50 / p95 / p99 latency overall and per action
+  errors by kind: "locked" (503 database is locked), 5xx, 4xx,
+  logged_out (bounced to the login page), timeout, connection
+
+The saturation point is the first stage whose throughput grows by less
+than --knee (default 10%) over the stage before, or whose error rate
+exceeds --max-error-rate. Results go to --out as JSON.
+
+Start the server first, e.g.
+
+    HEALTHCARE_DB=/tmp/big.sqlite flask --app app run --port 5000
+
+    python loadtest.py [--url http://127.0.0.1:5000] [--db PATH]
+                       [--stages 1:15,5:15,10:15,25:20,50:20]
+                       [--mix lookup=40,browse=10,analytics=10,...]
+                       [--doctor 1:alice_pw] [--doctor-range 20-60]
+                       [--think-ms 0] [--timeout 30] [--out loadtest.json]
+"""
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlencode, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = {
+    "lookup": 40,
+    "browse": 10,
+    "analytics": 10,
+    "add_condition": 10,
+    "add_medication": 10,
+    "add_vaccine": 5,
+    "delete_condition": 10,
+    "delete_medication": 5,
+}
+
+# tables a browse action picks from (tables.VIEWS, without importing Flask)
+BROWSE_TABLES = [
+    "Hospital", "Doctor", "Patient", "Condition", "Medication", "Vaccine",
+    "PatientDoctor", "PatientHospital", "PatientCondition", "PatientMedication",
+    "PatientImmunization", "MedicationCondition",
+]
+
+# patients sampled from the database for the actions to work on
+SAMPLE = 5000
+
+_PC_ID = re.compile(r'name="pc_id" value="(\d+)"')
+_PM_ID = re.compile(r'name="pm_id" value="(\d+)"')
+
+
+# -------------------------------
+# HTTP SESSION
+# -------------------------------
+class LoggedOut(Exception):
+    pass
+
+
+class Session:
+    # One keep-alive connection plus the cookies the server set.
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+        self.cookies = {}
+
+    def request(self, method, path, form=None):
+        if self.conn is None:
+            self.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, HTTPException):
+            self.close()
+            raise
+        for cookie in response.headers.get_all("Set-Cookie") or []:
+            name, _, rest = cookie.partition("=")
+            self.cookies[name.strip()] = rest.split(";", 1)[0]
+        if response.will_close:
+            self.close()
+        if response.status == 302 and "doctor_login" in (response.getheader("Location") or ""):
+            raise LoggedOut()
+        return response.status, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# -------------------------------
+# TEST DATA
+# -------------------------------
+def sample_data(path, n=SAMPLE, seed=None):
+    # MRNs and catalog ids, read-only, so the running server is not disturbed
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rng = random.Random(seed)
+        low, high = conn.execute("SELECT MIN(patient_id), MAX(patient_id) FROM Patient").fetchone()
+        ids = sorted({rng.randint(low, high) for _ in range(n * 2)})
+        mrns = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            mrns += [r[0] for r in conn.execute(
+                "SELECT medical_record_number FROM Patient WHERE patient_id IN (%s)"
+                % ",".join("?" * len(chunk)), chunk,
+            )]
+        rng.shuffle(mrns)
+        return {
+            "mrns": mrns[:n],
+            "conditions": [r[0] for r in conn.execute('SELECT condition_id FROM "Condition"')],
+            "medications": [r[0] for r in conn.execute("SELECT medication_id FROM Medication")],
+            "vaccines": [r[0] for r in conn.execute("SELECT vaccine_id FROM Vaccine")],
+        }
+    finally:
+        conn.close()
+
+
+def _day(rng):
+    return (date(2005, 1, 1) + timedelta(days=rng.randint(0, 7300))).isoformat()
+
+
+# -------------------------------
+# ACTIONS
+# -------------------------------
+# each takes (session, rng, data, timed) and makes one or two requests
+# through timed(label, method, path, form)
+def lookup(session, rng, data, timed):
+    timed("lookup", "POST", "/lookup_patient", {"mrn": rng.choice(data["mrns"])})
+
+
+def browse(session, rng, data, timed):
+    timed("browse", "POST", "/browse_tables", {"table_name": rng.choice(BROWSE_TABLES)})
+
+
+def analytics(session, rng, data, timed):
+    timed("analytics", "GET", "/analytics", None)
+
+
+def add_condition(session, rng, data, timed):
+    timed("add_condition", "POST", "/add_condition", {
+        "mrn": rng.choice(data["mrns"]),
+        "condition_id": rng.choice(data["conditions"]),
+        "diagnosis_date": _day(rng),
+    })
+
+
+def add_medication(session, rng, data, timed):
+    timed("add_medication", "POST", "/add_medication", {
+        "mrn": rng.choice(data["mrns"]),
+        "medication_id": rng.choice(data["medications"]),
+        "condition_id": rng.choice(data["conditions"]),
+        "prescription_date": _day(rng),
+    })
+
+
+def add_vaccine(session, rng, data, timed):
+    timed("add_vaccine", "POST", "/add_vaccine", {
+        "mrn": rng.choice(data["mrns"]),
+        "vaccine_id": rng.choice(data["vaccines"]),
+        "admin_date": _day(rng),
+    })
+
+
+def _delete(kind, pattern, field):
+    def action(session, rng, data, timed):
+        mrn = rng.choice(data["mrns"])
+        page = timed(f"{kind} list", "POST", f"/{kind}", {"mrn": mrn})
+        ids = pattern.findall(page.decode("utf-8", "replace")) if page else []
+        if ids:
+            timed(kind, "POST", f"/{kind}", {"mrn": mrn, field: rng.choice(ids)})
+    return action
+
+
+ACTIONS = {
+    "lookup": lookup,
+    "browse": browse,
+    "analytics": analytics,
+    "add_condition": add_condition,
+    "add_medication": add_medication,
+    "add_vaccine": add_vaccine,
+    "delete_condition": _delete("delete_condition", _PC_ID, "pc_id"),
+    "delete_medication": _delete("delete_medication", _PM_ID, "pm_id"),
+}
+
+
+# -------------------------------
+# FLEET
+# -------------------------------
+class Fleet:
+    def __init__(self, url, data, mix, logins, think, timeout, seed):
+        self.url = url
+        self.data = data
+        self.actions = [ACTIONS[name] for name in mix]
+        self.weights = list(mix.values())
+        self.logins = logins
+        self.think = think
+        self.timeout = timeout
+        self.seed = seed
+        self.users = 0  # sessions allowed to run; the rest park
+        self.records = []  # (label, seconds, outcome) of the current stage
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def scale_to(self, users):
+        self.users = users
+        while len(self.threads) < users:
+            thread = threading.Thread(target=self._run, args=(len(self.threads),), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(self.timeout + 1)
+
+    def _timed(self, session):
+        def timed(label, method, path, form):
+            started = time.perf_counter()
+            outcome, body = "ok", None
+            try:
+                status, body = session.request(method, path, form)
+                if status == 503 and b"locked" in body:
+                    outcome = "locked"
+                elif status >= 500:
+                    outcome = "5xx"
+                elif status >= 400:
+                    outcome = "4xx"
+            except LoggedOut:
+                outcome = "logged_out"
+            except socket.timeout:
+                outcome = "timeout"
+            except (OSError, HTTPException):
+                outcome = "connection"
+            self.records.append((label, time.perf_counter() - started, outcome))
+            if outcome == "logged_out":
+                raise LoggedOut()
+            if outcome == "connection":
+                time.sleep(0.1)  # server down or restarting; don't spin
+            return body
+        return timed
+
+    def _run(self, index):
+        # a fixed --seed repeats the same writes, which collide with the rows
+        # an earlier run left behind; by default every run draws fresh ones
+        rng = random.Random(None if self.seed is None else self.seed * 1000003 + index)
+        session = Session(self.url, self.timeout)
+        timed = self._timed(session)
+        doctor_id, password = self.logins[index % len(self.logins)]
+        logged_in = False
+        while not self.stopped.is_set():
+            if index >= self.users:
+                time.sleep(0.05)
+                continue
+            try:
+                if not logged_in:
+                    session.cookies.clear()
+                    timed("login", "POST", "/doctor_login",
+                          {"doctor_id": doctor_id, "password": password})
+                    logged_in = "session" in session.cookies
+                    if not logged_in:
+                        time.sleep(0.5)  # bad credentials or server down
+                        continue
+                action = rng.choices(self.actions, self.weights)[0]
+                action(session, rng, self.data, timed)
+            except LoggedOut:
+                logged_in = False
+            if self.think:
+                time.sleep(rng.expovariate(1 / self.think))
+        session.close()
+
+
+# -------------------------------
+# REPORTING
+# -------------------------------
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else None
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def summarize(users, seconds, records):
+    latencies = sorted(r[1] for r in records)
+    errors = {}
+    by_label = {}
+    for label, spent, outcome in records:
+        if outcome != "ok":
+            errors[outcome] = errors.get(outcome, 0) + 1
+        by_label.setdefault(label, []).append(spent)
+    n = len(records)
+    return {
+        "users": users,
+        "seconds": seconds,
+        "requests": n,
+        "rps": round(n / seconds, 1),
+        "p50_ms": _ms(_percentile(latencies, 0.50)),
+        "p95_ms": _ms(_percentile(latencies, 0.95)),
+        "p99_ms": _ms(_percentile(latencies, 0.99)),
+        "error_rate": round(sum(errors.values()) / n, 4) if n else 0.0,
+        "errors": errors,
+        "actions": {
+            label: {
+                "requests": len(spent),
+                "p50_ms": _ms(_percentile(sorted(spent), 0.50)),
+                "p95_ms": _ms(_percentile(sorted(spent), 0.95)),
+            }
+            for label, spent in sorted(by_label.items())
+        },
+    }
+
+
+def saturation(stages, knee, max_error_rate):
+    # the first stage that stopped paying for its extra users
+    for previous, stage in zip(stages, stages[1:]):
+        if stage["error_rate"] > max_error_rate:
+            return {"users": stage["users"], "reason": "error rate",
+                    "rps": previous["rps"], "error_rate": stage["error_rate"]}
+        if stage["users"] > previous["users"] and stage["rps"] < previous["rps"] * (1 + knee):
+            return {"users": previous["users"], "reason": "throughput plateau",
+                    "rps": previous["rps"], "p95_ms": stage["p95_ms"]}
+    return None
+
+
+def _parse_pairs(text, value_type):
+    pairs = []
+    for item in text.split(","):
+        key, sep, value = item.partition(":" if ":" in item else "=")
+        if not sep:
+            raise ValueError(f"expected key:value, got {item!r}")
+        pairs.append((key.strip(), value_type(value)))
+    return pairs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test a running healthcare server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--db", default=os.environ.get(
+        "HEALTHCARE_DB", os.path.join(HERE, "healthcare_analytics.sqlite")),
+        help="the server's database, read for MRNs and catalog ids")
+    parser.add_argument("--stages", default="1:15,5:15,10:15,25:20,50:20",
+                        help="comma-separated users:seconds")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="comma-separated action=weight")
+    parser.add_argument("--doctor", action="append", default=[],
+                        help="ID:PASSWORD to log in with (repeatable)")
+    parser.add_argument("--doctor-range",
+                        help="FIRST-LAST synthetic doctors (password doctor<id>_pw)")
+    parser.add_argument("--think-ms", type=float, default=0,
+                        help="mean pause between actions per session")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--knee", type=float, default=0.10)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, help="repeat a run exactly (default: random)")
+    parser.add_argument("--out", default="loadtest.json")
+    args = parser.parse_args()
+
+    stages = _parse_pairs(args.stages, float)
+    mix = dict(_parse_pairs(args.mix, float))
+    unknown = set(mix) - set(ACTIONS)
+    if unknown:
+        sys.exit(f"unknown actions in --mix: {', '.join(sorted(unknown))}")
+    logins = [tuple(d.split(":", 1)) for d in args.doctor]
+    if args.doctor_range:
+        first, last = (int(x) for x in args.doctor_range.split("-"))
+        logins += [(str(i), f"doctor{i}_pw") for i in range(first, last + 1)]
+    logins = logins or [("1", "alice_pw")]
+
+    data = sample_data(args.db, seed=args.seed)
+    fleet = Fleet(args.url, data, mix, logins, args.think_ms / 1000, args.timeout, args.seed)
+    results = []
+    print(f"{'users':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>8}  by kind")
+    try:
+        for users, seconds in stages:
+            users = int(users)
+            records = fleet.records = []
+            fleet.scale_to(users)
+            time.sleep(seconds)
+            fleet.records = []
+            stage = summarize(users, seconds, records)
+            results.append(stage)
+            print(f"{users:>6} {stage['rps']:>8} {stage['p50_ms']!s:>8} {stage['p95_ms']!s:>8} "
+                  f"{stage['p99_ms']!s:>8} {stage['error_rate']:>8.2%}  {stage['errors'] or ''}",
+                  flush=True)
+    except KeyboardInterrupt:
+        print("interrupted; reporting the stages so far")
+    finally:
+        fleet.stop()
+
+    knee = saturation(results, args.knee, args.max_error_rate)
+    if knee is None:
+        print("no saturation within these stages")
+    else:
+        print(f"saturation at about {knee['users']} users ({knee['reason']}, "
+              f"{knee['rps']} req/s before it)")
+    with open(args.out, "w") as f:
+        json.dump({
+            "meta": {
+                "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "url": args.url,
+                "mix": mix,
+                "think_ms": args.think_ms,
+                "sessions": len(logins),
+            },
+            "stages": results,
+            "saturation": knee,
+        }, f, indent=2)
+    print(f"results written to {args.out}")
@@ -0,0 +1,323 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+from flask import current_app
+
+import cache
+import catalogs
+import db
+import instrumentation
+
+# Prometheus text exposition (format 0.0.4), built from counters the app
+# already keeps; a scrape copies them under their locks and never touches
+# the database.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+log = logging.getLogger("healthcare.metrics")
+
+# bytes of shared memory per prefork worker for its published counters
+SLOT_BYTES = 256 * 1024
+
+# values that describe the moment, not a running total; a replacement
+# worker does not carry them over from the worker it replaces
+GAUGES = {"size", "idle", "in_use", "queued", "entries", "bytes"}
+
+
+# -------------------------------
+# TEXT FORMAT
+# -------------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help, samples):
+        # samples: [(labels dict, value)] or [(suffix, labels dict, value)]
+        samples = [s for s in samples if s[-1] is not None]
+        if not samples:
+            return
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("",) + sample
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            label_text = "{" + label_text + "}" if label_text else ""
+            self.lines.append(f"{name}{suffix}{label_text} {_number(value)}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+# -------------------------------
+# SAMPLES
+# -------------------------------
+def collect():
+    # this process's counters, as plain JSON-able data
+    caches = {}
+    for name, s in (("analytics", cache.get_analytics_cache().stats()),
+                    ("chart", cache.get_chart_cache().stats())):
+        caches[name] = {k: s.get(k) for k in ("hits", "misses", "entries", "evictions", "bytes")}
+    for name, s in catalogs.stats().items():
+        caches["catalog_" + name.lower()] = {
+            "hits": s["hits"], "misses": s["loads"], "entries": s["entries"],
+        }
+
+    writer = db.get_writer()
+    writer = writer.stats() if writer else None
+    return {
+        "requests": instrumentation.snapshot() or {},
+        "caches": caches,
+        "pool": db.get_pool().stats(),
+        "writer": writer and {k: writer[k] for k in ("queued", "done", "failed", "commits")},
+        "data_version": cache.data_version(),
+    }
+
+
+def _add(total, value, key=None):
+    # total + value, key by key and element by element
+    if value is None:
+        return total
+    if total is None or key == "buckets":
+        return value
+    if isinstance(value, dict):
+        total = dict(total)
+        for k, v in value.items():
+            total[k] = _add(total.get(k), v, k)
+        return total
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+def _counters(value):
+    # value without its gauges
+    if isinstance(value, dict):
+        return {k: _counters(v) for k, v in value.items() if k not in GAUGES}
+    return value
+
+
+def combine(samples):
+    total = None
+    for sample in samples:
+        total = _add(total, sample)
+    return total
+
+
+class SharedMetrics:
+    # The counters of every worker of a prefork server, one JSON slot per
+    # worker in shared memory created before the fork (like
+    # cache.SharedChanges). Each worker rewrites its slot every `interval`
+    # seconds and on its way out; a scrape, whichever worker takes it,
+    # adds up the slots. A worker that replaces a dead one starts from the
+    # counters left in its slot, so the totals never go backwards.
+
+    def __init__(self, slots, slot_bytes=SLOT_BYTES, interval=1.0):
+        ctx = multiprocessing.get_context("fork")
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.interval = interval
+        self._data = ctx.RawArray("c", slots * slot_bytes)
+        self._sizes = ctx.RawArray("q", slots)
+        self._lock = ctx.Lock()
+        self.slot = None  # per process: set in the worker by start()
+        self.base = None  # counters the previous owner of the slot left
+        self._stopping = threading.Event()
+
+    def _read(self, slot):
+        start = slot * self.slot_bytes
+        with self._lock:
+            raw = self._data[start:start + self._sizes[slot]]
+        return json.loads(raw) if raw else None
+
+    def _write(self, slot, sample):
+        raw = json.dumps(sample).encode()
+        if len(raw) > self.slot_bytes:
+            log.warning("metrics sample of %d bytes does not fit a %d byte slot",
+                        len(raw), self.slot_bytes)
+            return
+        start = slot * self.slot_bytes
+        with self._lock:
+            self._data[start:start + len(raw)] = raw
+            self._sizes[slot] = len(raw)
+
+    def own(self, sample):
+        # sample as this worker's slot holds it (JSON keys, carried counters)
+        return _add(self.base, json.loads(json.dumps(sample)))
+
+    def publish(self, app):
+        with app.app_context():
+            self._write(self.slot, self.own(collect()))
+
+    def start(self, app, slot):
+        # in a freshly forked worker: take over `slot` and keep it current
+        self.slot = slot
+        self.base = _counters(self._read(slot))
+        self._stopping.clear()
+
+        def run():
+            while not self._stopping.wait(self.interval):
+                self.publish(app)
+
+        threading.Thread(target=run, name="metrics-publisher", daemon=True).start()
+
+    def stop(self, app):
+        self._stopping.set()
+        self.publish(app)
+
+    def samples(self, sample):
+        # every worker's counters, this one's as of now
+        out = []
+        for slot in range(self.slots):
+            if slot == self.slot:
+                out.append(self.own(sample))
+            else:
+                other = self._read(slot)
+                if other is not None:
+                    out.append(other)
+        return out
+
+
+def get_shared_metrics():
+    # None outside a prefork worker
+    shared = current_app.extensions.get("shared_metrics")
+    return shared if shared is not None and shared.slot is not None else None
+
+
+def init_app(app):
+    # set by a prefork server (serve.py) to its number of workers
+    app.config.setdefault("SHARED_METRICS", 0)
+    app.config.setdefault("SHARED_METRICS_INTERVAL", 1.0)
+    if app.config["SHARED_METRICS"]:
+        app.extensions["shared_metrics"] = SharedMetrics(
+            app.config["SHARED_METRICS"], interval=app.config["SHARED_METRICS_INTERVAL"]
+        )
+
+
+# -------------------------------
+# COLLECTORS
+# -------------------------------
+def _requests(out, snapshot):
+    out.metric(
+        "healthcare_requests_total", "counter",
+        "HTTP requests served, by endpoint and status code.",
+        [
+            ({"endpoint": endpoint, "status": status}, n)
+            for endpoint, ep in sorted(snapshot.items())
+            for status, n in sorted(ep["statuses"].items())
+        ],
+    )
+
+    samples = []
+    for endpoint, ep in sorted(snapshot.items()):
+        cumulative = 0
+        bounds = list(ep["buckets"]) + [float("inf")]
+        for bound, n in zip(bounds, ep["bucket_counts"]):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append(("_bucket", {"endpoint": endpoint, "le": le}, cumulative))
+        samples.append(("_sum", {"endpoint": endpoint}, ep["sum"]))
+        samples.append(("_count", {"endpoint": endpoint}, ep["count"]))
+    out.metric(
+        "healthcare_request_duration_seconds", "histogram",
+        "Request latency, from routing to the end of the response.",
+        samples,
+    )
+
+    per_endpoint = [
+        ("healthcare_template_render_seconds_total",
+         "Time spent rendering templates.", "render_seconds"),
+        ("healthcare_sql_statements_total",
+         "SQLite statements run on behalf of requests.", "sql_count"),
+        ("healthcare_sql_duration_seconds_total",
+         "Time SQLite spent executing those statements.", "sql_seconds"),
+    ]
+    for name, help, key in per_endpoint:
+        out.metric(
+            name, "counter", help,
+            [({"endpoint": e}, ep[key]) for e, ep in sorted(snapshot.items())],
+        )
+
+
+def _caches(out, caches):
+    # caches: {name: stats dict with hits / misses and optional extras}
+    def collect(key):
+        return [({"cache": name}, s.get(key)) for name, s in sorted(caches.items())]
+
+    def hit_rate(s):
+        lookups = (s.get("hits") or 0) + (s.get("misses") or 0)
+        return round(s["hits"] / lookups, 4) if lookups else None
+
+    out.metric("healthcare_cache_hits_total", "counter",
+               "Cache lookups answered from memory.", collect("hits"))
+    out.metric("healthcare_cache_misses_total", "counter",
+               "Cache lookups that went to the database.", collect("misses"))
+    out.metric("healthcare_cache_hit_ratio", "gauge",
+               "hits / (hits + misses) since start.",
+               [({"cache": name}, hit_rate(s)) for name, s in sorted(caches.items())])
+    out.metric("healthcare_cache_entries", "gauge",
+               "Entries currently cached.", collect("entries"))
+    out.metric("healthcare_cache_evictions_total", "counter",
+               "Entries dropped to stay within the size bound.", collect("evictions"))
+    out.metric("healthcare_cache_bytes", "gauge",
+               "Estimated memory held by the cache.", collect("bytes"))
+
+
+def _database(out, pool, writer, path):
+    out.metric("healthcare_db_pool_size", "gauge",
+               "Idle connections the pool keeps.", [({}, pool["size"])])
+    out.metric("healthcare_db_pool_connections", "gauge",
+               "Pooled connections by state.",
+               [({"state": "idle"}, pool["idle"]), ({"state": "in_use"}, pool["in_use"])])
+    out.metric("healthcare_db_pool_acquires_total", "counter",
+               "Connection acquisitions, by whether an idle one was reused.",
+               [({"reused": "true"}, pool["hits"]), ({"reused": "false"}, pool["misses"])])
+
+    if writer is not None:
+        out.metric("healthcare_db_writer_queue", "gauge",
+                   "Write jobs waiting for the writer thread.", [({}, writer["queued"])])
+        out.metric("healthcare_db_writer_jobs_total", "counter",
+                   "Write jobs run, by outcome.",
+                   [({"outcome": "ok"}, writer["done"]),
+                    ({"outcome": "error"}, writer["failed"])])
+        out.metric("healthcare_db_writer_commits_total", "counter",
+                   "Transactions committed by the writer (group commits).",
+                   [({}, writer["commits"])])
+
+    samples = []
+    for file, suffix in (("db", ""), ("wal", "-wal"), ("shm", "-shm")):
+        try:
+            samples.append(({"file": file}, os.stat(path + suffix).st_size))
+        except OSError:
+            pass
+    out.metric("healthcare_db_file_bytes", "gauge",
+               "Size of the SQLite database, WAL and shared-memory files.", samples)
+
+
+def render(sample, path, workers=1):
+    # sample: collect()'s data, or combine() of every worker's
+    out = Exposition()
+    _requests(out, sample["requests"])
+    _caches(out, sample["caches"])
+    _database(out, sample["pool"], sample["writer"], path)
+    out.metric("healthcare_data_version", "counter",
+               "Writes seen (bumps of the data version), summed over the workers.",
+               [({}, sample["data_version"])])
+    out.metric("healthcare_workers", "gauge",
+               "Worker processes whose counters are included.", [({}, workers)])
+    return out.text()
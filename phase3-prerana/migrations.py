@@ -0,0 +1,414 @@
+"""Versioned schema migrations for healthcare_analytics.sqlite.
+
+The applied version lives in ``PRAGMA user_version``. Run directly to
+migrate a database file: ``python migrations.py [path/to/db.sqlite]``.
+"""
+import sqlite3
+import sys
+
+import change_log
+import search
+import summaries
+
+MIGRATIONS = []
+
+
+def migration(version, name, foreign_keys=True):
+    # foreign_keys=False is for migrations that rebuild tables; SQLite only
+    # lets us turn enforcement off outside a transaction
+    def register(fn):
+        MIGRATIONS.append((version, name, foreign_keys, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def column_names(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+# -------------------------------
+# 1. BASELINE SCHEMA
+# -------------------------------
+# Brings a database built from database_creation/create_database.sql up to
+# what the app actually uses (PatientMedication.condition_id and the unique
+# MRN index were only ever added by hand to the .sqlite file).
+@migration(1, "baseline schema")
+def _baseline(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Hospital (
+            hospital_id INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            city        TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Doctor (
+            doctor_id   INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            specialty   TEXT,
+            hospital_id INTEGER NOT NULL,
+            password    TEXT,
+            FOREIGN KEY (hospital_id) REFERENCES Hospital(hospital_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Patient (
+            patient_id            INTEGER PRIMARY KEY,
+            medical_record_number TEXT NOT NULL,
+            birth_year            INTEGER,
+            gender                TEXT,
+            blood_type            TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS "Condition" (
+            condition_id INTEGER PRIMARY KEY,
+            name         TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Medication (
+            medication_id INTEGER PRIMARY KEY,
+            name          TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Vaccine (
+            vaccine_id INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PatientDoctor (
+            patient_id INTEGER NOT NULL,
+            doctor_id  INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, doctor_id),
+            FOREIGN KEY (patient_id) REFERENCES Patient(patient_id),
+            FOREIGN KEY (doctor_id)  REFERENCES Doctor(doctor_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PatientHospital (
+            patient_id  INTEGER NOT NULL,
+            hospital_id INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, hospital_id),
+            FOREIGN KEY (patient_id)  REFERENCES Patient(patient_id),
+            FOREIGN KEY (hospital_id) REFERENCES Hospital(hospital_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PatientCondition (
+            patient_id     INTEGER NOT NULL,
+            condition_id   INTEGER NOT NULL,
+            diagnosis_date TEXT,
+            doctor_id      INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, condition_id),
+            FOREIGN KEY (patient_id)   REFERENCES Patient(patient_id),
+            FOREIGN KEY (condition_id) REFERENCES "Condition"(condition_id),
+            FOREIGN KEY (doctor_id)    REFERENCES Doctor(doctor_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PatientMedication (
+            patient_id        INTEGER NOT NULL,
+            medication_id     INTEGER NOT NULL,
+            prescription_date TEXT,
+            doctor_id         INTEGER NOT NULL,
+            condition_id      INTEGER REFERENCES "Condition"(condition_id),
+            PRIMARY KEY (patient_id, medication_id, prescription_date),
+            FOREIGN KEY (patient_id)    REFERENCES Patient(patient_id),
+            FOREIGN KEY (medication_id) REFERENCES Medication(medication_id),
+            FOREIGN KEY (doctor_id)     REFERENCES Doctor(doctor_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PatientImmunization (
+            patient_id INTEGER NOT NULL,
+            vaccine_id INTEGER NOT NULL,
+            admin_date TEXT,
+            PRIMARY KEY (patient_id, vaccine_id, admin_date),
+            FOREIGN KEY (patient_id) REFERENCES Patient(patient_id),
+            FOREIGN KEY (vaccine_id) REFERENCES Vaccine(vaccine_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS MedicationCondition (
+            medication_id INTEGER NOT NULL,
+            condition_id  INTEGER NOT NULL,
+            PRIMARY KEY (medication_id, condition_id),
+            FOREIGN KEY (medication_id) REFERENCES Medication(medication_id),
+            FOREIGN KEY (condition_id)  REFERENCES "Condition"(condition_id)
+        )
+    ''')
+
+    # databases created from create_database.sql don't have this column yet
+    if "condition_id" not in column_names(conn, "PatientMedication"):
+        conn.execute(
+            'ALTER TABLE PatientMedication '
+            'ADD COLUMN condition_id INTEGER REFERENCES "Condition"(condition_id)'
+        )
+
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_patient_mrn "
+        "ON Patient(medical_record_number)"
+    )
+
+
+# -------------------------------
+# 2. INDEXES FOR THE HOT JOIN PATHS
+# -------------------------------
+# Each index is named after the query in app.py that needs it. Most carry
+# patient_id as a trailing column so COUNT(DISTINCT patient_id) style
+# aggregates can be answered from the index alone.
+HOT_PATH_INDEXES = [
+    # analytics: cond_rows / common_condition / gender_top / blood_top /
+    # avg_age_rows group PatientCondition by condition_id
+    "CREATE INDEX IF NOT EXISTS idx_pc_condition_patient "
+    "ON PatientCondition(condition_id, patient_id)",
+    # FK from PatientCondition to Doctor (doctor deletes, browse joins)
+    "CREATE INDEX IF NOT EXISTS idx_pc_doctor "
+    "ON PatientCondition(doctor_id)",
+
+    # lookup_patient medications query and FK checks on Condition/Doctor
+    "CREATE INDEX IF NOT EXISTS idx_pm_condition "
+    "ON PatientMedication(condition_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pm_doctor "
+    "ON PatientMedication(doctor_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pm_medication_patient "
+    "ON PatientMedication(medication_id, patient_id)",
+
+    # analytics: common_vaccine / vaccine_rows group by vaccine_id
+    "CREATE INDEX IF NOT EXISTS idx_pi_vaccine_patient "
+    "ON PatientImmunization(vaccine_id, patient_id)",
+
+    # analytics: hospital_top groups PatientHospital by hospital_id
+    "CREATE INDEX IF NOT EXISTS idx_ph_hospital_patient "
+    "ON PatientHospital(hospital_id, patient_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pd_doctor "
+    "ON PatientDoctor(doctor_id)",
+
+    # lookup_patient conditions query joins MedicationCondition on
+    # condition_id, which is the second column of its primary key
+    "CREATE INDEX IF NOT EXISTS idx_mc_condition_medication "
+    "ON MedicationCondition(condition_id, medication_id)",
+
+    "CREATE INDEX IF NOT EXISTS idx_doctor_hospital "
+    "ON Doctor(hospital_id)",
+]
+
+
+@migration(2, "indexes for hot join paths")
+def _hot_path_indexes(conn):
+    for sql in HOT_PATH_INDEXES:
+        conn.execute(sql)
+
+    # give the planner row counts for the new indexes
+    conn.execute("ANALYZE")
+
+
+# -------------------------------
+# 3. ANALYTICS SUMMARY TABLES
+# -------------------------------
+# Trigger-maintained aggregates read by /analytics (see summaries.py).
+@migration(3, "analytics summary tables")
+def _analytics_summaries(conn):
+    summaries.install(conn)
+
+
+# -------------------------------
+# 4. TYPEAHEAD SEARCH INDEX
+# -------------------------------
+# FTS5 tables behind /search (see search.py). A SQLite without FTS5 skips
+# this and /search falls back to LIKE queries.
+@migration(4, "typeahead search index")
+def _search_index(conn):
+    search.install(conn)
+
+
+# -------------------------------
+# 5. CASCADING PATIENT DELETES
+# -------------------------------
+# Rebuilds the five patient child tables with ON DELETE CASCADE on
+# patient_id, so deleting a Patient row is the whole delete. SQLite can't
+# alter a foreign key in place: each table is copied into a new one
+# (rowids kept, the delete pages and browse cursors use them) and swapped.
+CASCADE_TABLES = {
+    "PatientDoctor": ("patient_id, doctor_id", '''
+        CREATE TABLE PatientDoctor_new (
+            patient_id INTEGER NOT NULL,
+            doctor_id  INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, doctor_id),
+            FOREIGN KEY (patient_id) REFERENCES Patient(patient_id)
+                ON DELETE CASCADE,
+            FOREIGN KEY (doctor_id)  REFERENCES Doctor(doctor_id)
+        )
+    '''),
+    "PatientHospital": ("patient_id, hospital_id", '''
+        CREATE TABLE PatientHospital_new (
+            patient_id  INTEGER NOT NULL,
+            hospital_id INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, hospital_id),
+            FOREIGN KEY (patient_id)  REFERENCES Patient(patient_id)
+                ON DELETE CASCADE,
+            FOREIGN KEY (hospital_id) REFERENCES Hospital(hospital_id)
+        )
+    '''),
+    "PatientCondition": ("patient_id, condition_id, diagnosis_date, doctor_id", '''
+        CREATE TABLE PatientCondition_new (
+            patient_id     INTEGER NOT NULL,
+            condition_id   INTEGER NOT NULL,
+            diagnosis_date TEXT,
+            doctor_id      INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, condition_id),
+            FOREIGN KEY (patient_id)   REFERENCES Patient(patient_id)
+                ON DELETE CASCADE,
+            FOREIGN KEY (condition_id) REFERENCES "Condition"(condition_id),
+            FOREIGN KEY (doctor_id)    REFERENCES Doctor(doctor_id)
+        )
+    '''),
+    "PatientMedication": (
+        "patient_id, medication_id, prescription_date, doctor_id, condition_id",
+        '''
+        CREATE TABLE PatientMedication_new (
+            patient_id        INTEGER NOT NULL,
+            medication_id     INTEGER NOT NULL,
+            prescription_date TEXT,
+            doctor_id         INTEGER NOT NULL,
+            condition_id      INTEGER REFERENCES "Condition"(condition_id),
+            PRIMARY KEY (patient_id, medication_id, prescription_date),
+            FOREIGN KEY (patient_id)    REFERENCES Patient(patient_id)
+                ON DELETE CASCADE,
+            FOREIGN KEY (medication_id) REFERENCES Medication(medication_id),
+            FOREIGN KEY (doctor_id)     REFERENCES Doctor(doctor_id)
+        )
+        ''',
+    ),
+    "PatientImmunization": ("patient_id, vaccine_id, admin_date", '''
+        CREATE TABLE PatientImmunization_new (
+            patient_id INTEGER NOT NULL,
+            vaccine_id INTEGER NOT NULL,
+            admin_date TEXT,
+            PRIMARY KEY (patient_id, vaccine_id, admin_date),
+            FOREIGN KEY (patient_id) REFERENCES Patient(patient_id)
+                ON DELETE CASCADE,
+            FOREIGN KEY (vaccine_id) REFERENCES Vaccine(vaccine_id)
+        )
+    '''),
+}
+
+
+@migration(5, "cascade patient deletes to child tables", foreign_keys=False)
+def _cascade_patient_deletes(conn):
+    # the summary triggers reference these tables; with them in place the
+    # RENAME below would fail re-parsing a trigger whose table is gone
+    summaries.drop_triggers(conn)
+
+    for table, (columns, create) in CASCADE_TABLES.items():
+        conn.execute(create)
+        conn.execute(
+            f"INSERT INTO {table}_new (rowid, {columns}) "
+            f"SELECT rowid, {columns} FROM {table}"
+        )
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    # dropping the old tables took their indexes and triggers with them
+    for sql in HOT_PATH_INDEXES:
+        conn.execute(sql)
+    summaries.install_triggers(conn)
+    search.install_triggers(conn)
+    conn.execute("ANALYZE")
+
+
+# -------------------------------
+# 6. PATIENT CHANGE LOG
+# -------------------------------
+# Trigger-fed log of changed patient ids, read by the in-memory cohort
+# store and bitmap index to refresh only those patients. Just the table:
+# the triggers are installed by the first reader (change_log.ensure).
+@migration(6, "patient change log")
+def _change_log(conn):
+    conn.execute(change_log.CREATE)
+
+
+# -------------------------------
+# 7. PATIENTDOCTOR BROWSE ORDER
+# -------------------------------
+# /browse_tables orders PatientDoctor by (doctor name, doctor_id,
+# patient_id). Doctor(name, doctor_id) drives the join in that order and
+# PatientDoctor(doctor_id, patient_id) keeps each doctor's patients in it,
+# so a page is a seek plus LIMIT instead of sorting the whole join. The
+# second index covers everything idx_pd_doctor was used for.
+@migration(7, "indexes for the PatientDoctor browse order")
+def _patient_doctor_browse(conn):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_doctor_name ON Doctor(name, doctor_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_pd_doctor_patient "
+        "ON PatientDoctor(doctor_id, patient_id)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_pd_doctor")
+    conn.execute("ANALYZE Doctor")
+    conn.execute("ANALYZE PatientDoctor")
+
+
+# -------------------------------
+# RUNNER
+# -------------------------------
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def migrate(path, target=None, log=None):
+    # Apply every migration newer than the database, each in its own
+    # transaction together with its user_version bump.
+    if target is None:
+        target = latest_version()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        before = current_version(conn)
+        for version, name, foreign_keys, fn in MIGRATIONS:
+            if version <= current_version(conn) or version > target:
+                continue
+
+            conn.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                fn(conn)
+                if not foreign_keys:
+                    broken = conn.execute("PRAGMA foreign_key_check").fetchall()
+                    if broken:
+                        raise sqlite3.IntegrityError(
+                            f"migration {version} left {len(broken)} "
+                            "foreign key violations"
+                        )
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            if log:
+                log(f"applied migration {version}: {name}")
+
+        return before, current_version(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import os
+
+    default = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "healthcare_analytics.sqlite"
+    )
+    path = sys.argv[1] if len(sys.argv) > 1 else default
+    before, after = migrate(path, log=print)
+    print(f"{path}: schema version {before} -> {after}")
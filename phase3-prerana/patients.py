@@ -0,0 +1,30 @@
+import json
+
+# -------------------------------
+# BATCH PATIENT DELETES
+# -------------------------------
+# Child rows go with their patient through ON DELETE CASCADE (migration
+# 5), and the summary triggers subtract each patient before it goes, so
+# one DELETE removes everything. The MRN list is bound as one JSON
+# parameter and resolved through idx_patient_mrn, so a cohort of any size
+# is a single statement.
+DELETE_SQL = '''
+    DELETE FROM Patient
+    WHERE patient_id IN (
+        SELECT p.patient_id
+        FROM json_each(?) AS j
+        CROSS JOIN Patient p
+            ON p.medical_record_number = j.value
+    )
+    RETURNING patient_id, medical_record_number
+'''
+
+
+def delete_patients(conn, mrns):
+    # MRN -> patient_id of every patient deleted; unknown MRNs are absent.
+    # A write job: run it through db.write() so it gets one transaction.
+    mrns = list(dict.fromkeys(mrns))
+    if not mrns:
+        return {}
+    rows = conn.execute(DELETE_SQL, (json.dumps(mrns),)).fetchall()
+    return {row[1]: row[0] for row in rows}
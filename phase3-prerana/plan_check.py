@@ -0,0 +1,338 @@
+"""Query-plan regression check for the SQL that the routes in app.py run.
+
+Builds a synthetic database, drives every route through the Flask test
+client and captures each statement those requests execute, together with
+its EXPLAIN QUERY PLAN. The capture uses the slow-query log with a 0 ms
+threshold. The plans are then checked against the rules below:
+
+  single   requests about one patient (lookups, add_* / delete_* forms,
+           MRN-filtered browse and export) must not SCAN Patient or any
+           patient relationship table
+  paged    later browse_tables pages of views ordered by MRN, doctor
+           name or primary key must seek the index on that key, with no
+           temporary B-tree for the whole ORDER BY (the view ordered by
+           medication name has no such index and is not checked)
+  EXPECT   statements matching a pattern must use the index named for them
+
+Every route of the app has to be exercised, so a new route without a
+scenario here fails too. Exit status is 1 on any failure. The same
+check runs under pytest as tests/test_plan_check.py, on a smaller
+database.
+
+    python plan_check.py [--patients N] [--keep-db PATH] [--verbose]
+
+--keep-db builds the synthetic database once at PATH and reuses it; each
+run works on a copy, because the write routes change the data.
+"""
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import db
+import generate_data
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# tables a single-patient request must never scan
+PATIENT_TABLES = (
+    "Patient",
+    "PatientCondition",
+    "PatientMedication",
+    "PatientImmunization",
+    "PatientHospital",
+    "PatientDoctor",
+)
+
+# (statement pattern, plan pattern that must appear in its plan)
+EXPECT = [
+    (
+        r"WHERE (\w+\.)?medical_record_number = \?",
+        r"SEARCH \w+ USING (COVERING )?INDEX \w+ \(medical_record_number=\?\)",
+    ),
+    (
+        r"FROM PatientCondition \w+ .*WHERE \w+\.patient_id (= \?|IN)",
+        r"SEARCH \w+ USING (COVERING )?INDEX \w+ \(patient_id=\?",
+    ),
+    (
+        r"FROM PatientMedication \w+ .*WHERE \w+\.patient_id (= \?|IN)",
+        r"SEARCH \w+ USING (COVERING )?INDEX \w+ \(patient_id=\?",
+    ),
+    (
+        r"FROM PatientImmunization \w+ .*WHERE \w+\.patient_id (= \?|IN)",
+        r"SEARCH \w+ USING (COVERING )?INDEX \w+ \(patient_id=\?",
+    ),
+]
+
+# leading browse keys with an index to seek -> the plan term that shows it
+PAGED_KEYS = {
+    "p.medical_record_number": "medical_record_number>?",
+    "d.name": "name>?",
+    "hospital_id": "rowid>?",
+    "patient_id": "rowid>?",
+    "condition_id": "rowid>?",
+    "medication_id": "rowid>?",
+    "vaccine_id": "rowid>?",
+}
+
+# endpoints that are fine without a scenario (no SQL of their own)
+UNCHECKED = {"static"}
+
+
+# -------------------------------
+# SYNTHETIC DATABASE
+# -------------------------------
+def build_database(path, patients, seed=111):
+    # the shipped database plus `patients` synthetic patients, migrated
+    generate_data.generate(path, patients, seed=seed)
+
+
+# -------------------------------
+# STATEMENT CAPTURE
+# -------------------------------
+class Capture(logging.Handler):
+    # collects the slow-query log entries (every statement at 0 ms)
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def emit(self, record):
+        self.entries.append(json.loads(record.getMessage()))
+
+    def drain(self):
+        entries, self.entries = self.entries, []
+        return entries
+
+
+# -------------------------------
+# SCENARIOS
+# -------------------------------
+def sample_patient(path):
+    # an MRN with conditions, medications and immunizations to work on
+    conn = sqlite3.connect(path)
+    try:
+        mrn, pid = conn.execute(
+            "SELECT p.medical_record_number, p.patient_id FROM Patient p "
+            "WHERE EXISTS (SELECT 1 FROM PatientCondition WHERE patient_id = p.patient_id) "
+            "AND EXISTS (SELECT 1 FROM PatientMedication WHERE patient_id = p.patient_id) "
+            "AND EXISTS (SELECT 1 FROM PatientImmunization WHERE patient_id = p.patient_id) "
+            "ORDER BY p.patient_id DESC LIMIT 1"
+        ).fetchone()
+        others = [r[0] for r in conn.execute(
+            "SELECT medical_record_number FROM Patient WHERE patient_id < ? "
+            "ORDER BY patient_id DESC LIMIT 3", (pid,)
+        )]
+        pc_id = conn.execute(
+            "SELECT rowid FROM PatientCondition WHERE patient_id = ? LIMIT 1", (pid,)
+        ).fetchone()[0]
+        pm_id = conn.execute(
+            "SELECT rowid FROM PatientMedication WHERE patient_id = ? LIMIT 1", (pid,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return mrn, others, pc_id, pm_id
+
+
+def scenarios(app, path):
+    # (label, rule, method, url, request kwargs); rule is "single",
+    # ("paged", seek term) or None
+    import tables
+
+    mrn, others, pc_id, pm_id = sample_patient(path)
+    today = "2024-06-01"
+    ndjson = json.dumps({
+        "mrn": "PLAN-IMPORT-1", "birth_year": 1980, "gender": "Female",
+        "blood_type": "O+", "conditions": [{"condition_id": 1}],
+    }) + "\n"
+
+    out = [
+        ("index", None, "GET", "/", {}),
+        ("doctor_dashboard", "single", "GET", "/doctor_dashboard", {}),
+        ("lookup_patient", "single", "POST", "/lookup_patient", {"data": {"mrn": mrn}}),
+        ("patient_charts", "single", "POST", "/patient_charts", {"json": {"mrns": others}}),
+        ("search_terms", "single", "GET", "/search?q=diab", {}),
+        ("search_terms mrn", "single", "GET", f"/search?q={mrn[:-2]}&kind=patient", {}),
+        ("cohort", None, "GET", "/cohort?q=condition:1 AND NOT vaccine:1&limit=50", {}),
+        ("add_patient", "single", "POST", "/add_patient", {"data": {
+            "mrn": "PLAN-1", "birth_year": "1990", "gender": "Female", "blood_type": "A+"}}),
+        ("update_patient", "single", "POST", "/update_patient", {"data": {
+            "mrn": "PLAN-1", "birth_year": "1991", "gender": "Female", "blood_type": "B+"}}),
+        ("add_condition", "single", "POST", "/add_condition", {"data": {
+            "mrn": mrn, "condition_id": "1", "diagnosis_date": today}}),
+        ("add_condition new", "single", "POST", "/add_condition", {"data": {
+            "mrn": mrn, "new_condition_name": "Plan Check Condition", "diagnosis_date": ""}}),
+        ("add_medication", "single", "POST", "/add_medication", {"data": {
+            "mrn": mrn, "medication_id": "1", "condition_id": "1", "prescription_date": today}}),
+        ("add_vaccine", "single", "POST", "/add_vaccine", {"data": {
+            "mrn": mrn, "vaccine_id": "1", "admin_date": today}}),
+        ("delete_condition list", "single", "POST", "/delete_condition", {"data": {"mrn": mrn}}),
+        ("delete_condition", "single", "POST", "/delete_condition", {"data": {
+            "mrn": mrn, "pc_id": str(pc_id)}}),
+        ("delete_medication list", "single", "POST", "/delete_medication", {"data": {"mrn": mrn}}),
+        ("delete_medication", "single", "POST", "/delete_medication", {"data": {
+            "mrn": mrn, "pm_id": str(pm_id)}}),
+        ("import_patients", "single", "POST", "/import_patients", {"data": {
+            "format": "ndjson", "file": (io.BytesIO(ndjson.encode()), "p.ndjson")}}),
+        ("delete_patient", "single", "POST", "/delete_patient", {"data": {"mrn": "PLAN-1"}}),
+        ("delete_patients", "single", "POST", "/delete_patients", {"json": {
+            "mrns": ["PLAN-IMPORT-1", others[0]]}}),
+        ("analytics", None, "GET", "/analytics", {}),
+        ("stats", None, "GET", "/stats", {}),
+        ("slow_query_log", None, "GET", "/slow_queries", {}),
+        ("prometheus_metrics", None, "GET", "/metrics", {}),
+    ]
+    for name, view in tables.VIEWS.items():
+        seek = PAGED_KEYS.get(view.keys[0][0])
+        out.append((f"browse {name}", None, "POST", "/browse_tables",
+                    {"data": {"table_name": name}}))
+        out.append((f"browse {name} page 2", seek and ("paged", seek), "POST",
+                    "/browse_tables", {"data": {"table_name": name}, "next_page": True}))
+        if "medical_record_number" in view.labels:
+            out.append((f"browse {name} by mrn", "single", "POST", "/browse_tables",
+                        {"data": {"table_name": name, "f_medical_record_number": mrn}}))
+            out.append((f"export {name} by mrn", "single", "GET",
+                        f"/export/{name}?f_medical_record_number={mrn}", {}))
+        out.append((f"export {name}", None, "GET", f"/export/{name}", {}))
+    out.append(("healthz", None, "GET", "/healthz", {}))
+    out.append(("logout", None, "GET", "/logout", {}))
+    return out
+
+
+# -------------------------------
+# RULES
+# -------------------------------
+def check(label, rule, entries):
+    problems = []
+    for entry in entries:
+        plan = entry.get("plan") or []
+        sql = entry["sql"]
+        if entry.get("plan_error"):
+            problems.append(f"{label}: EXPLAIN failed ({entry['plan_error']}): {sql}")
+            continue
+
+        if rule == "single":
+            names = dict.fromkeys(PATIENT_TABLES)
+            for table in PATIENT_TABLES:
+                for m in re.finditer(r"\b%s\b\s+(?:AS\s+)?(\w+)" % table, sql):
+                    names[m.group(1)] = table
+            for line in plan:
+                m = re.match(r"SCAN (\w+)", line.strip())
+                if m and m.group(1) in names:
+                    problems.append(f"{label}: full scan `{line.strip()}` in: {sql}")
+
+        if isinstance(rule, tuple) and " ORDER BY " in sql:
+            _, seek = rule
+            if not any(line.strip().startswith("SEARCH") and f"({seek})" in line
+                       for line in plan):
+                problems.append(f"{label}: page does not seek ({seek}) in: {sql}")
+            if any("USE TEMP B-TREE FOR ORDER BY" in line for line in plan):
+                problems.append(f"{label}: page sorted without an index in: {sql}")
+
+        for sql_pattern, plan_pattern in EXPECT:
+            if re.search(sql_pattern, sql) and plan and not any(
+                re.search(plan_pattern, line) for line in plan
+            ):
+                problems.append(
+                    f"{label}: expected /{plan_pattern}/ in the plan of: {sql}\n    "
+                    + "\n    ".join(plan)
+                )
+    return problems
+
+
+# -------------------------------
+# DRIVER
+# -------------------------------
+def run(path, verbose=False):
+    # (problems, statements checked); also the entry point of
+    # tests/test_plan_check.py
+    sys.path.insert(0, HERE)
+    import app as app_module
+
+    # a 0 ms threshold sends every statement, with its plan, to the log
+    app = app_module.create_app({"DATABASE": path, "SLOW_QUERY_MS": 0})
+    capture = Capture()
+    slow_log = logging.getLogger("healthcare.slow_queries")
+    slow_log.addHandler(capture)
+    propagate, slow_log.propagate = slow_log.propagate, False
+    try:
+        return _drive(app, capture, path, verbose)
+    finally:
+        slow_log.removeHandler(capture)
+        slow_log.propagate = propagate
+        db.shutdown(app)
+
+
+def _drive(app, capture, path, verbose):
+    client = app.test_client()
+    response = client.post("/doctor_login", data={"doctor_id": "1", "password": "alice_pw"})
+    if response.status_code != 302:
+        return [f"login failed with status {response.status_code}"], 0
+    exercised = {"views.doctor_login"}
+    capture.drain()
+
+    problems = []
+    statements = 0
+    urls = app.url_map.bind("localhost")
+
+    for label, rule, method, url, kwargs in scenarios(app, path):
+        kwargs = dict(kwargs)
+        next_page = kwargs.pop("next_page", False)
+        if next_page:
+            first = client.open(url, method=method, **kwargs).get_data(as_text=True)
+            cursor = re.search(r"after=([^&\"']+)", first)
+            capture.drain()
+            if cursor is None:
+                continue  # a table with a single page
+            kwargs["data"] = dict(kwargs["data"], after=cursor.group(1))
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # run streamed responses to the end
+        if response.status_code >= 400:
+            problems.append(f"{label}: {method} {url} returned {response.status_code}")
+        exercised.add(urls.match(url.split("?")[0], method=method)[0])
+
+        entries = capture.drain()
+        statements += len(entries)
+        problems += check(label, rule, entries)
+        if verbose:
+            for entry in entries:
+                print(f"[{label}] {entry['sql'][:120]}")
+                for line in entry.get("plan") or []:
+                    print(f"    {line}")
+
+    missing = set(app.view_functions) - exercised - UNCHECKED
+    for endpoint in sorted(missing):
+        problems.append(f"route {endpoint!r} has no plan_check scenario")
+    return problems, statements
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the query plans of every route.")
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--keep-db", help="build (or reuse) the database at this path")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="plan_check_")
+    path = os.path.join(workdir, "plan_check.sqlite")
+    try:
+        if args.keep_db:
+            if not os.path.exists(args.keep_db):
+                build_database(args.keep_db, args.patients)
+            shutil.copy(args.keep_db, path)
+        else:
+            build_database(path, args.patients)
+        problems, statements = run(path, args.verbose)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for problem in problems:
+        print("FAIL", problem)
+    print(f"{statements} statements checked, {len(problems)} problems")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,305 @@
+"""Typeahead search over catalog names and patient MRNs (SQLite FTS5).
+
+Two FTS5 tables mirror "Condition".name, Medication.name, Vaccine.name and
+Patient.medical_record_number, kept in sync by triggers:
+
+  search_index    word tokens with 2/3-character prefix indexes, for
+                  "starts with" matches as the user types
+  search_trigram  trigram tokens, for substring and typo-tolerant matches
+
+Both use rowid = ref_id * 4 + kind code, so a trigger can find the entry
+for a source row without a lookup. On a SQLite built without FTS5 the
+tables are never created and search() falls back to LIKE prefix queries;
+without the trigram tokenizer (SQLite < 3.34) only prefix search is kept.
+
+    python search.py rebuild [path/to/db.sqlite]
+"""
+import difflib
+import re
+import sqlite3
+import sys
+
+# -------------------------------
+# INDEXED COLUMNS
+# -------------------------------
+# kind -> (code, table, id column, text column)
+KINDS = {
+    "condition": (0, '"Condition"', "condition_id", "name"),
+    "medication": (1, "Medication", "medication_id", "name"),
+    "vaccine": (2, "Vaccine", "vaccine_id", "name"),
+    "patient": (3, "Patient", "patient_id", "medical_record_number"),
+}
+N_KINDS = 4
+
+CREATE_INDEX = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        term,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+
+CREATE_TRIGRAM = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_trigram USING fts5(
+        term,
+        tokenize = 'trigram'
+    )
+'''
+
+
+def fts_tables(conn):
+    # which of the two search tables this database has
+    names = {
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE name IN ('search_index', 'search_trigram')"
+        )
+    }
+    return "search_index" in names, "search_trigram" in names
+
+
+# -------------------------------
+# TRIGGERS
+# -------------------------------
+def _add(row, kind, trigram):
+    code, _, id_col, text_col = KINDS[kind]
+    rowid = f"{row}.{id_col} * {N_KINDS} + {code}"
+    statements = [
+        f"INSERT INTO search_index (rowid, term) "
+        f"VALUES ({rowid}, {row}.{text_col})",
+    ]
+    if trigram:
+        statements.append(
+            f"INSERT INTO search_trigram (rowid, term) "
+            f"VALUES ({rowid}, {row}.{text_col})"
+        )
+    return statements
+
+
+def _remove(row, kind, trigram):
+    code, _, id_col, _ = KINDS[kind]
+    rowid = f"{row}.{id_col} * {N_KINDS} + {code}"
+    statements = [f"DELETE FROM search_index WHERE rowid = {rowid}"]
+    if trigram:
+        statements.append(f"DELETE FROM search_trigram WHERE rowid = {rowid}")
+    return statements
+
+
+def triggers(trigram=True):
+    # name -> (trigger header, statements)
+    out = {}
+    for kind, (_, table, _, text_col) in KINDS.items():
+        out[f"trg_search_{kind}_ins"] = (
+            f"AFTER INSERT ON {table}", _add("NEW", kind, trigram)
+        )
+        out[f"trg_search_{kind}_del"] = (
+            f"AFTER DELETE ON {table}", _remove("OLD", kind, trigram)
+        )
+        out[f"trg_search_{kind}_upd"] = (
+            f"AFTER UPDATE OF {text_col} ON {table}",
+            _remove("OLD", kind, trigram) + _add("NEW", kind, trigram),
+        )
+    return out
+
+
+def install_triggers(conn):
+    # Idempotent; re-run after any migration that rebuilds a source table.
+    fts, trigram = fts_tables(conn)
+    if not fts:
+        return
+    for name, (header, statements) in triggers(trigram).items():
+        body = ";\n".join(statements)
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {header} BEGIN\n{body};\nEND")
+
+
+def drop_triggers(conn):
+    for name in triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def install(conn):
+    # Returns False (and creates nothing) when SQLite lacks FTS5.
+    try:
+        conn.execute(CREATE_INDEX)
+    except sqlite3.OperationalError:
+        return False
+    try:
+        conn.execute(CREATE_TRIGRAM)
+    except sqlite3.OperationalError:
+        pass  # no trigram tokenizer; prefix search only
+    install_triggers(conn)
+    rebuild(conn)
+    return True
+
+
+def rebuild(conn):
+    _, trigram = fts_tables(conn)
+    conn.execute("DELETE FROM search_index")
+    if trigram:
+        conn.execute("DELETE FROM search_trigram")
+    for kind, (code, table, id_col, text_col) in KINDS.items():
+        rowid = f"{id_col} * {N_KINDS} + {code}"
+        conn.execute(
+            f"INSERT INTO search_index (rowid, term) "
+            f"SELECT {rowid}, {text_col} FROM {table}"
+        )
+        if trigram:
+            conn.execute(
+                f"INSERT INTO search_trigram (rowid, term) "
+                f"SELECT {rowid}, {text_col} FROM {table}"
+            )
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    if trigram:
+        conn.execute(
+            "INSERT INTO search_trigram (search_trigram) VALUES ('optimize')"
+        )
+
+
+# -------------------------------
+# QUERIES
+# -------------------------------
+# Matches are fetched unranked (FTS5 can stop after LIMIT rows; ORDER BY
+# bm25 has to score every match first) and ranked here. A query matching
+# no more than CANDIDATES terms is therefore ranked exactly; a broader one
+# (one or two letters typed) returns good-enough suggestions fast.
+CANDIDATES = 100
+
+# how close (difflib ratio) a typo'd query must be to count as a match
+SIMILARITY = 0.75
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _prefix_query(q):
+    # "mrn-10" -> "mrn"* "10"*   (every word must match as a prefix)
+    return " ".join(_quote(w) + "*" for w in re.findall(r"\w+", q))
+
+
+def _candidates(conn, table, match, codes):
+    if not match:
+        return []
+    marks = ",".join("?" * len(codes))
+    return conn.execute(
+        f"SELECT rowid, term FROM {table} "
+        f"WHERE {table} MATCH ? AND rowid % {N_KINDS} IN ({marks}) LIMIT ?",
+        [match] + codes + [CANDIDATES],
+    ).fetchall()
+
+
+def _similarity(matcher, needle, hay, cutoff):
+    # 1.0 for a substring, else the best match of the needle against a
+    # needle-sized window starting at any word of hay; matcher has the
+    # needle as seq2 so difflib only indexes it once
+    if needle in hay:
+        return 1.0
+    best = 0.0
+    for i in [0] + [m.end() for m in re.finditer(r"\W+", hay)]:
+        matcher.set_seq1(hay[i:i + len(needle) + 1])
+        if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+            continue
+        best = max(best, matcher.ratio())
+    return best
+
+
+def _kind_of(rowid):
+    code = rowid % N_KINDS
+    for kind, (c, _, _, _) in KINDS.items():
+        if c == code:
+            return kind
+
+
+def _fts_search(conn, q, kinds, limit, trigram):
+    codes = [KINDS[k][0] for k in kinds]
+    needle = q.lower()
+    results = {}  # rowid -> term, in rank order
+
+    def take(rows, key):
+        for rowid, term in sorted(rows, key=key):
+            if len(results) >= limit:
+                return
+            results.setdefault(rowid, term)
+
+    def closeness(row):
+        # whole term starts with the query, then shorter, then alphabetical
+        term = row[1].lower()
+        return (not term.startswith(needle), len(term), term)
+
+    # 1. every word of the query is a word prefix ("type 2 dia")
+    take(_candidates(conn, "search_index", _prefix_query(q), codes), closeness)
+
+    # 2. the query appears anywhere ("betes")
+    if trigram and len(results) < limit and len(q) >= 3:
+        take(_candidates(conn, "search_trigram", _quote(q), codes), closeness)
+
+    # 3. one typo ("diabtes", "cardoi"): one half of the query is intact,
+    #    so gather terms matching either half and keep the similar ones
+    if len(results) < limit and len(q) >= 4:
+        half = len(q) // 2
+        rows = _candidates(conn, "search_index", _prefix_query(q[:half + 1]), codes)
+        if trigram and len(q) - half >= 3:
+            rows += _candidates(conn, "search_trigram", _quote(q[half:]), codes)
+        matcher = difflib.SequenceMatcher(None, "", needle)
+        scored = {}
+        for rowid, term in rows:
+            if rowid not in results:
+                score = _similarity(matcher, needle, term.lower(), SIMILARITY)
+                if score >= SIMILARITY:
+                    scored[rowid] = (score, term)
+        take(
+            [(rowid, term) for rowid, (_, term) in scored.items()],
+            lambda row: (-scored[row[0]][0],) + closeness(row),
+        )
+
+    return [
+        {"kind": _kind_of(rowid), "id": rowid // N_KINDS, "label": term}
+        for rowid, term in results.items()
+    ]
+
+
+def _like_search(conn, q, kinds, limit):
+    # no FTS5: prefix matches straight off the source tables
+    results = []
+    pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    for kind in kinds:
+        _, table, id_col, text_col = KINDS[kind]
+        rows = conn.execute(
+            f"SELECT {id_col}, {text_col} FROM {table} "
+            f"WHERE {text_col} LIKE ? ESCAPE '\\' "
+            f"ORDER BY length({text_col}), {text_col} LIMIT ?",
+            (pattern, limit),
+        ).fetchall()
+        results += [{"kind": kind, "id": r[0], "label": r[1]} for r in rows]
+    results.sort(key=lambda r: (len(r["label"]), r["label"]))
+    return results[:limit]
+
+
+def search(conn, q, kinds=None, limit=10):
+    # [{"kind", "id", "label"}], best matches first
+    q = q.strip()
+    kinds = [k for k in (kinds or KINDS) if k in KINDS]
+    if not q or not kinds:
+        return []
+    fts, trigram = fts_tables(conn)
+    if fts:
+        return _fts_search(conn, q, kinds, limit, trigram)
+    return _like_search(conn, q, kinds, limit)
+
+
+if __name__ == "__main__":
+    import os
+
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit("usage: python search.py rebuild [path/to/db.sqlite]")
+
+    default = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "healthcare_analytics.sqlite"
+    )
+    path = sys.argv[2] if len(sys.argv) > 2 else default
+    conn = sqlite3.connect(path)
+    with conn:
+        if not install(conn):
+            sys.exit("this SQLite build has no FTS5")
+    print(f"{path}: search index rebuilt")
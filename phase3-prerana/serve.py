@@ -0,0 +1,312 @@
+"""Production launcher for app.py: a prefork pool of threaded workers.
+
+The master process builds the app once with create_app(). That runs the
+migrations, compiles every template, loads the dropdown catalogs (and
+the cohort store, in columnar analytics mode) and answers one GET
+/healthz through the test client. Then it closes its database
+connections, binds the listening socket and forks --workers children.
+Each child serves the shared socket with a threaded WSGI server. At most
+--threads requests per worker run inside the app at once, a streamed
+export counting until its body is closed; others wait their turn. A
+child opens its own pooled connections and writer thread on first use,
+never one inherited from the master.
+
+Writes from different workers serialize in SQLite (WAL plus the busy
+timeout); a lock that outlasts it is answered with 503. Each worker keeps
+its own caches. A shared-memory change ring (cache.SharedChanges) tells
+every worker which patients the others wrote, and the catalogs get a
+short TTL (HEALTHCARE_CATALOG_TTL, 30 s unless set). Each worker also
+publishes its request and cache counters to shared memory every second
+(metrics.SharedMetrics), so /metrics reports the sum over all workers
+whichever one takes the scrape.
+
+After forking, the master polls /healthz over HTTP and exits 1 if no
+worker answers within --startup-timeout. On SIGTERM or SIGINT it stops
+replacing workers and passes SIGTERM on. Each worker stops accepting,
+finishes its requests in flight, drains its writer queue and exits;
+any left after --graceful-timeout are killed. A worker that dies on its
+own is replaced.
+
+    python serve.py [--bind 127.0.0.1:8000] [--workers N] [--threads N]
+                    [--graceful-timeout 30] [--startup-timeout 15] [--access-log]
+
+--bind, --workers and --threads default to HEALTHCARE_BIND,
+HEALTHCARE_WORKERS and HEALTHCARE_THREADS; the app reads the rest of its
+HEALTHCARE_* settings as usual.
+"""
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+from werkzeug.serving import make_server
+
+import catalogs
+import cohort_store
+import db
+from app import create_app
+
+log = logging.getLogger("healthcare.serve")
+
+# change-ring entries shared by the workers (see cache.SharedChanges)
+SHARED_CHANGES = 4096
+
+
+# -------------------------------
+# MASTER: PRELOAD
+# -------------------------------
+def preload(workers):
+    config = {}
+    if workers > 1:
+        config["SHARED_CHANGES"] = SHARED_CHANGES
+        config["SHARED_METRICS"] = workers
+        if not os.environ.get("HEALTHCARE_CATALOG_TTL"):
+            config["CATALOG_TTL"] = 30
+    app = create_app(config)
+
+    # compiled templates, loaded catalogs and the cohort store's arrays are
+    # inherited by every worker
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        for name in catalogs.CATALOGS:
+            catalogs.get_catalog(name).rows()
+        store = cohort_store.get_cohort_store()
+        if store is not None:
+            store.refresh()
+
+    response = app.test_client().get("/healthz")
+    if response.status_code != 200:
+        raise SystemExit(f"health check failed before forking: {response.get_data(as_text=True)}")
+
+    db.shutdown(app)
+    return app
+
+
+def listen(host, port, backlog=2048):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+# -------------------------------
+# WORKER
+# -------------------------------
+class _Body:
+    # The app's response iterable, holding a permit until the server closes
+    # it: a streamed body (the /export generators) is still running, and
+    # may still hold a pooled connection, after the app has returned it.
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            release, self.release = self.release, None
+            if release is not None:
+                release()
+
+
+def limited(app, threads):
+    # at most `threads` requests inside the app (or streaming its body) at once
+    gate = threading.BoundedSemaphore(threads)
+
+    def wsgi(environ, start_response):
+        gate.acquire()
+        try:
+            body = app(environ, start_response)
+        except BaseException:
+            gate.release()
+            raise
+        return _Body(body, gate.release)
+
+    return wsgi, gate
+
+
+def run_worker(app, sock, host, port, threads, graceful_timeout, slot=0):
+    shared_metrics = app.extensions.get("shared_metrics")
+    if shared_metrics is not None:
+        shared_metrics.start(app, slot)
+    wsgi, gate = limited(app, threads)
+    server = make_server(host, port, wsgi, threaded=True, fd=sock.fileno())
+    # Every worker wakes up for each new connection but only one gets it;
+    # the others must find accept() empty rather than block in it, or
+    # they stop noticing shutdown().
+    server.socket.setblocking(False)
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() waits for serve_forever() to return, which runs on
+            # this (the main) thread, so it has to be called from another
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+
+    # wait for the requests in flight: they hold the gate's permits
+    deadline = time.monotonic() + graceful_timeout
+    held = 0
+    while held < threads and gate.acquire(timeout=max(0, deadline - time.monotonic())):
+        held += 1
+    if shared_metrics is not None:
+        shared_metrics.stop(app)
+    db.shutdown(app)
+    return 0 if held == threads else 1
+
+
+# -------------------------------
+# MASTER: SUPERVISE
+# -------------------------------
+class Master:
+    def __init__(self, app, sock, host, port, workers, threads, graceful_timeout):
+        self.app = app
+        self.sock = sock
+        self.host, self.port = host, port
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.children = {}  # pid -> (started at, metrics slot)
+        self.stopping = False
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.app, self.sock, self.host, self.port,
+                                  self.threads, self.graceful_timeout, slot)
+            except BaseException:
+                log.exception("worker %d crashed", os.getpid())
+            finally:
+                os._exit(code)
+        self.children[pid] = (time.monotonic(), slot)
+        return pid
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            child = self.children.pop(pid, None)
+            if child is not None and not self.stopping:
+                started, slot = child
+                log.warning("worker %d exited (status %d); replacing it", pid, status)
+                if time.monotonic() - started < 1:
+                    time.sleep(1)  # don't spin on a worker that dies at once
+                self.spawn(slot)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def shutdown(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 1
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            log.warning("worker %d did not stop in time; killing it", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.children:
+            self.reap()
+            time.sleep(0.05)
+
+    def healthy(self, timeout):
+        host = "127.0.0.1" if self.host in ("0.0.0.0", "") else self.host.strip("[]")
+        if host == "::":
+            host = "::1"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self.stopping:
+            try:
+                conn = HTTPConnection(host, self.port, timeout=2)
+                conn.request("GET", "/healthz")
+                if conn.getresponse().status == 200:
+                    return True
+            except OSError:
+                pass
+            self.reap()
+            time.sleep(0.2)
+        return False
+
+    def run(self, startup_timeout):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+        if not self.healthy(startup_timeout):
+            log.error("no worker answered /healthz within %ss", startup_timeout)
+            self.shutdown()
+            return 1
+        log.info("serving on http://%s:%d with %d workers x %d threads (master %d)",
+                 self.host, self.port, self.workers, self.threads, os.getpid())
+
+        while not self.stopping:
+            self.reap()
+            time.sleep(0.2)
+        log.info("stopping")
+        self.shutdown()
+        return 0
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the healthcare app with prefork workers.")
+    parser.add_argument("--bind", default=os.environ.get("HEALTHCARE_BIND", "127.0.0.1:8000"),
+                        help="HOST:PORT to listen on")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("HEALTHCARE_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int,
+                        default=int(os.environ.get("HEALTHCARE_THREADS", 8)),
+                        help="requests each worker runs at once")
+    parser.add_argument("--graceful-timeout", type=float, default=30)
+    parser.add_argument("--startup-timeout", type=float, default=15)
+    parser.add_argument("--access-log", action="store_true",
+                        help="log every request (werkzeug format)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    host, _, port = args.bind.rpartition(":")
+    host, port = host.strip("[]") or "127.0.0.1", int(port)
+    app = preload(args.workers)
+    sock = listen(host, port)
+    master = Master(app, sock, host, port, max(1, args.workers), max(1, args.threads),
+                    args.graceful_timeout)
+    sys.exit(master.run(args.startup_timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from instrumentation import LITERALS, normalize_sql
+
+log = logging.getLogger("healthcare.slow_queries")
+
+# Tables that grow with the patient count; a SCAN of one of these in a
+# request path is almost always a missing or unusable index.
+RELATIONSHIP_TABLES = (
+    "PatientCondition",
+    "PatientMedication",
+    "PatientImmunization",
+    "PatientHospital",
+    "MedicationCondition",
+)
+
+# columns whose compared values are patient identifiers
+REDACT_COLUMNS = ("medical_record_number", "mrn")
+
+# MRN-shaped values anywhere else (INSERT ... VALUES, JSON lists)
+MRN_PATTERN = r"MRN[-_ ]?\w+"
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+_SCAN = re.compile(r"^SCAN (\w+)")
+_NOT_ALIAS = {
+    "AS", "ON", "USING", "JOIN", "LEFT", "INNER", "CROSS", "NATURAL", "WHERE",
+    "GROUP", "ORDER", "LIMIT", "UNION", "SET", "VALUES", "WHEN", "DEFAULT",
+}
+
+
+# -------------------------------
+# PARAMETERS (REDACTED)
+# -------------------------------
+def redacted_params(sql, mrn_pattern=MRN_PATTERN):
+    # the values the statement ran with, in order of its ? placeholders
+    compared_to_mrn = re.compile(
+        r"\b(?:%s)\s*(?:=|==|!=|<>|LIKE|GLOB)\s*$" % "|".join(REDACT_COLUMNS),
+        re.I,
+    )
+    mrn = re.compile(mrn_pattern, re.I)
+    insert_columns, values_at = _insert_columns(sql)
+    in_lists = _mrn_in_lists(sql)
+    params = []
+    for match in LITERALS.finditer(sql):
+        if any(start <= match.start() < end for start, end in in_lists):
+            params.append("<redacted>")
+            continue
+        if values_at is not None and match.start() > values_at:
+            # i-th value of an INSERT row goes to its i-th column
+            column = insert_columns[len(params) % len(insert_columns)]
+            if column in REDACT_COLUMNS:
+                params.append("<redacted>")
+                continue
+        text = match.group()
+        if not text.startswith("'"):
+            params.append(float(text) if re.search(r"[.e]", text, re.I) else int(text))
+            continue
+        value = text[1:-1].replace("''", "'")
+        if value.startswith("["):
+            # a JSON list binding (json_each); these carry MRN or id lists
+            try:
+                params.append(f"<list of {len(json.loads(value))}>")
+                continue
+            except ValueError:
+                pass
+        if compared_to_mrn.search(sql, 0, match.start()) or mrn.search(value):
+            value = "<redacted>"
+        params.append(value)
+    return params
+
+
+def _mrn_in_lists(sql):
+    # (start, end) of the parentheses after `mrn_column [NOT] IN`; every
+    # literal between them is an MRN, whatever it looks like
+    spans = []
+    opening = re.compile(r"\b(?:%s)\s+(?:NOT\s+)?IN\s*\(" % "|".join(REDACT_COLUMNS), re.I)
+    for match in opening.finditer(sql):
+        depth = 1
+        for token in re.finditer(r"'(?:[^']|'')*'|[()]", sql[match.end():]):
+            if token.group() == "(":
+                depth += 1
+            elif token.group() == ")":
+                depth -= 1
+                if depth == 0:
+                    spans.append((match.end(), match.end() + token.start()))
+                    break
+        else:
+            spans.append((match.end(), len(sql)))
+    return spans
+
+
+def _insert_columns(sql):
+    # (column names, offset of VALUES) for INSERT ... (cols) VALUES (...)
+    match = re.match(
+        r"\s*(?:INSERT|REPLACE)\b[^(]*\(([^)]*)\)\s*VALUES\b", sql, re.I
+    )
+    if match is None:
+        return None, None
+    columns = [c.strip().strip('"').lower() for c in match.group(1).split(",")]
+    return columns, match.end()
+
+
+# -------------------------------
+# QUERY PLAN
+# -------------------------------
+def query_plan(conn, sql):
+    # EXPLAIN QUERY PLAN rows as indented lines, like the sqlite3 shell
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+    return lines
+
+
+def _aliases(sql, tables):
+    # alias or table name as it appears in plan rows -> table
+    names = {table: table for table in tables}
+    for table in tables:
+        for match in re.finditer(r"\b%s\b\s+(?:AS\s+)?(\w+)" % table, sql, re.I):
+            alias = match.group(1)
+            if alias.upper() not in _NOT_ALIAS:
+                names[alias] = table
+    return names
+
+
+def flagged_scans(sql, plan, tables=RELATIONSHIP_TABLES):
+    names = _aliases(sql, tables)
+    flags = []
+    for line in plan:
+        match = _SCAN.match(line.strip())
+        if match and match.group(1) in names:
+            flags.append(f"{line.strip()} ({names[match.group(1)]})")
+    return flags
+
+
+# -------------------------------
+# RING BUFFER + LOG
+# -------------------------------
+class SlowQueryLog:
+    def __init__(self, pool, threshold_ms=100, keep=100,
+                 tables=RELATIONSHIP_TABLES, mrn_pattern=MRN_PATTERN):
+        self.pool = pool
+        self.threshold_ms = threshold_ms
+        self.tables = tables
+        self.mrn_pattern = mrn_pattern
+        self._entries = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.total = 0
+        self.flagged = 0
+
+    def record(self, endpoint, slow):
+        # slow: [(sql as run, seconds)]. Runs at the end of the request, on
+        # a pooled connection of its own, never inside the SQLite callback
+        # that timed the statement.
+        conn = self.pool.acquire()
+        try:
+            entries = [self._entry(conn, endpoint, sql, seconds) for sql, seconds in slow]
+        finally:
+            self.pool.release(conn)
+
+        with self._lock:
+            for entry in entries:
+                self._entries.append(entry)
+                self.total += 1
+                if entry["flagged"]:
+                    self.flagged += 1
+        for entry in entries:
+            log.warning(json.dumps(dict(event="slow_query", **entry)))
+
+    def _entry(self, conn, endpoint, sql, seconds):
+        plan, error = None, None
+        if _EXPLAINABLE.match(sql):
+            try:
+                plan = query_plan(conn, sql)
+            except sqlite3.Error as exc:
+                error = str(exc)  # e.g. refers to a temp table of the writer
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "endpoint": endpoint,
+            "ms": round(seconds * 1000, 3),
+            "sql": normalize_sql(sql),
+            "params": redacted_params(sql, self.mrn_pattern),
+            "plan": plan,
+            "flagged": flagged_scans(sql, plan, self.tables) if plan else [],
+        }
+        if error:
+            entry["plan_error"] = error
+        return entry
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold_ms,
+                "total": self.total,
+                "flagged": self.flagged,
+                "kept": len(self._entries),
+            }
+
+
+# -------------------------------
+# FLASK INTEGRATION
+# -------------------------------
+def init_app(app):
+    # needs instrumentation.init_app(app) to have run first
+    app.config.setdefault("SLOW_QUERY_MS", 100)
+    app.config.setdefault("SLOW_QUERY_KEEP", 100)
+    instrumentation = app.extensions.get("instrumentation")
+    if instrumentation is None or app.config["SLOW_QUERY_MS"] is None:
+        return
+
+    slow_log = SlowQueryLog(
+        app.extensions["db_pool"],
+        threshold_ms=app.config["SLOW_QUERY_MS"],
+        keep=app.config["SLOW_QUERY_KEEP"],
+    )
+    app.extensions["slow_queries"] = slow_log
+    instrumentation.slow_threshold = app.config["SLOW_QUERY_MS"] / 1000
+    instrumentation.slow_log = slow_log
+
+
+def get_slow_log():
+    return current_app.extensions.get("slow_queries")
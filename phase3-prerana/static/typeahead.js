@@ -0,0 +1,41 @@
+// Suggestions from /search for any <input data-typeahead="kind[,kind]">,
+// shown through a <datalist> so the browser draws the dropdown.
+document.querySelectorAll("input[data-typeahead]").forEach(function (input) {
+    var list = document.createElement("datalist");
+    list.id = input.name + "-suggestions";
+    input.setAttribute("list", list.id);
+    input.setAttribute("autocomplete", "off");
+    input.after(list);
+
+    var kinds = input.dataset.typeahead.split(",");
+    var timer = null;
+    var pending = null;
+
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        var q = input.value.trim();
+        if (!q) {
+            list.innerHTML = "";
+            return;
+        }
+        timer = setTimeout(function () {
+            if (pending) pending.abort();
+            pending = new AbortController();
+
+            var params = new URLSearchParams({ q: q, limit: 8 });
+            kinds.forEach(function (k) { params.append("kind", k); });
+
+            fetch("/search?" + params, { signal: pending.signal })
+                .then(function (r) { return r.json(); })
+                .then(function (data) {
+                    list.innerHTML = "";
+                    data.results.forEach(function (item) {
+                        var option = document.createElement("option");
+                        option.value = item.label;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(function () {});
+        }, 120);
+    });
+});
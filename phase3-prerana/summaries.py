@@ -0,0 +1,599 @@
+"""Analytics summary tables kept current by SQLite triggers.
+
+The /analytics page reads these small tables instead of aggregating the
+relationship tables on every view. To recompute them from scratch, or to
+compare them against the live aggregates:
+
+    python summaries.py rebuild [path/to/db.sqlite]
+    python summaries.py check   [path/to/db.sqlite]
+"""
+import sqlite3
+import sys
+
+# -------------------------------
+# TABLES
+# -------------------------------
+# summary table -> (CREATE TABLE, live aggregate producing the same columns)
+SUMMARIES = {
+    # condition -> distinct patients (PatientCondition's primary key makes
+    # every row a distinct patient) plus birth years for the average age
+    "summary_condition": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_condition (
+            condition_id     INTEGER PRIMARY KEY,
+            total_patients   INTEGER NOT NULL,
+            birth_year_sum   INTEGER NOT NULL,
+            birth_year_count INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT pc.condition_id, COUNT(*),
+               IFNULL(SUM(p.birth_year), 0), COUNT(p.birth_year)
+        FROM PatientCondition pc
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        GROUP BY pc.condition_id
+        ''',
+    ),
+    "summary_condition_gender": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_condition_gender (
+            condition_id INTEGER NOT NULL,
+            gender       TEXT,
+            total        INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT pc.condition_id, p.gender, COUNT(*)
+        FROM PatientCondition pc
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        GROUP BY pc.condition_id, p.gender
+        ''',
+    ),
+    "summary_condition_blood": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_condition_blood (
+            condition_id INTEGER NOT NULL,
+            blood_type   TEXT,
+            total        INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT pc.condition_id, p.blood_type, COUNT(*)
+        FROM PatientCondition pc
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        GROUP BY pc.condition_id, p.blood_type
+        ''',
+    ),
+    "summary_vaccine": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_vaccine (
+            vaccine_id     INTEGER PRIMARY KEY,
+            total_doses    INTEGER NOT NULL,
+            total_patients INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT vaccine_id, COUNT(*), COUNT(DISTINCT patient_id)
+        FROM PatientImmunization
+        GROUP BY vaccine_id
+        ''',
+    ),
+    "summary_hospital_condition": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_hospital_condition (
+            hospital_id  INTEGER NOT NULL,
+            condition_id INTEGER NOT NULL,
+            total        INTEGER NOT NULL,
+            PRIMARY KEY (hospital_id, condition_id)
+        )
+        ''',
+        '''
+        SELECT ph.hospital_id, pc.condition_id, COUNT(*)
+        FROM PatientHospital ph
+        JOIN PatientCondition pc ON ph.patient_id = pc.patient_id
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        GROUP BY ph.hospital_id, pc.condition_id
+        ''',
+    ),
+    "summary_blood_type": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_blood_type (
+            blood_type TEXT,
+            total      INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT blood_type, COUNT(*)
+        FROM Patient
+        GROUP BY blood_type
+        ''',
+    ),
+    "summary_birth_year": (
+        '''
+        CREATE TABLE IF NOT EXISTS summary_birth_year (
+            birth_year INTEGER PRIMARY KEY,
+            total      INTEGER NOT NULL
+        )
+        ''',
+        '''
+        SELECT birth_year, COUNT(*)
+        FROM Patient
+        WHERE birth_year IS NOT NULL
+        GROUP BY birth_year
+        ''',
+    ),
+}
+
+# gender / blood_type can be NULL, so these tables can't use a primary key
+# for upserts; the triggers match groups with IS instead
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_summary_condition_gender "
+    "ON summary_condition_gender(condition_id, gender)",
+    "CREATE INDEX IF NOT EXISTS idx_summary_condition_blood "
+    "ON summary_condition_blood(condition_id, blood_type)",
+    "CREATE INDEX IF NOT EXISTS idx_summary_blood_type "
+    "ON summary_blood_type(blood_type)",
+]
+
+
+# -------------------------------
+# TRIGGER BODIES
+# -------------------------------
+# Every PatientCondition / PatientHospital statement joins Patient. When a
+# patient is deleted through ON DELETE CASCADE the child triggers can no
+# longer see the patient row, so they do nothing and the BEFORE DELETE
+# trigger on Patient subtracts that patient's contributions instead.
+
+def _bump_group(table, key, cond_expr, patient_expr, sign):
+    # NULL-safe "upsert" of a (condition_id, <key>) group
+    if sign > 0:
+        return [
+            f'''
+            INSERT INTO {table} (condition_id, {key}, total)
+            SELECT {cond_expr}, p.{key}, 0
+            FROM Patient p
+            WHERE p.patient_id = {patient_expr}
+              AND NOT EXISTS (
+                  SELECT 1 FROM {table} s
+                  WHERE s.condition_id = {cond_expr} AND s.{key} IS p.{key}
+              )
+            ''',
+            f'''
+            UPDATE {table} SET total = total + 1
+            FROM Patient p
+            WHERE p.patient_id = {patient_expr}
+              AND {table}.condition_id = {cond_expr} AND {table}.{key} IS p.{key}
+            ''',
+        ]
+    return [
+        f'''
+        UPDATE {table} SET total = total - 1
+        FROM Patient p
+        WHERE p.patient_id = {patient_expr}
+          AND {table}.condition_id = {cond_expr} AND {table}.{key} IS p.{key}
+        ''',
+        f"DELETE FROM {table} WHERE condition_id = {cond_expr} AND total <= 0",
+    ]
+
+
+def _patient_condition(row, sign):
+    pid = f"{row}.patient_id"
+    cid = f"{row}.condition_id"
+    if sign > 0:
+        statements = [
+            f'''
+            INSERT INTO summary_condition
+                (condition_id, total_patients, birth_year_sum, birth_year_count)
+            SELECT {cid}, 1, IFNULL(p.birth_year, 0), p.birth_year IS NOT NULL
+            FROM Patient p
+            WHERE p.patient_id = {pid}
+            ON CONFLICT (condition_id) DO UPDATE SET
+                total_patients   = total_patients + 1,
+                birth_year_sum   = birth_year_sum + excluded.birth_year_sum,
+                birth_year_count = birth_year_count + excluded.birth_year_count
+            ''',
+            f'''
+            INSERT INTO summary_hospital_condition (hospital_id, condition_id, total)
+            SELECT ph.hospital_id, {cid}, 1
+            FROM PatientHospital ph
+            JOIN Patient p ON ph.patient_id = p.patient_id
+            WHERE ph.patient_id = {pid}
+            ON CONFLICT (hospital_id, condition_id) DO UPDATE SET
+                total = total + 1
+            ''',
+        ]
+    else:
+        statements = [
+            f'''
+            UPDATE summary_condition SET
+                total_patients   = total_patients - 1,
+                birth_year_sum   = birth_year_sum - IFNULL(p.birth_year, 0),
+                birth_year_count = birth_year_count - (p.birth_year IS NOT NULL)
+            FROM Patient p
+            WHERE p.patient_id = {pid} AND summary_condition.condition_id = {cid}
+            ''',
+            f"DELETE FROM summary_condition "
+            f"WHERE condition_id = {cid} AND total_patients <= 0",
+            f'''
+            UPDATE summary_hospital_condition SET total = total - 1
+            FROM PatientHospital ph
+            JOIN Patient p ON ph.patient_id = p.patient_id
+            WHERE ph.patient_id = {pid}
+              AND summary_hospital_condition.hospital_id = ph.hospital_id
+              AND summary_hospital_condition.condition_id = {cid}
+            ''',
+            f'''
+            DELETE FROM summary_hospital_condition
+            WHERE hospital_id IN (
+                SELECT hospital_id FROM PatientHospital WHERE patient_id = {pid}
+            )
+              AND condition_id = {cid} AND total <= 0
+            ''',
+        ]
+    statements += _bump_group("summary_condition_gender", "gender", cid, pid, sign)
+    statements += _bump_group("summary_condition_blood", "blood_type", cid, pid, sign)
+    return statements
+
+
+def _patient_hospital(row, sign):
+    if sign > 0:
+        return [
+            f'''
+            INSERT INTO summary_hospital_condition (hospital_id, condition_id, total)
+            SELECT {row}.hospital_id, pc.condition_id, 1
+            FROM PatientCondition pc
+            JOIN Patient p ON pc.patient_id = p.patient_id
+            WHERE pc.patient_id = {row}.patient_id
+            ON CONFLICT (hospital_id, condition_id) DO UPDATE SET
+                total = total + 1
+            ''',
+        ]
+    return [
+        f'''
+        UPDATE summary_hospital_condition SET total = total - 1
+        FROM PatientCondition pc
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        WHERE pc.patient_id = {row}.patient_id
+          AND summary_hospital_condition.hospital_id = {row}.hospital_id
+          AND summary_hospital_condition.condition_id = pc.condition_id
+        ''',
+        f"DELETE FROM summary_hospital_condition "
+        f"WHERE hospital_id = {row}.hospital_id AND total <= 0",
+    ]
+
+
+def _patient_immunization(row, sign):
+    # total_patients only moves on a patient's first / last dose of a vaccine
+    same = (
+        f"SELECT COUNT(*) FROM PatientImmunization "
+        f"WHERE patient_id = {row}.patient_id AND vaccine_id = {row}.vaccine_id"
+    )
+    if sign > 0:
+        return [
+            f'''
+            INSERT INTO summary_vaccine (vaccine_id, total_doses, total_patients)
+            SELECT {row}.vaccine_id, 1, ({same}) = 1
+            WHERE true
+            ON CONFLICT (vaccine_id) DO UPDATE SET
+                total_doses    = total_doses + 1,
+                total_patients = total_patients + excluded.total_patients
+            ''',
+        ]
+    return [
+        f'''
+        UPDATE summary_vaccine SET
+            total_doses    = total_doses - 1,
+            total_patients = total_patients - (({same}) = 0)
+        WHERE vaccine_id = {row}.vaccine_id
+        ''',
+        f"DELETE FROM summary_vaccine "
+        f"WHERE vaccine_id = {row}.vaccine_id AND total_doses <= 0",
+    ]
+
+
+def _patient_row(row, sign):
+    # Patient-level tables: blood type counts and the birth-year histogram
+    statements = []
+    if sign > 0:
+        statements += [
+            f'''
+            INSERT INTO summary_blood_type (blood_type, total)
+            SELECT {row}.blood_type, 0
+            WHERE NOT EXISTS (
+                SELECT 1 FROM summary_blood_type
+                WHERE blood_type IS {row}.blood_type
+            )
+            ''',
+            f'''
+            UPDATE summary_blood_type SET total = total + 1
+            WHERE blood_type IS {row}.blood_type
+            ''',
+            f'''
+            INSERT INTO summary_birth_year (birth_year, total)
+            SELECT {row}.birth_year, 1
+            WHERE {row}.birth_year IS NOT NULL
+            ON CONFLICT (birth_year) DO UPDATE SET total = total + 1
+            ''',
+        ]
+    else:
+        statements += [
+            f'''
+            UPDATE summary_blood_type SET total = total - 1
+            WHERE blood_type IS {row}.blood_type
+            ''',
+            f"DELETE FROM summary_blood_type "
+            f"WHERE blood_type IS {row}.blood_type AND total <= 0",
+            f'''
+            UPDATE summary_birth_year SET total = total - 1
+            WHERE birth_year = {row}.birth_year
+            ''',
+            f"DELETE FROM summary_birth_year "
+            f"WHERE birth_year = {row}.birth_year AND total <= 0",
+        ]
+    return statements
+
+
+def _conditions_of(row):
+    # the patient's conditions; empty groups are only ever left behind for
+    # these, so the cleanup DELETEs can seek instead of scanning
+    return f"SELECT condition_id FROM PatientCondition WHERE patient_id = {row}.patient_id"
+
+
+def _patient_attribute(key):
+    # a patient's gender / blood_type changed: move each of their
+    # conditions from the old group to the new one
+    table = {
+        "gender": "summary_condition_gender",
+        "blood_type": "summary_condition_blood",
+    }[key]
+    return [
+        f'''
+        UPDATE {table} SET total = total - 1
+        FROM PatientCondition pc
+        WHERE pc.patient_id = NEW.patient_id
+          AND {table}.condition_id = pc.condition_id AND {table}.{key} IS OLD.{key}
+        ''',
+        f"DELETE FROM {table} "
+        f"WHERE condition_id IN ({_conditions_of('NEW')}) AND total <= 0",
+        f'''
+        INSERT INTO {table} (condition_id, {key}, total)
+        SELECT pc.condition_id, NEW.{key}, 0
+        FROM PatientCondition pc
+        WHERE pc.patient_id = NEW.patient_id
+          AND NOT EXISTS (
+              SELECT 1 FROM {table} s
+              WHERE s.condition_id = pc.condition_id AND s.{key} IS NEW.{key}
+          )
+        ''',
+        f'''
+        UPDATE {table} SET total = total + 1
+        FROM PatientCondition pc
+        WHERE pc.patient_id = NEW.patient_id
+          AND {table}.condition_id = pc.condition_id AND {table}.{key} IS NEW.{key}
+        ''',
+    ]
+
+
+def _patient_birth_year():
+    return [
+        '''
+        UPDATE summary_condition SET
+            birth_year_sum   = birth_year_sum
+                               - IFNULL(OLD.birth_year, 0)
+                               + IFNULL(NEW.birth_year, 0),
+            birth_year_count = birth_year_count
+                               - (OLD.birth_year IS NOT NULL)
+                               + (NEW.birth_year IS NOT NULL)
+        FROM PatientCondition pc
+        WHERE pc.patient_id = NEW.patient_id
+          AND summary_condition.condition_id = pc.condition_id
+        ''',
+    ]
+
+
+def _patient_removed():
+    # runs BEFORE DELETE ON Patient, while the patient and (with cascading
+    # foreign keys) their child rows are still visible
+    conditions = _conditions_of("OLD")
+    return [
+        '''
+        UPDATE summary_condition SET
+            total_patients   = total_patients - 1,
+            birth_year_sum   = birth_year_sum - IFNULL(OLD.birth_year, 0),
+            birth_year_count = birth_year_count - (OLD.birth_year IS NOT NULL)
+        FROM PatientCondition pc
+        WHERE pc.patient_id = OLD.patient_id
+          AND summary_condition.condition_id = pc.condition_id
+        ''',
+        f"DELETE FROM summary_condition "
+        f"WHERE condition_id IN ({conditions}) AND total_patients <= 0",
+        '''
+        UPDATE summary_condition_gender SET total = total - 1
+        FROM PatientCondition pc
+        WHERE pc.patient_id = OLD.patient_id
+          AND summary_condition_gender.condition_id = pc.condition_id
+          AND summary_condition_gender.gender IS OLD.gender
+        ''',
+        f"DELETE FROM summary_condition_gender "
+        f"WHERE condition_id IN ({conditions}) AND total <= 0",
+        '''
+        UPDATE summary_condition_blood SET total = total - 1
+        FROM PatientCondition pc
+        WHERE pc.patient_id = OLD.patient_id
+          AND summary_condition_blood.condition_id = pc.condition_id
+          AND summary_condition_blood.blood_type IS OLD.blood_type
+        ''',
+        f"DELETE FROM summary_condition_blood "
+        f"WHERE condition_id IN ({conditions}) AND total <= 0",
+        '''
+        UPDATE summary_hospital_condition SET total = total - 1
+        FROM PatientCondition pc
+        JOIN PatientHospital ph ON ph.patient_id = pc.patient_id
+        WHERE pc.patient_id = OLD.patient_id
+          AND summary_hospital_condition.hospital_id = ph.hospital_id
+          AND summary_hospital_condition.condition_id = pc.condition_id
+        ''',
+        f'''
+        DELETE FROM summary_hospital_condition
+        WHERE hospital_id IN (
+            SELECT hospital_id FROM PatientHospital WHERE patient_id = OLD.patient_id
+        )
+          AND condition_id IN ({conditions}) AND total <= 0
+        ''',
+    ]
+
+
+def triggers():
+    # name -> (trigger header, statements)
+    pc_cols = "patient_id, condition_id"
+    ph_cols = "patient_id, hospital_id"
+    pi_cols = "patient_id, vaccine_id"
+    return {
+        "trg_summary_pc_insert": (
+            "AFTER INSERT ON PatientCondition",
+            _patient_condition("NEW", +1),
+        ),
+        # skipped outright when the patient row is already gone (a
+        # cascade); trg_summary_patient_removed has done the work
+        "trg_summary_pc_delete": (
+            "AFTER DELETE ON PatientCondition "
+            "WHEN EXISTS (SELECT 1 FROM Patient WHERE patient_id = OLD.patient_id)",
+            _patient_condition("OLD", -1),
+        ),
+        "trg_summary_pc_update": (
+            f"AFTER UPDATE OF {pc_cols} ON PatientCondition",
+            _patient_condition("OLD", -1) + _patient_condition("NEW", +1),
+        ),
+        "trg_summary_ph_insert": (
+            "AFTER INSERT ON PatientHospital",
+            _patient_hospital("NEW", +1),
+        ),
+        "trg_summary_ph_delete": (
+            "AFTER DELETE ON PatientHospital "
+            "WHEN EXISTS (SELECT 1 FROM Patient WHERE patient_id = OLD.patient_id)",
+            _patient_hospital("OLD", -1),
+        ),
+        "trg_summary_ph_update": (
+            f"AFTER UPDATE OF {ph_cols} ON PatientHospital",
+            _patient_hospital("OLD", -1) + _patient_hospital("NEW", +1),
+        ),
+        "trg_summary_pi_insert": (
+            "AFTER INSERT ON PatientImmunization",
+            _patient_immunization("NEW", +1),
+        ),
+        "trg_summary_pi_delete": (
+            "AFTER DELETE ON PatientImmunization",
+            _patient_immunization("OLD", -1),
+        ),
+        "trg_summary_pi_update": (
+            f"AFTER UPDATE OF {pi_cols} ON PatientImmunization",
+            _patient_immunization("OLD", -1) + _patient_immunization("NEW", +1),
+        ),
+        "trg_summary_patient_insert": (
+            "AFTER INSERT ON Patient",
+            _patient_row("NEW", +1),
+        ),
+        "trg_summary_patient_delete": (
+            "AFTER DELETE ON Patient",
+            _patient_row("OLD", -1),
+        ),
+        "trg_summary_patient_removed": (
+            "BEFORE DELETE ON Patient",
+            _patient_removed(),
+        ),
+        "trg_summary_patient_update": (
+            "AFTER UPDATE OF birth_year, blood_type ON Patient",
+            _patient_row("OLD", -1) + _patient_row("NEW", +1),
+        ),
+        "trg_summary_patient_gender": (
+            "AFTER UPDATE OF gender ON Patient "
+            "WHEN OLD.gender IS NOT NEW.gender",
+            _patient_attribute("gender"),
+        ),
+        "trg_summary_patient_blood": (
+            "AFTER UPDATE OF blood_type ON Patient "
+            "WHEN OLD.blood_type IS NOT NEW.blood_type",
+            _patient_attribute("blood_type"),
+        ),
+        "trg_summary_patient_birth_year": (
+            "AFTER UPDATE OF birth_year ON Patient "
+            "WHEN OLD.birth_year IS NOT NEW.birth_year",
+            _patient_birth_year(),
+        ),
+    }
+
+
+# -------------------------------
+# INSTALL / REBUILD / CHECK
+# -------------------------------
+def install_triggers(conn):
+    # Idempotent; re-run after any migration that rebuilds a source table,
+    # since dropping a table drops its triggers.
+    for name, (header, statements) in triggers().items():
+        body = ";\n".join(s.strip() for s in statements)
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {header}\nBEGIN\n{body};\nEND")
+
+
+def drop_triggers(conn):
+    for name in triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def install(conn):
+    for create, _ in SUMMARIES.values():
+        conn.execute(create)
+    for sql in INDEXES:
+        conn.execute(sql)
+    install_triggers(conn)
+    rebuild(conn)
+
+
+def rebuild(conn):
+    for table, (_, live) in SUMMARIES.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {live}")
+
+
+def check(conn):
+    # summary table -> number of rows that differ from the live aggregate
+    mismatches = {}
+    for table, (_, live) in SUMMARIES.items():
+        diff = conn.execute(
+            f'''
+            SELECT COUNT(*) FROM (
+                SELECT * FROM (SELECT * FROM {table} EXCEPT {live})
+                UNION ALL
+                SELECT * FROM ({live} EXCEPT SELECT * FROM {table})
+            )
+            '''
+        ).fetchone()[0]
+        if diff:
+            mismatches[table] = diff
+    return mismatches
+
+
+if __name__ == "__main__":
+    import os
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "check"):
+        sys.exit("usage: python summaries.py rebuild|check [path/to/db.sqlite]")
+
+    default = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "healthcare_analytics.sqlite"
+    )
+    path = sys.argv[2] if len(sys.argv) > 2 else default
+    conn = sqlite3.connect(path)
+
+    if sys.argv[1] == "rebuild":
+        with conn:
+            rebuild(conn)
+        print("summary tables rebuilt")
+
+    mismatches = check(conn)
+    conn.close()
+    for table, diff in mismatches.items():
+        print(f"{table}: {diff} rows differ from the live aggregate")
+    if mismatches:
+        sys.exit(1)
+    print("summary tables match the live aggregates")
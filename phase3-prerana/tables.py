@@ -0,0 +1,358 @@
+import base64
+import json
+
+# -------------------------------
+# BROWSABLE TABLES
+# -------------------------------
+TABLE_WHITELIST = [
+    "Hospital",
+    "Doctor",
+    "Patient",
+    "Condition",          # actual table name is "Condition"
+    "Medication",
+    "Vaccine",
+    "PatientDoctor",
+    "PatientHospital",
+    "PatientCondition",
+    "PatientMedication",
+    "PatientImmunization",
+    "MedicationCondition",
+]
+
+
+class TableView:
+    # One browsable view of a table.
+    #   columns: [(label, sql expression)] shown to the user and filterable
+    #   keys:    [(sql expression, descending)] -- the ORDER BY, which must be
+    #            unique so it can double as the keyset pagination cursor
+    #   base:    the table whose size stands in for the view's row count
+
+    def __init__(self, name, from_sql, columns, keys, base):
+        self.name = name
+        self.from_sql = from_sql
+        self.columns = columns
+        self.keys = keys
+        self.base = base
+        self.labels = [label for label, _ in columns]
+        self.filterable = dict(columns)
+
+    def select_sql(self):
+        cols = [f"{expr} AS {label}" for label, expr in self.columns]
+        # key values ride along as hidden columns so the last row of a page
+        # can be turned into the cursor for the next one
+        cols += [f"{expr} AS _k{i}" for i, (expr, _) in enumerate(self.keys)]
+        return "SELECT " + ", ".join(cols) + " " + self.from_sql
+
+    def order_sql(self, reverse=False):
+        parts = []
+        for expr, desc in self.keys:
+            if reverse:
+                desc = not desc
+            parts.append(f"{expr} {'DESC' if desc else 'ASC'}")
+        return "ORDER BY " + ", ".join(parts)
+
+    def seek_sql(self, reverse=False):
+        # (k1, k2, ...) strictly after the cursor in this view's order,
+        # written out column by column because directions can be mixed
+        n = len(self.keys)
+        ors = []
+        for i in range(n):
+            terms = [f"{self.keys[j][0]} = ?" for j in range(i)]
+            expr, desc = self.keys[i]
+            if reverse:
+                desc = not desc
+            terms.append(f"{expr} {'<' if desc else '>'} ?")
+            ors.append("(" + " AND ".join(terms) + ")")
+
+        # the redundant bound on the leading key lets SQLite seek an index
+        lead, desc = self.keys[0]
+        if reverse:
+            desc = not desc
+        bound = f"{lead} {'<=' if desc else '>='} ?"
+        return f"{bound} AND ({' OR '.join(ors)})"
+
+    def seek_params(self, cursor):
+        params = [cursor[0]]
+        for i in range(len(self.keys)):
+            params += cursor[:i] + [cursor[i]]
+        return params
+
+
+def _simple(name, sql_table, columns, key):
+    return TableView(
+        name,
+        f"FROM {sql_table}",
+        [(c, c) for c in columns],
+        [(key, False)],
+        sql_table,
+    )
+
+
+VIEWS = {
+    "Hospital": _simple(
+        "Hospital", "Hospital", ["hospital_id", "name", "city"], "hospital_id"
+    ),
+    # Hide password; show hospital info instead
+    "Doctor": TableView(
+        "Doctor",
+        """
+        FROM Doctor d
+        JOIN Hospital h ON d.hospital_id = h.hospital_id
+        """,
+        [
+            ("doctor_id", "d.doctor_id"),
+            ("name", "d.name"),
+            ("specialty", "d.specialty"),
+            ("hospital_name", "h.name"),
+            ("hospital_city", "h.city"),
+        ],
+        [("d.name", False), ("d.doctor_id", False)],
+        "Doctor",
+    ),
+    "Patient": _simple(
+        "Patient",
+        "Patient",
+        ["patient_id", "medical_record_number", "birth_year", "gender", "blood_type"],
+        "patient_id",
+    ),
+    "Condition": _simple(
+        "Condition", '"Condition"', ["condition_id", "name"], "condition_id"
+    ),
+    "Medication": _simple(
+        "Medication", "Medication", ["medication_id", "name"], "medication_id"
+    ),
+    "Vaccine": _simple(
+        "Vaccine", "Vaccine", ["vaccine_id", "name"], "vaccine_id"
+    ),
+    "PatientDoctor": TableView(
+        "PatientDoctor",
+        """
+        FROM PatientDoctor pd
+        JOIN Patient p ON pd.patient_id = p.patient_id
+        JOIN Doctor d ON pd.doctor_id = d.doctor_id
+        JOIN Hospital h ON d.hospital_id = h.hospital_id
+        """,
+        [
+            ("patient_id", "pd.patient_id"),
+            ("medical_record_number", "p.medical_record_number"),
+            ("doctor_id", "pd.doctor_id"),
+            ("doctor_name", "d.name"),
+            ("doctor_specialty", "d.specialty"),
+            ("hospital_name", "h.name"),
+            ("hospital_city", "h.city"),
+        ],
+        # the order idx_doctor_name and idx_pd_doctor_patient (migration 7)
+        # read the join in, so no page has to sort it
+        [
+            ("d.name", False),
+            ("d.doctor_id", False),
+            ("pd.patient_id", False),
+        ],
+        "PatientDoctor",
+    ),
+    "PatientHospital": TableView(
+        "PatientHospital",
+        """
+        FROM PatientHospital ph
+        JOIN Patient p ON ph.patient_id = p.patient_id
+        JOIN Hospital h ON ph.hospital_id = h.hospital_id
+        """,
+        [
+            ("patient_id", "ph.patient_id"),
+            ("medical_record_number", "p.medical_record_number"),
+            ("hospital_id", "ph.hospital_id"),
+            ("hospital_name", "h.name"),
+            ("hospital_city", "h.city"),
+        ],
+        [
+            ("p.medical_record_number", False),
+            ("h.name", False),
+            ("ph.hospital_id", False),
+        ],
+        "PatientHospital",
+    ),
+    "PatientCondition": TableView(
+        "PatientCondition",
+        """
+        FROM PatientCondition pc
+        JOIN Patient p ON pc.patient_id = p.patient_id
+        JOIN "Condition" c ON pc.condition_id = c.condition_id
+        JOIN Doctor d ON pc.doctor_id = d.doctor_id
+        """,
+        [
+            ("patient_id", "pc.patient_id"),
+            ("medical_record_number", "p.medical_record_number"),
+            ("condition_name", "c.name"),
+            ("diagnosis_date", "pc.diagnosis_date"),
+            ("doctor_name", "d.name"),
+        ],
+        [
+            ("p.medical_record_number", False),
+            ("c.name", False),
+            ("IFNULL(pc.diagnosis_date, '')", True),
+            ("pc.condition_id", False),
+        ],
+        "PatientCondition",
+    ),
+    "PatientMedication": TableView(
+        "PatientMedication",
+        """
+        FROM PatientMedication pm
+        JOIN Patient p
+            ON pm.patient_id = p.patient_id
+        JOIN Medication m
+            ON pm.medication_id = m.medication_id
+        JOIN Doctor d
+            ON pm.doctor_id = d.doctor_id
+        LEFT JOIN "Condition" c
+            ON pm.condition_id = c.condition_id
+        """,
+        [
+            ("patient_id", "pm.patient_id"),
+            ("medical_record_number", "p.medical_record_number"),
+            ("medication_name", "m.name"),
+            ("condition_name", "c.name"),
+            ("prescription_date", "pm.prescription_date"),
+            ("doctor_name", "d.name"),
+        ],
+        [
+            ("p.medical_record_number", False),
+            ("IFNULL(pm.prescription_date, '')", True),
+            ("m.name", False),
+            ("pm.rowid", False),
+        ],
+        "PatientMedication",
+    ),
+    "PatientImmunization": TableView(
+        "PatientImmunization",
+        """
+        FROM PatientImmunization pi
+        JOIN Patient p ON pi.patient_id = p.patient_id
+        JOIN Vaccine v ON pi.vaccine_id = v.vaccine_id
+        """,
+        [
+            ("patient_id", "pi.patient_id"),
+            ("medical_record_number", "p.medical_record_number"),
+            ("vaccine_name", "v.name"),
+            ("admin_date", "pi.admin_date"),
+        ],
+        [
+            ("p.medical_record_number", False),
+            ("IFNULL(pi.admin_date, '')", True),
+            ("v.name", False),
+            ("pi.rowid", False),
+        ],
+        "PatientImmunization",
+    ),
+    "MedicationCondition": TableView(
+        "MedicationCondition",
+        """
+        FROM MedicationCondition mc
+        JOIN Medication m ON mc.medication_id = m.medication_id
+        JOIN "Condition" c ON mc.condition_id = c.condition_id
+        """,
+        [
+            ("medication_id", "mc.medication_id"),
+            ("medication_name", "m.name"),
+            ("condition_id", "mc.condition_id"),
+            ("condition_name", "c.name"),
+        ],
+        [
+            ("m.name", False),
+            ("c.name", False),
+            ("mc.medication_id", False),
+            ("mc.condition_id", False),
+        ],
+        "MedicationCondition",
+    ),
+}
+
+
+# -------------------------------
+# CURSORS
+# -------------------------------
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, n_keys):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != n_keys:
+        return None
+    # only what SQLite can bind: a crafted token must not reach execute()
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+# -------------------------------
+# QUERIES
+# -------------------------------
+def where_sql(view, filters, cursor=None, reverse=False):
+    # column filters are pushed down as equality tests on the underlying
+    # expression; unknown columns are ignored
+    clauses = []
+    params = []
+    for label, value in filters.items():
+        if label in view.filterable and value != "":
+            clauses.append(f"{view.filterable[label]} = ?")
+            params.append(value)
+    if cursor is not None:
+        clauses.append(view.seek_sql(reverse))
+        params += view.seek_params(cursor)
+    if not clauses:
+        return "", params
+    return "WHERE " + " AND ".join(clauses), params
+
+
+def fetch_page(conn, view, filters, page_size, after=None, before=None):
+    # Keyset pagination: every page is one index seek + LIMIT, so page N
+    # costs the same as page 1. Paging backwards runs the query in reverse
+    # order from the first row of the current page.
+    reverse = before is not None
+    cursor = before if reverse else after
+
+    where, params = where_sql(view, filters, cursor, reverse)
+    sql = f"{view.select_sql()} {where} {view.order_sql(reverse)} LIMIT ?"
+    rows = conn.execute(sql, params + [page_size + 1]).fetchall()
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor(row[f"_k{i}"] for i in range(len(view.keys)))
+
+    next_cursor = prev_cursor = None
+    if rows and reverse:
+        # we came back from a later page, so there is always a next one
+        next_cursor = key(rows[-1])
+        prev_cursor = key(rows[0]) if more else None
+    elif rows:
+        next_cursor = key(rows[-1]) if more else None
+        prev_cursor = key(rows[0]) if cursor is not None else None
+
+    return {
+        "rows": rows,
+        "columns": view.labels,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
+
+
+def approx_row_count(conn, view):
+    # The rowid span: two O(log n) probes of the table's b-tree, current
+    # after every insert, import or delete. An upper bound: rows deleted
+    # from the middle of the span still count. (sqlite_stat1 is only as
+    # fresh as the last ANALYZE.)
+    # (one subquery each: MIN and MAX in one SELECT scan the whole table)
+    low, high = conn.execute(
+        f"SELECT (SELECT MIN(rowid) FROM {view.base}), (SELECT MAX(rowid) FROM {view.base})"
+    ).fetchone()
+    return high - low + 1 if high is not None else 0
@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+sys.path.insert(0, APP_DIR)
+
+SHIPPED_DB = os.path.join(APP_DIR, "healthcare_analytics.sqlite")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # a private copy of the shipped database, brought up to date
+    import migrations
+
+    path = str(tmp_path / "healthcare_analytics.sqlite")
+    shutil.copy(SHIPPED_DB, path)
+    migrations.migrate(path)
+    return path
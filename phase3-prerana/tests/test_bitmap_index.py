@@ -0,0 +1,99 @@
+import random
+import sqlite3
+
+import pytest
+
+import bitmap_index
+import db
+
+
+def members(index):
+    return {
+        kind: {item: bitmap.ids() for item, bitmap in bitmaps.items() if len(bitmap)}
+        for kind, bitmaps in index.bitmaps.items()
+    }
+
+
+def sql_ids(conn, where):
+    return [row[0] for row in conn.execute(
+        f"SELECT patient_id FROM Patient WHERE {where} ORDER BY patient_id"
+    )]
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = db.ConnectionPool(db_path, size=2)
+    yield pool
+    pool.close_all()
+
+
+def test_bitmap_algebra():
+    a = bitmap_index.Bitmap.from_ids([1, 5, 70000, 200000])
+    b = bitmap_index.Bitmap.from_ids([5, 6, 200000])
+    assert (a & b).ids() == [5, 200000]
+    assert (a | b).ids() == [1, 5, 6, 70000, 200000]
+    assert (a - b).ids() == [1, 70000]
+    assert len(a) == 4 and 70000 in a and 6 not in a
+    a.difference_update(b)
+    assert a.ids() == [1, 70000]
+    a.update(b)
+    assert a.ids() == [1, 5, 6, 70000, 200000]
+    assert a.ids(limit=2) == [1, 5]
+
+
+def test_queries_match_sql(pool, db_path):
+    index = bitmap_index.BitmapIndex(pool)
+    conn = sqlite3.connect(db_path)
+    has = "patient_id IN (SELECT patient_id FROM {} WHERE {} = {})"
+    cases = {
+        "condition:1": has.format("PatientCondition", "condition_id", 1),
+        "NOT condition:1": "NOT " + has.format("PatientCondition", "condition_id", 1),
+        "condition:1 AND NOT (medication:2 OR vaccine:1)":
+            has.format("PatientCondition", "condition_id", 1) + " AND NOT ("
+            + has.format("PatientMedication", "medication_id", 2) + " OR "
+            + has.format("PatientImmunization", "vaccine_id", 1) + ")",
+        'condition:"type 2 diabetes" or condition:2':
+            "patient_id IN (SELECT pc.patient_id FROM PatientCondition pc "
+            "JOIN \"Condition\" c USING (condition_id) WHERE c.name = 'Type 2 Diabetes') OR "
+            + has.format("PatientCondition", "condition_id", 2),
+    }
+    for expression, where in cases.items():
+        assert index.query(expression).ids() == sql_ids(conn, where), expression
+
+
+@pytest.mark.parametrize("expression", [
+    "", "condition:1 AND", "(condition:1", "drug:1", "condition:nosuch", "condition:1 maybe",
+])
+def test_bad_expressions_raise_value_error(pool, expression):
+    with pytest.raises(ValueError):
+        bitmap_index.BitmapIndex(pool).query(expression)
+
+
+def test_refresh_after_writes_matches_a_fresh_load(pool, db_path):
+    index = bitmap_index.BitmapIndex(pool)
+    index.refresh()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    ids = [row[0] for row in conn.execute("SELECT patient_id FROM Patient")]
+    rng = random.Random(25)
+    for patient_id in rng.sample(ids, 5):
+        conn.execute("DELETE FROM PatientCondition WHERE patient_id = ?", (patient_id,))
+    for patient_id in rng.sample(ids, 5):
+        conn.execute("INSERT OR IGNORE INTO PatientImmunization (patient_id, vaccine_id) "
+                     "VALUES (?, 1)", (patient_id,))
+    conn.execute("DELETE FROM Patient WHERE patient_id = ?", (ids[0],))
+    new_id = conn.execute(
+        "INSERT INTO Patient (medical_record_number) VALUES ('BITMAP-1')"
+    ).lastrowid
+    conn.execute("INSERT INTO PatientCondition (patient_id, condition_id, doctor_id) VALUES (?, 1, 1)",
+                 (new_id,))
+    conn.commit()
+
+    index.refresh()
+    assert index.stats()["loads"] == 1  # rereads the changed patients only
+    fresh = bitmap_index.BitmapIndex(pool)
+    fresh.refresh()
+    assert members(index) == members(fresh)
+    assert index.patients.ids() == fresh.patients.ids()
+    assert new_id in index.query("condition:1")
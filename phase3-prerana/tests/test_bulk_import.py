@@ -0,0 +1,54 @@
+import io
+import json
+import sqlite3
+
+import bulk_import
+from app import create_app
+
+
+def ndjson(count, prefix):
+    return b"".join(
+        json.dumps({"mrn": f"{prefix}-{i}", "birth_year": 1980, "gender": "Female",
+                    "blood_type": "O+"}).encode() + b"\n"
+        for i in range(count)
+    )
+
+
+def test_undecodable_upload_reports_and_keeps_earlier_chunks(db_path):
+    app = create_app({"DATABASE": db_path, "IMPORT_CHUNK_SIZE": 50})
+    client = app.test_client()
+    client.post("/doctor_login", data={"doctor_id": "1", "password": "alice_pw"})
+    version = app.extensions["data_version"].value
+
+    # well past the TextIOWrapper's read size, then a Latin-1 byte
+    body = ndjson(400, "IMPORT") + b'{"mrn": "CAF\xe9"}\n'
+    response = client.post(
+        "/import_patients",
+        data={"file": (io.BytesIO(body), "patients.ndjson")},
+        headers={"Accept": "application/json"},
+    )
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["error_count"] == 1
+    assert "cannot read the file" in report["errors"][0]["error"]
+
+    conn = sqlite3.connect(db_path)
+    loaded = conn.execute(
+        "SELECT COUNT(*) FROM Patient WHERE medical_record_number LIKE 'IMPORT-%'"
+    ).fetchone()[0]
+    assert loaded == report["imported"]["patient"] > 0
+    assert app.extensions["data_version"].value != version  # analytics and charts were dropped
+    app.extensions["db_writer"].stop()
+
+
+def test_read_errors_end_the_import_with_a_report():
+    def records():
+        yield 1, "patient", {"mrn": "READ-1"}
+        raise OSError("connection reset")
+
+    loaded = []
+    importer = bulk_import.run(records(), lambda fn, chunk: loaded.extend(chunk))
+    assert [record[0] for record in loaded] == [1]
+    assert importer.errors == [
+        (2, "cannot read the file after line 1, the rest was not imported: connection reset")
+    ]
@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+import change_log
+import cohort_store
+import db
+from bitmap_index import BitmapIndex
+
+
+def add_patient(path, mrn):
+    conn = sqlite3.connect(path)
+    with conn:
+        patient_id = conn.execute(
+            "INSERT INTO Patient (medical_record_number) VALUES (?)", (mrn,)
+        ).lastrowid
+    conn.close()
+    return patient_id
+
+
+def test_writes_are_not_logged_until_a_reader_loads(db_path):
+    conn = sqlite3.connect(db_path)
+    assert not change_log.installed(conn)
+    add_patient(db_path, "UNLOGGED-1")
+    assert change_log.latest(conn) == 0
+
+    pool = db.ConnectionPool(db_path, size=1)
+    index = BitmapIndex(pool)
+    index.refresh()
+    assert change_log.installed(conn)
+    assert not change_log.ensure(conn)  # already there
+
+    patient_id = add_patient(db_path, "LOGGED-1")
+    assert change_log.since(conn, index.seq) == ({patient_id}, index.seq + 1)
+    pool.close_all()
+
+
+def test_readers_catch_up_through_the_log(db_path):
+    pool = db.ConnectionPool(db_path, size=1)
+    index = BitmapIndex(pool)
+    index.refresh()
+    patient_id = add_patient(db_path, "LOGGED-2")
+    index.refresh()
+    assert patient_id in index.patients
+    assert index.stats()["loads"] == 1
+    pool.close_all()
+
+
+@pytest.mark.skipif(cohort_store.np is None, reason="needs NumPy")
+def test_columnar_store_installs_the_triggers(db_path):
+    pool = db.ConnectionPool(db_path, size=1)
+    cohort_store.CohortStore(pool).refresh()
+    assert change_log.installed(sqlite3.connect(db_path))
+    pool.close_all()
+
+
+def test_trim_is_a_rowid_lookup_after_analyze_on_a_small_log(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    change_log.ensure(conn)  # writes the one reset entry
+    conn.execute("ANALYZE")
+    assert conn.execute(
+        "SELECT stat FROM sqlite_stat1 WHERE tbl = 'change_log'"
+    ).fetchone() == ("1",)
+
+    (_, statements), = [
+        body for name, body in change_log.triggers().items() if name == "trg_change_log_trim"
+    ]
+    trim = statements[0].replace("NEW.seq", "?")
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {trim}", (1,))]
+    assert plan == ["SEARCH change_log USING INTEGER PRIMARY KEY (rowid=?)"]
+
+
+def test_trim_keeps_the_last_entries(db_path, monkeypatch):
+    monkeypatch.setattr(change_log, "KEEP", 3)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    change_log.ensure(conn)
+    for _ in range(5):
+        change_log.reset(conn)
+    latest = change_log.latest(conn)
+    assert [seq for (seq,) in conn.execute("SELECT seq FROM change_log ORDER BY seq")] == [
+        latest - 2, latest - 1, latest
+    ]
+
+
+def test_ensure_replaces_an_outdated_trim(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    change_log.ensure(conn)
+    conn.execute("DROP TRIGGER trg_change_log_trim")
+    conn.execute(
+        "CREATE TRIGGER trg_change_log_trim AFTER INSERT ON change_log\n"
+        f"BEGIN\nDELETE FROM change_log WHERE seq <= NEW.seq - {change_log.KEEP};\nEND"
+    )
+    assert not change_log.installed(conn)
+    assert change_log.ensure(conn)
+    assert change_log.installed(conn)
@@ -0,0 +1,17 @@
+import sqlite3
+
+import change_log
+from generate_data import generate
+
+
+def test_generated_database_has_no_change_log_stats(tmp_path):
+    path = str(tmp_path / "generated.sqlite")
+    generate(path, 200)
+    conn = sqlite3.connect(path)
+    # the reset entry is there, but ANALYZE ran before it was written
+    assert conn.execute("SELECT patient_id FROM change_log").fetchall() == [(None,)]
+    assert conn.execute(
+        "SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'change_log'"
+    ).fetchone() == (0,)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    assert change_log.latest(conn) == 1
@@ -0,0 +1,52 @@
+import re
+
+import metrics
+from app import create_app
+
+
+def requests_total(text, endpoint):
+    return sum(
+        float(n) for n in re.findall(
+            rf'^healthcare_requests_total\{{endpoint="{re.escape(endpoint)}",[^}}]*\}} (\S+)$',
+            text, re.M,
+        )
+    )
+
+
+def test_metrics_add_up_every_worker_slot(db_path):
+    app = create_app({"DATABASE": db_path, "SHARED_METRICS": 2,
+                      "SHARED_METRICS_INTERVAL": 3600})
+    shared = app.extensions["shared_metrics"]
+    client = app.test_client()
+    try:
+        shared.start(app, 0)
+        for _ in range(3):
+            client.get("/healthz")
+
+        # another worker has served 5 health checks and holds 2 connections
+        with app.app_context():
+            other = shared.own(metrics.collect())
+        other["requests"]["views.healthz"]["statuses"] = {"200": 5}
+        other["pool"]["in_use"] = 2
+        shared._write(1, other)
+
+        text = client.get("/metrics").get_data(as_text=True)
+        assert requests_total(text, "views.healthz") == 8
+        assert "healthcare_workers 2" in text
+
+        # its replacement keeps the counters, not the gauges
+        carried = metrics._counters(shared._read(1))
+        assert carried["requests"]["views.healthz"]["statuses"] == {"200": 5}
+        assert "in_use" not in carried["pool"]
+    finally:
+        shared.stop(app)
+        app.extensions["db_writer"].stop()
+
+
+def test_single_process_metrics(db_path):
+    app = create_app({"DATABASE": db_path})
+    client = app.test_client()
+    client.get("/healthz")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert requests_total(text, "views.healthz") == 1
+    assert "healthcare_workers 1" in text
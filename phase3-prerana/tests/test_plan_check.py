@@ -0,0 +1,21 @@
+import plan_check
+
+# enough patients for the planner to prefer the indexes the rules expect
+PATIENTS = 3000
+
+
+def test_every_route_keeps_its_query_plans(tmp_path):
+    path = str(tmp_path / "plan_check.sqlite")
+    plan_check.build_database(path, PATIENTS)
+    problems, statements = plan_check.run(path)
+    assert statements > 100
+    assert problems == []
+
+
+def test_a_scan_of_a_patient_table_is_reported():
+    entries = [{
+        "sql": "SELECT * FROM PatientCondition pc WHERE pc.diagnosis_date = ?",
+        "plan": ["SCAN pc"],
+    }]
+    problems = plan_check.check("lookup", "single", entries)
+    assert len(problems) == 1 and "full scan" in problems[0]
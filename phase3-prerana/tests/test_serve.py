@@ -0,0 +1,41 @@
+import serve
+
+
+def stream(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    yield b"one\n"
+    yield b"two\n"
+
+
+def crash(environ, start_response):
+    raise RuntimeError("boom")
+
+
+def free_permits(gate, threads):
+    taken = 0
+    while taken < threads and gate.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        gate.release()
+    return taken
+
+
+def test_streamed_body_holds_its_permit_until_closed():
+    wsgi, gate = serve.limited(stream, 2)
+    body = wsgi({}, lambda status, headers: None)
+    assert free_permits(gate, 2) == 1
+    assert b"".join(body) == b"one\ntwo\n"
+    assert free_permits(gate, 2) == 1  # iterated, not yet closed
+    body.close()
+    assert free_permits(gate, 2) == 2
+    body.close()  # a second close() must not release twice
+    assert free_permits(gate, 2) == 2
+
+
+def test_app_error_releases_its_permit():
+    wsgi, gate = serve.limited(crash, 1)
+    try:
+        wsgi({}, lambda status, headers: None)
+    except RuntimeError:
+        pass
+    assert free_permits(gate, 1) == 1
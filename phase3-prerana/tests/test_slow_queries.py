@@ -0,0 +1,22 @@
+from slow_queries import redacted_params
+
+
+def test_every_value_of_an_mrn_in_list_is_redacted():
+    sql = ("SELECT * FROM Patient p WHERE p.medical_record_number IN ('A1', 'A2', 'x)y') "
+           "AND birth_year = 1980")
+    assert redacted_params(sql) == ["<redacted>"] * 3 + [1980]
+
+
+def test_not_in_lists_and_other_in_lists():
+    sql = ("SELECT * FROM Patient WHERE medical_record_number NOT IN ('A1',\n'A2') "
+           "AND patient_id IN (1, 2) AND gender = 'Female'")
+    assert redacted_params(sql) == ["<redacted>", "<redacted>", 1, 2, "Female"]
+
+
+def test_comparisons_and_inserts_are_redacted():
+    assert redacted_params(
+        "SELECT patient_id FROM Patient WHERE medical_record_number = 'A1'"
+    ) == ["<redacted>"]
+    assert redacted_params(
+        "INSERT INTO Patient (medical_record_number, birth_year) VALUES ('A1', 1980)"
+    ) == ["<redacted>", 1980]
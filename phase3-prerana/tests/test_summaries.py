@@ -0,0 +1,82 @@
+import random
+import sqlite3
+
+import summaries
+from app import create_app
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def test_migrated_database_is_consistent(db_path):
+    assert summaries.check(connect(db_path)) == {}
+
+
+def test_route_writes_keep_the_summaries_consistent(db_path):
+    app = create_app({"DATABASE": db_path})
+    client = app.test_client()
+    client.post("/doctor_login", data={"doctor_id": "1", "password": "alice_pw"})
+    form = {"mrn": "SUMMARY-1", "birth_year": "1980", "gender": "Female", "blood_type": "O-"}
+    steps = [
+        ("/add_patient", form),
+        ("/add_condition", {"mrn": "SUMMARY-1", "condition_id": "1", "diagnosis_date": ""}),
+        ("/add_condition", {"mrn": "SUMMARY-1", "condition_id": "2", "diagnosis_date": ""}),
+        ("/update_patient", dict(form, birth_year="1955", blood_type="AB+")),
+        ("/add_vaccine", {"mrn": "SUMMARY-1", "vaccine_id": "1", "admin_date": "2024-01-01"}),
+        ("/delete_patient", {"mrn": "SUMMARY-1"}),
+    ]
+    conn = connect(db_path)
+    for url, data in steps:
+        assert client.post(url, data=data).status_code < 400, url
+        assert summaries.check(conn) == {}, url
+    app.extensions["db_writer"].stop()
+
+
+def test_random_writes_keep_the_summaries_consistent(db_path):
+    conn = connect(db_path)
+    rng = random.Random(18)
+    patients = [row[0] for row in conn.execute("SELECT patient_id FROM Patient")]
+    conditions = [row[0] for row in conn.execute('SELECT condition_id FROM "Condition"')]
+    hospitals = [row[0] for row in conn.execute("SELECT hospital_id FROM Hospital")]
+    for step in range(60):
+        patient_id = rng.choice(patients)
+        action = rng.randrange(6)
+        with conn:
+            if action == 0:
+                conn.execute(
+                    "INSERT OR IGNORE INTO PatientCondition (patient_id, condition_id, doctor_id) "
+                    "VALUES (?, ?, 1)", (patient_id, rng.choice(conditions)))
+            elif action == 1:
+                conn.execute("DELETE FROM PatientCondition WHERE patient_id = ?", (patient_id,))
+            elif action == 2:
+                conn.execute(
+                    "INSERT OR IGNORE INTO PatientHospital (patient_id, hospital_id) VALUES (?, ?)",
+                    (patient_id, rng.choice(hospitals)))
+            elif action == 3:
+                conn.execute(
+                    "UPDATE Patient SET gender = ?, blood_type = ?, birth_year = ? "
+                    "WHERE patient_id = ?",
+                    (rng.choice(["Male", "Female", None]), rng.choice(["A+", "O-", None]),
+                     rng.choice([1950, 1990, None]), patient_id))
+            elif action == 4:
+                conn.execute(
+                    "UPDATE PatientCondition SET condition_id = ? "
+                    "WHERE rowid = (SELECT rowid FROM PatientCondition WHERE patient_id = ? LIMIT 1)"
+                    " AND NOT EXISTS (SELECT 1 FROM PatientCondition WHERE patient_id = ? "
+                    "AND condition_id = ?)",
+                    (c := rng.choice(conditions), patient_id, patient_id, c))
+            elif len(patients) > 5:
+                conn.execute("DELETE FROM Patient WHERE patient_id = ?", (patient_id,))
+                patients.remove(patient_id)
+        assert summaries.check(conn) == {}, (step, action)
+
+
+def test_check_reports_a_drifted_summary(db_path):
+    conn = connect(db_path)
+    with conn:
+        conn.execute("UPDATE summary_condition SET total_patients = total_patients + 1 "
+                     "WHERE condition_id = 1")
+    assert summaries.check(conn) == {"summary_condition": 2}
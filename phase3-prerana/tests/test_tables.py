@@ -0,0 +1,61 @@
+import sqlite3
+
+import tables
+
+
+def test_approx_row_count_follows_writes(db_path):
+    conn = sqlite3.connect(db_path)
+    view = tables.VIEWS["Patient"]
+    before = tables.approx_row_count(conn, view)
+    assert before >= conn.execute("SELECT COUNT(*) FROM Patient").fetchone()[0]
+
+    conn.executemany("INSERT INTO Patient (medical_record_number) VALUES (?)",
+                     [(f"COUNT-{i}",) for i in range(25)])
+    assert tables.approx_row_count(conn, view) == before + 25
+
+    conn.execute("DELETE FROM Patient WHERE medical_record_number LIKE 'COUNT-%'")
+    assert tables.approx_row_count(conn, view) == before
+
+
+def test_approx_row_count_of_an_empty_table(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM MedicationCondition")
+    assert tables.approx_row_count(conn, tables.VIEWS["MedicationCondition"]) == 0
+
+
+def test_crafted_cursor_falls_back_to_the_first_page(db_path):
+    import base64
+    import json
+
+    from app import create_app
+
+    token = base64.urlsafe_b64encode(json.dumps([[1], {"a": 1}]).encode()).decode()
+    assert tables.decode_cursor(token, 2) is None
+    assert tables.decode_cursor(tables.encode_cursor(["a", 1.5]), 2) == ["a", 1.5]
+
+    app = create_app({"DATABASE": db_path})
+    client = app.test_client()
+    client.post("/doctor_login", data={"doctor_id": "1", "password": "alice_pw"})
+    response = client.post("/browse_tables", data={"table_name": "Doctor", "after": token})
+    assert response.status_code == 200
+    app.extensions["db_writer"].stop()
+
+
+def test_patient_doctor_pages_follow_an_index(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    view = tables.VIEWS["PatientDoctor"]
+    page = tables.fetch_page(conn, view, {}, 50)
+    seen = [(row["doctor_id"], row["patient_id"]) for row in page["rows"]]
+    while page["next_cursor"]:
+        after = tables.decode_cursor(page["next_cursor"], len(view.keys))
+        where, params = tables.where_sql(view, {}, after)
+        sql = f"{view.select_sql()} {where} {view.order_sql()} LIMIT ?"
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params + [51])]
+        assert not any("TEMP B-TREE" in line for line in plan), plan
+        page = tables.fetch_page(conn, view, {}, 50, after=after)
+        seen += [(row["doctor_id"], row["patient_id"]) for row in page["rows"]]
+    # every row once, whatever the page boundaries
+    assert sorted(seen) == sorted(
+        tuple(row) for row in conn.execute("SELECT doctor_id, patient_id FROM PatientDoctor")
+    )
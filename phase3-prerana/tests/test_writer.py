@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db
+
+
+def insert_patient(conn, mrn):
+    return conn.execute(
+        "INSERT INTO Patient (medical_record_number) VALUES (?)", (mrn,)
+    ).lastrowid
+
+
+def count_patients(path, mrn):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM Patient WHERE medical_record_number = ?", (mrn,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def submit_in_thread(writer, fn, *args):
+    # writer.submit() blocks; run it on a thread so a hang fails the test
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = writer.submit(fn, *args)
+        except BaseException as exc:
+            outcome["error"] = exc
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def test_locked_database_fails_the_job_and_keeps_the_writer_running(db_path):
+    writer = db.Writer(db_path, busy_timeout_ms=100)
+    try:
+        holder = sqlite3.connect(db_path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        thread, outcome = submit_in_thread(writer, insert_patient, "LOCKED-1")
+        thread.join(10)
+        assert not thread.is_alive(), "submit() hung on a locked database"
+        assert isinstance(outcome.get("error"), sqlite3.OperationalError)
+        assert "locked" in str(outcome["error"])
+        holder.execute("ROLLBACK")
+        holder.close()
+
+        # the same writer thread takes the next job once the lock is gone
+        assert writer.submit(insert_patient, "AFTER-LOCK-1")
+        assert writer._thread.is_alive()
+        assert count_patients(db_path, "AFTER-LOCK-1") == 1
+        assert count_patients(db_path, "LOCKED-1") == 0
+        assert writer.stats()["failed"] == 1
+    finally:
+        writer.stop()
+
+
+def test_failing_job_rolls_back_alone(db_path):
+    writer = db.Writer(db_path, window_ms=200)
+
+    def fail(conn):
+        insert_patient(conn, "FAILED-1")
+        raise ValueError("job failed")
+
+    try:
+        first, ok = submit_in_thread(writer, insert_patient, "BATCHED-1")
+        second, failed = submit_in_thread(writer, fail)
+        first.join(10)
+        second.join(10)
+        assert "result" in ok
+        assert isinstance(failed.get("error"), ValueError)
+        assert count_patients(db_path, "BATCHED-1") == 1
+        assert count_patients(db_path, "FAILED-1") == 0
+    finally:
+        writer.stop()
+
+
+def test_constraint_error_reaches_the_caller(db_path):
+    writer = db.Writer(db_path)
+    try:
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.submit(
+                lambda conn: conn.execute(
+                    "INSERT INTO PatientCondition (patient_id, condition_id) VALUES (?, 1)",
+                    (10 ** 9,),
+                )
+            )
+        assert writer.submit(insert_patient, "AFTER-CONSTRAINT-1")
+        assert writer.stats()["failed"] == 1
+    finally:
+        writer.stop()
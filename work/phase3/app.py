@@ -1,4 +1,5 @@
 from flask import Flask, render_template, request, redirect, session
+import os
 import sqlite3
 
 app = Flask(__name__,
@@ -215,4 +216,7 @@ def logout():
 
 # -------------------------------
 if __name__ == "__main__":
-    app.run(debug=True)
+    # threaded and without the debugger/reloader unless FLASK_DEBUG=1;
+    # the maintained server is phase3-prerana/serve.py
+    debug = os.environ.get("FLASK_DEBUG") == "1"
+    app.run(debug=debug, threaded=True, use_reloader=debug)